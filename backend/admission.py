@@ -0,0 +1,206 @@
+# admission.py
+
+import os
+import math
+import time
+import asyncio
+import threading
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, Optional
+from metrics import ADMISSION_WAIT_SECONDS, ADMISSION_REJECTED
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Admission control for chat turns. Voice and text turns have separate
+# slot pools, so cheap text turns never wait behind Whisper work. Each pool
+# queues a bounded number of waiters (FIFO). A request is turned away right
+# away with 503 when the queue is full or its predicted wait is over the
+# limit. Each user_id also has a token bucket (429 when it is empty). Both
+# rejections carry Retry-After.
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() == "true"
+ADMISSION_LIMITS = {
+    "text": {
+        "concurrency": int(os.getenv("ADMISSION_TEXT_CONCURRENCY", "16")),
+        "queue": int(os.getenv("ADMISSION_TEXT_QUEUE", "64")),
+        "max_wait": float(os.getenv("ADMISSION_TEXT_MAX_WAIT_S", "10")),
+    },
+    "voice": {
+        "concurrency": int(os.getenv("ADMISSION_VOICE_CONCURRENCY", "4")),
+        "queue": int(os.getenv("ADMISSION_VOICE_QUEUE", "16")),
+        "max_wait": float(os.getenv("ADMISSION_VOICE_MAX_WAIT_S", "20")),
+    },
+}
+# Per-user token bucket: USER_RATE_PER_MINUTE tokens refill per minute up to
+# USER_RATE_BURST; a text turn takes 1 token, a voice turn VOICE_TOKEN_COST.
+# USER_RATE_PER_MINUTE=0 disables per-user limits.
+USER_RATE_PER_MINUTE = float(os.getenv("USER_RATE_PER_MINUTE", "30"))
+USER_RATE_BURST = float(os.getenv("USER_RATE_BURST", "10"))
+VOICE_TOKEN_COST = float(os.getenv("VOICE_TOKEN_COST", "3"))
+# WebSocket voice: speech segments one socket may have transcribing or
+# waiting for the STT stage at once.
+WS_MAX_PENDING_SEGMENTS = int(os.getenv("WS_MAX_PENDING_SEGMENTS", "2"))
+_MAX_TRACKED_USERS = 10000
+
+class AdmissionRejected(Exception):
+    """Raised instead of queueing; the API maps it to 429 or 503."""
+
+    def __init__(self, status: int, reason: str, retry_after: float, endpoint_class: str):
+        super().__init__(f"{endpoint_class} request rejected: {reason}")
+        self.status = status
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+        self.endpoint_class = endpoint_class
+
+# --------- 1. Per-User Token Buckets ------
+class UserRateLimiter:
+    def __init__(self, rate_per_minute: float = USER_RATE_PER_MINUTE, burst: float = USER_RATE_BURST,
+                 max_users: int = _MAX_TRACKED_USERS):
+        self.rate = rate_per_minute / 60
+        self.burst = burst
+        self.max_users = max_users
+        self._buckets: "OrderedDict[str, list]" = OrderedDict()  # user -> [tokens, last refill]
+        self._lock = threading.Lock()
+
+    def take(self, user_id: str, cost: float = 1.0) -> float:
+        """Take `cost` tokens. Returns 0 on success, otherwise the seconds
+        until enough tokens will be available."""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.pop(user_id, None) or [self.burst, now]
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            self._buckets[user_id] = bucket  # most recently used last
+            if len(self._buckets) > self.max_users:
+                self._buckets.popitem(last=False)
+            if bucket[0] >= cost:
+                bucket[0] -= cost
+                return 0.0
+            return (min(cost, self.burst) - bucket[0]) / self.rate
+
+# --------- 2. Bounded Slot Pools ----------
+class EndpointQueue:
+    """`concurrency` slots plus a FIFO of at most `queue_size` waiters.
+    Must be used from a single event loop (the API server's)."""
+
+    def __init__(self, name: str, concurrency: int, queue_size: int, max_wait: float):
+        self.name = name
+        self.concurrency = max(1, concurrency)
+        self.queue_size = queue_size
+        self.max_wait = max_wait
+        self.active = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._service = 1.0  # EWMA of seconds a slot is held
+        self._stats = {"admitted": 0, "rejected_full": 0, "rejected_wait": 0, "timed_out": 0}
+
+    def expected_wait(self, position: int) -> float:
+        """Predicted wait for the waiter at `position` (0 = next in line)."""
+        return (position // self.concurrency + 1) * self._service if self.active >= self.concurrency else 0.0
+
+    async def acquire(self) -> float:
+        """Wait for a slot; returns the seconds spent waiting."""
+        if self.active < self.concurrency and not self._waiters:
+            self.active += 1
+            self._stats["admitted"] += 1
+            return 0.0
+        position = len(self._waiters)
+        if position >= self.queue_size:
+            self._stats["rejected_full"] += 1
+            raise AdmissionRejected(503, "queue_full", self.expected_wait(position), self.name)
+        predicted = self.expected_wait(position)
+        if predicted > self.max_wait:
+            self._stats["rejected_wait"] += 1
+            raise AdmissionRejected(503, "predicted_wait", predicted, self.name)
+
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.append(fut)
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(asyncio.shield(fut), self.max_wait)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if fut.done() and not fut.cancelled():
+                self._release_slot()  # the slot was handed over just as we gave up
+            else:
+                fut.cancel()
+                self._waiters.remove(fut)
+            if isinstance(e, asyncio.TimeoutError):
+                self._stats["timed_out"] += 1
+                raise AdmissionRejected(503, "wait_timeout", self.expected_wait(len(self._waiters)), self.name)
+            raise
+        self._stats["admitted"] += 1
+        return time.perf_counter() - start
+
+    def release(self, held_seconds: float):
+        self._service += 0.2 * (held_seconds - self._service)
+        self._release_slot()
+
+    def _release_slot(self):
+        # Hand the slot straight to the next live waiter
+        while self._waiters:
+            fut = self._waiters.popleft()
+            if not fut.done():
+                fut.set_result(None)
+                return
+        self.active -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(self._stats, active=self.active, queued=len(self._waiters),
+                    concurrency=self.concurrency, mean_service_seconds=round(self._service, 3))
+
+# --------- 3. Controller ------------------
+class Ticket:
+    """An admitted request; release() frees its slot (safe to call twice)."""
+
+    def __init__(self, queue: Optional[EndpointQueue], wait_seconds: float):
+        self.queue = queue
+        self.wait_seconds = wait_seconds
+        self._start = time.perf_counter()
+        self._released = False
+
+    @property
+    def wait_ms(self) -> float:
+        return round(self.wait_seconds * 1000, 1)
+
+    def release(self):
+        if self._released or self.queue is None:
+            return
+        self._released = True
+        self.queue.release(time.perf_counter() - self._start)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.release()
+
+class AdmissionController:
+    def __init__(self, limits: Dict[str, Dict[str, Any]] = ADMISSION_LIMITS, enabled: bool = ADMISSION_ENABLED):
+        self.enabled = enabled
+        self.queues = {name: EndpointQueue(name, l["concurrency"], l["queue"], l["max_wait"]) for name, l in limits.items()}
+        self.limiter = UserRateLimiter()
+        self.costs = {"text": 1.0, "voice": VOICE_TOKEN_COST}
+
+    async def admit(self, endpoint_class: str, user_id: str) -> Ticket:
+        """Rate-limit the user, then wait for a slot in the class's pool.
+        Raises AdmissionRejected instead of queueing past the limits."""
+        if not self.enabled:
+            return Ticket(None, 0.0)
+        retry_after = self.limiter.take(user_id, self.costs.get(endpoint_class, 1.0))
+        if retry_after:
+            ADMISSION_REJECTED.labels(endpoint_class, "rate_limited").inc()
+            raise AdmissionRejected(429, "rate_limited", retry_after, endpoint_class)
+        queue = self.queues[endpoint_class]
+        try:
+            wait = await queue.acquire()
+        except AdmissionRejected as e:
+            ADMISSION_REJECTED.labels(endpoint_class, e.reason).inc()
+            raise
+        ADMISSION_WAIT_SECONDS.labels(endpoint_class).observe(wait)
+        return Ticket(queue, wait)
+
+    def stats(self) -> Dict[str, Any]:
+        return {name: queue.stats() for name, queue in self.queues.items()}
+
+admission = AdmissionController()
@@ -0,0 +1,164 @@
+# analytics_log.py
+
+import os
+import gzip
+import json
+import time
+import queue
+import atexit
+import shutil
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Per-turn analytics records (emotion, valence/arousal, latencies, token
+# counts). Callers only enqueue; a background thread batches the writes,
+# rotates files by size and age and optionally gzips closed segments.
+ANALYTICS_LOG_ENABLED = os.getenv("ANALYTICS_LOG_ENABLED", "true").lower() == "true"
+TURN_LOG_FILE = os.getenv("TURN_LOG_FILE", "turn_log.jsonl")
+EMOTION_LOG_FILE = os.getenv("EMOTION_LOG_FILE", "emotion_log.jsonl")
+ANALYTICS_LOG_MAX_MB = float(os.getenv("ANALYTICS_LOG_MAX_MB", "50"))
+ANALYTICS_LOG_ROTATE_HOURS = float(os.getenv("ANALYTICS_LOG_ROTATE_HOURS", "24"))
+ANALYTICS_LOG_GZIP = os.getenv("ANALYTICS_LOG_GZIP", "true").lower() == "true"
+ANALYTICS_LOG_FLUSH_SECONDS = float(os.getenv("ANALYTICS_LOG_FLUSH_SECONDS", "1.0"))
+# Records waiting for the writer; beyond this new records are dropped
+# (and counted) rather than slowing down turns.
+ANALYTICS_LOG_QUEUE = int(os.getenv("ANALYTICS_LOG_QUEUE", "10000"))
+
+_STOP = object()
+
+class BufferedLogWriter:
+    """JSONL writer fed through a queue and flushed by one background thread.
+
+    A batch is written when ANALYTICS_LOG_FLUSH_SECONDS pass or `batch_size`
+    records are waiting. The active file is rotated to
+    `<name>.<YYYYmmdd-HHMMSS>.jsonl[.gz]` once it exceeds max_bytes or
+    gets older than rotate_seconds. close() (also run at exit) drains the
+    queue before returning."""
+
+    def __init__(self, path: str, max_bytes: int = int(ANALYTICS_LOG_MAX_MB * 1024 * 1024),
+                 rotate_seconds: float = ANALYTICS_LOG_ROTATE_HOURS * 3600,
+                 compress: bool = ANALYTICS_LOG_GZIP, flush_seconds: float = ANALYTICS_LOG_FLUSH_SECONDS,
+                 batch_size: int = 500, maxsize: int = ANALYTICS_LOG_QUEUE):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.rotate_seconds = rotate_seconds
+        self.compress = compress
+        self.flush_seconds = flush_seconds
+        self.batch_size = batch_size
+        self._queue: "queue.Queue[Any]" = queue.Queue(maxsize=maxsize)
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+        self._opened_at: Optional[float] = None
+        self._stats = {"written": 0, "dropped": 0, "batches": 0, "rotations": 0, "errors": 0}
+
+    # --------- Producer side ---------
+    def log(self, record: Dict[str, Any]):
+        """Enqueue one record; never blocks and never raises."""
+        if self._closed:
+            return
+        self._ensure_started()
+        record.setdefault("timestamp", datetime.utcnow().isoformat())
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self._stats["dropped"] += 1
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=f"log-{os.path.basename(self.path)}", daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+
+    def close(self, timeout: float = 10.0):
+        """Write everything still queued and stop the writer thread."""
+        if self._closed:
+            return
+        self._closed = True
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(self._stats, pending=self._queue.qsize())
+
+    # --------- Writer thread ---------
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch: List[Dict[str, Any]] = []
+            deadline = time.monotonic() + self.flush_seconds
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    # Pick up anything enqueued before close()
+                    while True:
+                        try:
+                            item = self._queue.get_nowait()
+                        except queue.Empty:
+                            break
+                        if item is not _STOP:
+                            batch.append(item)
+                    break
+                batch.append(item)
+            if batch:
+                self._write(batch)
+
+    def _write(self, batch: List[Dict[str, Any]]):
+        try:
+            self._maybe_rotate()
+            data = "".join(json.dumps(record, default=str) + "\n" for record in batch)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(data)
+            self._stats["written"] += len(batch)
+            self._stats["batches"] += 1
+        except Exception as e:
+            self._stats["errors"] += 1
+            print(f"⚠️ Could not write {len(batch)} records to {self.path}: {e}")
+
+    def _maybe_rotate(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            self._opened_at = time.time()
+            return
+        if self._opened_at is None:
+            # File left by a previous run: age it from its last write
+            self._opened_at = st.st_mtime
+        if st.st_size < self.max_bytes and time.time() - self._opened_at < self.rotate_seconds:
+            return
+        base, ext = os.path.splitext(self.path)
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        rotated, n = f"{base}.{stamp}{ext}", 1
+        while os.path.exists(rotated) or os.path.exists(rotated + ".gz"):
+            rotated, n = f"{base}.{stamp}-{n}{ext}", n + 1
+        os.replace(self.path, rotated)
+        self._opened_at = time.time()
+        self._stats["rotations"] += 1
+        if self.compress:
+            with open(rotated, "rb") as src, gzip.open(rotated + ".gz", "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            os.remove(rotated)
+
+# --------- Shared writers ---------
+turn_log = BufferedLogWriter(TURN_LOG_FILE)
+emotion_log = BufferedLogWriter(EMOTION_LOG_FILE)
+
+def log_turn(record: Dict[str, Any]):
+    if ANALYTICS_LOG_ENABLED:
+        turn_log.log(record)
+
+def close_all():
+    turn_log.close()
+    emotion_log.close()
@@ -1,12 +1,33 @@
-from fastapi import FastAPI, UploadFile, File, Request, Form
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, UploadFile, File, Request, Form, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, StreamingResponse, Response, PlainTextResponse
+from starlette.background import BackgroundTask
 from fastapi.middleware.cors import CORSMiddleware
 import numpy as np
-import soundfile as sf
-import io
-from orchestrator import chatbot
+import json
+import time
+import asyncio
+import logging
+from orchestrator import chatbot, FUSED_LLM_CALL
 from main import load_user_profile, save_user_profile
-from pydub import AudioSegment
+from concurrency import run_stage
+from emotion_test import sentiment_batcher
+from condition_pipeline import get_condition_pipeline
+from model_registry import registry, WARMUP_MODELS, REQUIRED_MODELS, MODEL_SERVER_ADDRESS
+from result_cache import all_cache_stats
+from audio_io import spool_upload, decode_to_pcm16k, ffmpeg_available, UploadTooLarge, TARGET_SR
+from emotion_detector import atranscribe_clip
+from stt_tiering import policy as stt_policy
+from admission import admission, AdmissionRejected, WS_MAX_PENDING_SEGMENTS
+from llm_gateway import gateway_stats
+from user_context import user_contexts
+from vad_stream import StreamingVAD
+from model_server import ModelServerBusy, get_model_client
+from analytics_log import log_turn, turn_log, emotion_log, close_all as close_analytics_logs
+from context_builder import count_tokens
+from metrics import (
+    HTTP_SECONDS, HTTP_REQUESTS, PROFILER_SAMPLE_HZ,
+    render_metrics, register_stats, new_trace_id, log_event, profiler, trace_id_var,
+)
 
 app = FastAPI()
 
@@ -19,6 +40,117 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Per-request trace ID (X-Request-ID, generated if absent), latency metrics
+# and one structured log line per request. For streaming responses the
+# latency is time to first byte.
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    trace_id = new_trace_id(request.headers.get("x-request-id"))
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        response.headers["X-Request-ID"] = trace_id
+        return response
+    finally:
+        elapsed = time.perf_counter() - start
+        route = request.scope.get("route")
+        path = getattr(route, "path", "unmatched")
+        HTTP_SECONDS.labels(request.method, path).observe(elapsed)
+        HTTP_REQUESTS.labels(request.method, path, str(status)).inc()
+        log_event("request", method=request.method, path=path, status=status, duration_ms=round(elapsed * 1000, 1))
+
+@app.exception_handler(ModelServerBusy)
+async def model_server_busy(request: Request, exc: ModelServerBusy):
+    # Shared model server is at capacity: shed load instead of queueing
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "1"})
+
+@app.exception_handler(AdmissionRejected)
+async def admission_rejected(request: Request, exc: AdmissionRejected):
+    # 429: this user's token bucket is empty; 503: the endpoint class is full
+    return JSONResponse(
+        status_code=exc.status,
+        content={"detail": str(exc), "reason": exc.reason},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+# Existing counters, exported as gauges on /metrics
+register_stats("sentiment_batcher", sentiment_batcher.stats)
+register_stats("condition_queue", lambda: get_condition_pipeline().stats())
+register_stats("cache", all_cache_stats)
+register_stats("stt_tiering", stt_policy.stats)
+register_stats("admission", admission.stats)
+register_stats("llm_gateway", gateway_stats)
+register_stats("user_context", user_contexts.stats)
+register_stats("analytics_log", lambda: {"turn": turn_log.stats(), "emotion": emotion_log.stats()})
+
+@app.on_event("startup")
+async def startup():
+    if PROFILER_SAMPLE_HZ > 0:
+        profiler.start()
+    # Drain transcripts left in the queue by a previous run
+    get_condition_pipeline().start()
+    # Load configured models in the background; /readyz reports progress
+    if WARMUP_MODELS:
+        asyncio.get_running_loop().run_in_executor(None, registry.warmup, WARMUP_MODELS)
+
+@app.on_event("shutdown")
+async def shutdown():
+    profiler.stop()
+    await run_stage("profile", get_condition_pipeline().stop)
+    # Flush buffered analytics records before the process exits
+    await run_stage("profile", close_analytics_logs)
+
+@app.get("/healthz")
+async def healthz():
+    """Liveness: the process is up, with per-model load state"""
+    return {"status": "ok", "models": registry.status()}
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness: every model in REQUIRED_MODELS is loaded, and ffmpeg is
+    installed when Whisper is required (non-WAV uploads need it)"""
+    models = registry.status()
+    missing = [name for name in REQUIRED_MODELS if not registry.is_loaded(name)]
+    ffmpeg = ffmpeg_available()
+    if not ffmpeg and any(name.startswith("whisper") for name in REQUIRED_MODELS):
+        missing.append("ffmpeg")
+    body = {"ready": not missing, "missing": missing, "models": models, "ffmpeg": ffmpeg}
+    return JSONResponse(content=body, status_code=200 if not missing else 503)
+
+@app.get("/stats")
+async def stats():
+    """Throughput counters for the inference services"""
+    return {
+        "sentiment_batcher": sentiment_batcher.stats(),
+        "condition_queue": await run_stage("profile", get_condition_pipeline().stats),
+        "caches": all_cache_stats(),
+        "stt_tiering": stt_policy.stats(),
+        "admission": admission.stats(),
+        "llm_gateway": gateway_stats(),
+        "user_context": user_contexts.stats(),
+        "model_server": await run_stage("profile", get_model_client().stats) if MODEL_SERVER_ADDRESS else None,
+    }
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus exposition: node/stage latency histograms, stage errors,
+    HTTP metrics and the /stats counters"""
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+@app.get("/debug/profile")
+async def debug_profile(limit: int = 200, reset: bool = False):
+    """Collapsed stacks from the sampling profiler (PROFILER_SAMPLE_HZ > 0),
+    one "frame;frame;frame count" line each, ready for flamegraph.pl"""
+    if PROFILER_SAMPLE_HZ <= 0:
+        raise HTTPException(status_code=404, detail="Profiler disabled; set PROFILER_SAMPLE_HZ")
+    body = profiler.collapsed(limit)
+    if reset:
+        profiler.reset()
+    return PlainTextResponse(body)
+
 @app.post("/check-user")
 async def check_user(request: Request):
     """Check if user exists and return profile status"""
@@ -28,7 +160,7 @@ async def check_user(request: Request):
     if not user_id:
         return JSONResponse(content={"error": "User ID is required"}, status_code=400)
     
-    profile = load_user_profile(user_id)
+    profile = await run_stage("profile", load_user_profile, user_id)
     
     if profile:
         return {
@@ -53,12 +185,12 @@ async def create_profile(request: Request):
         return JSONResponse(content={"error": "User ID, name, and age are required"}, status_code=400)
     
     # Check if user already exists
-    existing_profile = load_user_profile(user_id)
+    existing_profile = await run_stage("profile", load_user_profile, user_id)
     if existing_profile:
         return JSONResponse(content={"error": "User already exists"}, status_code=409)
     
     # Create new profile
-    save_user_profile(user_id, name, age)
+    await run_stage("profile", save_user_profile, user_id, name, age)
     
     return {
         "success": True,
@@ -70,50 +202,289 @@ async def create_profile(request: Request):
         }
     }
 
-@app.post("/text")
-async def handle_text(request: Request):
-    data = await request.json()
+def text_inputs(data: dict):
     messages = data.get("messages", [])
-    user_id = data.get("user_id", "default_user")
     if not messages:
-        return JSONResponse(content={"answer": "No message received"}, status_code=400)
-    
+        return None
     last_message = messages[-1].get("content", "")
-    inputs = {
+    return {
         "user_input": {
             "type": "text",
             "content": last_message
         }
     }
-    final_state = chatbot.invoke(inputs, config={"configurable": {"thread_id": user_id}})
+
+def record_turn(endpoint: str, user_id: str, state: dict, started: float, queue_wait_ms: float = None):
+    """Queue one analytics record for a finished turn (written in the
+    background by analytics_log; transcripts and replies are not logged)."""
+    answer = state.get("bot_response") or ""
+    log_turn({
+        "trace_id": trace_id_var.get(),
+        "endpoint": endpoint,
+        "user_id": user_id,
+        "emotion": state.get("emotion"),
+        "valence": state.get("valence"),
+        "arousal": state.get("arousal"),
+        "timings": state.get("timings", {}),
+        "stt_tier": state.get("stt_tier"),
+        "queue_wait_ms": queue_wait_ms,
+        "total_ms": round((time.perf_counter() - started) * 1000, 1),
+        "prompt_tokens": state.get("prompt_tokens"),
+        "response_tokens": count_tokens(answer),
+    })
+
+@app.post("/text")
+async def handle_text(request: Request, response: Response):
+    started = time.perf_counter()
+    data = await request.json()
+    user_id = data.get("user_id", "default_user")
+    inputs = text_inputs(data)
+    if inputs is None:
+        return JSONResponse(content={"answer": "No message received"}, status_code=400)
+
+    async with await admission.admit("text", user_id) as ticket:
+        final_state = await chatbot.ainvoke(inputs, config={"configurable": {"thread_id": user_id}})
+    response.headers["X-Queue-Wait-Ms"] = str(ticket.wait_ms)
+    record_turn("text", user_id, final_state, started, ticket.wait_ms)
     bot_response = final_state.get("bot_response", "I'm here to listen.")
-    return {"answer": bot_response}
+    return {"answer": bot_response, "prompt_tokens": final_state.get("prompt_tokens")}
 
-@app.post("/voice")
-async def handle_audio(file: UploadFile = File(...), user_id: str = Form("default_user")):
-    contents = await file.read()
-    audio_bytes = io.BytesIO(contents)
-    filename = file.filename.lower()
-    # Convert webm to wav if needed
-    if filename.endswith(".webm"):
-        audio_segment = AudioSegment.from_file(audio_bytes, format="webm")
-        # Resample to 16000 Hz
-        audio_segment = audio_segment.set_frame_rate(16000)
-        wav_io = io.BytesIO()
-        audio_segment.export(wav_io, format="wav")
-        wav_io.seek(0)
-        audio, sr = sf.read(wav_io)
-    else:
-        audio, sr = sf.read(audio_bytes)
-    inputs = {
+async def voice_inputs(file: UploadFile):
+    # Read the upload with a size cap, then decode once to 16 kHz mono float32
+    try:
+        spool = await spool_upload(file)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    try:
+        with spool:
+            audio = await run_stage("decode", decode_to_pcm16k, spool, file.filename or "")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {
         "user_input": {
             "type": "audio",
             "content": audio,
-            "sr": sr,
+            "sr": TARGET_SR,
             "filename": file.filename
         }
     }
-    final_state = chatbot.invoke(inputs, config={"configurable": {"thread_id": user_id}})
+
+@app.post("/voice")
+async def handle_audio(response: Response, file: UploadFile = File(...), user_id: str = Form("default_user")):
+    started = time.perf_counter()
+    # Admit before decoding: decode and Whisper are the expensive part
+    async with await admission.admit("voice", user_id) as ticket:
+        inputs = await voice_inputs(file)
+        final_state = await chatbot.ainvoke(inputs, config={"configurable": {"thread_id": user_id}})
+    response.headers["X-Queue-Wait-Ms"] = str(ticket.wait_ms)
+    record_turn("voice", user_id, final_state, started, ticket.wait_ms)
     bot_response = final_state.get("bot_response", "I'm here to listen.")
     transcript = final_state.get("transcript", "[No transcript]")
-    return {"answer": bot_response, "transcript": transcript} 
\ No newline at end of file
+    return {
+        "answer": bot_response,
+        "transcript": transcript,
+        "stt_tier": final_state.get("stt_tier"),
+        "prompt_tokens": final_state.get("prompt_tokens"),
+    }
+
+# --------- Streaming (Server-Sent Events) ---------
+# Event order: "meta" (transcript + emotion, once detect_emotion finishes),
+# then one "token" per LLM chunk, then "done" with the full answer. The
+# generate_response node still persists the completed message to memory.
+def sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def turn_events(inputs: dict, user_id: str, endpoint: str, queue_wait_ms: float = None):
+    """Run one graph turn, yielding (event, data) as results become available."""
+    started = time.perf_counter()
+    config = {"configurable": {"thread_id": user_id}}
+    turn = {}
+    async for event in chatbot.astream_events(inputs, config=config, version="v2"):
+        kind = event["event"]
+        if kind == "on_chain_end" and event["name"] == "detect_emotion":
+            state = event["data"]["output"]
+            turn.update(state)
+            yield "meta", {
+                "transcript": state.get("transcript", ""),
+                "emotion": state.get("emotion"),
+                "valence": state.get("valence"),
+                "arousal": state.get("arousal"),
+                "timings": state.get("timings", {}),
+                "stt_tier": state.get("stt_tier"),
+            }
+        # In fused mode the model streams JSON, so the reply only arrives with "done"
+        elif kind == "on_chat_model_stream" and not FUSED_LLM_CALL and event.get("metadata", {}).get("langgraph_node") == "generate_response":
+            token = event["data"]["chunk"].content
+            if token:
+                yield "token", {"token": token}
+        elif kind == "on_chain_end" and event["name"] == "generate_response":
+            state = event["data"]["output"]
+            turn.update(state)
+            record_turn(endpoint, user_id, turn, started, queue_wait_ms)
+            yield "done", {"answer": state.get("bot_response", "I'm here to listen."), "prompt_tokens": state.get("prompt_tokens")}
+
+async def stream_turn(inputs: dict, user_id: str, endpoint: str, ticket):
+    try:
+        async for event, data in turn_events(inputs, user_id, endpoint, ticket.wait_ms):
+            yield sse(event, data)
+    except Exception as e:
+        log_event("turn_failed", level=logging.ERROR, user_id=user_id, error=str(e))
+        yield sse("error", {"error": str(e)})
+    finally:
+        ticket.release()
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+def stream_response(inputs: dict, user_id: str, endpoint: str, ticket) -> StreamingResponse:
+    # The admission slot is held until the stream ends. The background task
+    # also frees it if the client disconnects before streaming starts.
+    return StreamingResponse(
+        stream_turn(inputs, user_id, endpoint, ticket),
+        media_type="text/event-stream",
+        headers={**SSE_HEADERS, "X-Queue-Wait-Ms": str(ticket.wait_ms)},
+        background=BackgroundTask(ticket.release),
+    )
+
+@app.post("/text/stream")
+async def handle_text_stream(request: Request):
+    data = await request.json()
+    user_id = data.get("user_id", "default_user")
+    inputs = text_inputs(data)
+    if inputs is None:
+        return JSONResponse(content={"answer": "No message received"}, status_code=400)
+    ticket = await admission.admit("text", user_id)
+    return stream_response(inputs, user_id, "text/stream", ticket)
+
+@app.post("/voice/stream")
+async def handle_audio_stream(file: UploadFile = File(...), user_id: str = Form("default_user")):
+    ticket = await admission.admit("voice", user_id)
+    try:
+        inputs = await voice_inputs(file)
+    except BaseException:
+        ticket.release()
+        raise
+    return stream_response(inputs, user_id, "voice/stream", ticket)
+
+# --------- Real-time voice (WebSocket) ---------
+# Protocol: the client streams binary PCM16 little-endian, 16 kHz mono frames
+# as they are recorded, and may send {"type": "end"} to force end of speech.
+# The server runs webrtcvad incrementally, transcribes each speech segment as
+# soon as it closes ({"type": "partial"}), and starts the LangGraph turn the
+# moment end of speech is detected ({"type": "final"}, then the same
+# meta/token/done events as the SSE endpoints).
+background_tasks = set()  # strong refs so running turns are not GC'd
+
+@app.websocket("/ws/voice")
+async def voice_socket(websocket: WebSocket, user_id: str = "default_user"):
+    new_trace_id(websocket.headers.get("x-request-id"))
+    await websocket.accept()
+    send_lock = asyncio.Lock()
+    closed = False
+
+    async def send(message: dict):
+        # A turn that is already running finishes (and is saved to memory)
+        # even if the client has gone away, so drop sends after disconnect.
+        nonlocal closed
+        if closed:
+            return
+        async with send_lock:
+            try:
+                await websocket.send_json(message)
+            except (WebSocketDisconnect, RuntimeError):
+                closed = True
+
+    detector = StreamingVAD(sr=TARGET_SR)
+    segments = []  # (audio, transcription task) for the current utterance
+    turn_task = None
+    # Segments run under the STT stage limit only; this bounds the socket's
+    # share of it. Admission is charged once per utterance, in run_turn.
+    segment_slots = asyncio.Semaphore(WS_MAX_PENDING_SEGMENTS)
+
+    async def transcribe_segment(index: int, audio: np.ndarray):
+        async with segment_slots:
+            text, tier = await atranscribe_clip(audio, TARGET_SR)
+        await send({"type": "partial", "segment": index, "text": text, "stt_tier": tier})
+        return text, tier
+
+    def drop(utterance):
+        for _, task in utterance:
+            task.cancel()
+        return send({"type": "final", "transcript": "", "dropped": True})
+
+    async def run_turn(utterance, previous_turn):
+        if previous_turn is not None:
+            await previous_turn  # keep turns in order for this user
+        # End of speech: admit the utterance as one voice turn, the same
+        # charge as a /voice upload
+        try:
+            ticket = await admission.admit("voice", user_id)
+        except AdmissionRejected as e:
+            await send({"type": "error", "error": str(e), "reason": e.reason, "retry_after": e.retry_after})
+            await drop(utterance)
+            return
+        try:
+            results = await asyncio.gather(*(task for _, task in utterance), return_exceptions=True)
+            failed = [r for r in results if isinstance(r, BaseException)]
+            if failed:
+                for r in failed:
+                    log_event("segment_failed", level=logging.ERROR, user_id=user_id, error=str(r))
+                await drop(utterance)
+                return
+            transcript = " ".join(text for text, _ in results if text)
+            tiers = [tier for _, tier in results]
+            await send({"type": "final", "transcript": transcript})
+            if not transcript:
+                return
+            inputs = {
+                "user_input": {
+                    "type": "audio",
+                    "content": np.concatenate([audio for audio, _ in utterance]),
+                    "sr": TARGET_SR,
+                    "filename": "websocket",
+                    "transcript": transcript,
+                    # Segments may have been decoded by different tiers
+                    "stt_tier": ",".join(sorted(set(tiers), key=tiers.index)),
+                }
+            }
+            async for event, data in turn_events(inputs, user_id, "ws/voice", ticket.wait_ms):
+                await send({"type": event, **data})
+        except Exception as e:
+            log_event("turn_failed", level=logging.ERROR, user_id=user_id, error=str(e))
+            await send({"type": "error", "error": str(e)})
+        finally:
+            ticket.release()
+
+    async def handle(events):
+        nonlocal segments, turn_task
+        for kind, audio in events:
+            if kind == "segment":
+                task = asyncio.create_task(transcribe_segment(len(segments), audio))
+                segments.append((audio, task))
+            elif kind == "end" and segments:
+                turn_task = asyncio.create_task(run_turn(segments, turn_task))
+                background_tasks.add(turn_task)
+                turn_task.add_done_callback(background_tasks.discard)
+                segments = []
+
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            if message.get("bytes"):
+                await handle(detector.feed(message["bytes"]))
+            elif message.get("text"):
+                try:
+                    control = json.loads(message["text"])
+                    kind = control.get("type")
+                except (ValueError, AttributeError):
+                    await send({"type": "error", "error": "control frames must be JSON objects"})
+                    continue
+                if kind == "end":
+                    await handle(detector.flush())
+    except WebSocketDisconnect:
+        pass
+    finally:
+        closed = True
+        for _, task in segments:
+            task.cancel()
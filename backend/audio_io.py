@@ -0,0 +1,114 @@
+# audio_io.py
+
+import io
+import os
+import math
+import shutil
+import tempfile
+import subprocess
+import threading
+import numpy as np
+import soundfile as sf
+from typing import BinaryIO, Union
+from fastapi import UploadFile
+from metrics import timed
+
+TARGET_SR = 16000  # Whisper and webrtcvad both want 16 kHz mono
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(25 * 1024 * 1024)))
+# Uploads up to this size stay in memory; larger ones spill to a temp file.
+UPLOAD_SPOOL_BYTES = int(os.getenv("UPLOAD_SPOOL_BYTES", str(1024 * 1024)))
+UPLOAD_CHUNK_BYTES = 64 * 1024
+
+class UploadTooLarge(Exception):
+    pass
+
+# --------- 1. Upload Spooling -------------
+async def spool_upload(file: UploadFile, max_bytes: int = MAX_UPLOAD_BYTES) -> tempfile.SpooledTemporaryFile:
+    """Copy an upload into a SpooledTemporaryFile chunk by chunk, raising
+    UploadTooLarge as soon as it exceeds max_bytes."""
+    spool = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_BYTES)
+    total = 0
+    while True:
+        chunk = await file.read(UPLOAD_CHUNK_BYTES)
+        if not chunk:
+            break
+        total += len(chunk)
+        if total > max_bytes:
+            spool.close()
+            raise UploadTooLarge(f"Upload exceeds {max_bytes} bytes")
+        spool.write(chunk)
+    spool.seek(0)
+    return spool
+
+# --------- 2. Decoding --------------------
+def resample(audio: np.ndarray, sr: int, target_sr: int = TARGET_SR) -> np.ndarray:
+    """Polyphase resampling; its low-pass filter keeps 44.1/48 kHz content
+    above 8 kHz from aliasing into the speech band."""
+    if sr == target_sr:
+        return audio
+    from scipy.signal import resample_poly
+    g = math.gcd(int(sr), int(target_sr))
+    return resample_poly(audio, target_sr // g, int(sr) // g).astype(np.float32)
+
+def ffmpeg_available() -> bool:
+    return shutil.which("ffmpeg") is not None
+
+def _ffmpeg_decode(src: BinaryIO) -> np.ndarray:
+    """Decode with ffmpeg, streaming the source to its stdin in chunks (a
+    writer thread feeds stdin while the decoded PCM is read from stdout)."""
+    try:
+        proc = subprocess.Popen(
+            [
+                "ffmpeg", "-nostdin", "-loglevel", "error",
+                "-i", "pipe:0",
+                "-f", "f32le", "-acodec", "pcm_f32le", "-ac", "1", "-ar", str(TARGET_SR),
+                "pipe:1",
+            ],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+    except FileNotFoundError:
+        raise ValueError("ffmpeg is not installed, so only WAV/FLAC/OGG audio can be decoded")
+
+    def feed():
+        try:
+            for chunk in iter(lambda: src.read(UPLOAD_CHUNK_BYTES), b""):
+                proc.stdin.write(chunk)
+        except (BrokenPipeError, ValueError):
+            pass  # ffmpeg stopped reading; its exit status reports why
+        finally:
+            try:
+                proc.stdin.close()
+            except BrokenPipeError:
+                pass
+
+    writer = threading.Thread(target=feed, name="ffmpeg-feed", daemon=True)
+    writer.start()
+    pcm = proc.stdout.read()
+    stderr = proc.stderr.read()
+    writer.join()
+    if proc.wait() != 0:
+        raise ValueError(f"ffmpeg could not decode audio: {stderr.decode(errors='ignore').strip()}")
+    return np.frombuffer(pcm, dtype=np.float32)
+
+@timed("decode")
+def decode_to_pcm16k(src: Union[bytes, BinaryIO], filename: str = "") -> np.ndarray:
+    """Decode an uploaded clip to 16 kHz mono float32 in one pass.
+
+    WAV/FLAC/OGG files are read by soundfile straight from the (spooled)
+    file and resampled if needed; everything else (webm/opus, mp3) is
+    streamed through ffmpeg, which decodes, downmixes and resamples in a
+    single step. File objects are never read into memory as a whole."""
+    if isinstance(src, bytes):
+        src = io.BytesIO(src)
+    if not filename.lower().endswith(".webm"):
+        start = src.tell()
+        try:
+            audio, sr = sf.read(src, dtype="float32", always_2d=True)
+        except RuntimeError:
+            src.seek(start)
+            return _ffmpeg_decode(src)
+        audio = audio.mean(axis=1) if audio.shape[1] > 1 else audio[:, 0]
+        return resample(np.ascontiguousarray(audio, dtype=np.float32), sr, TARGET_SR)
+    return _ffmpeg_decode(src)
@@ -0,0 +1,270 @@
+# batch_analyze.py
+
+import os
+import sys
+import json
+import time
+import argparse
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Dict, Iterator, List, Set
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Offline emotion/condition analysis of recording and transcript archives:
+#
+#   python batch_analyze.py ../frontend/mockserver/uploads --out results.jsonl
+#   python batch_analyze.py --manifest recordings.jsonl --out results.parquet --workers 4 --conditions
+#
+# Each worker process loads its own copy of the models once (initializer),
+# results are written as they complete, and re-running the same command
+# skips items already present in the output.
+
+AUDIO_EXTENSIONS = {".webm", ".wav", ".mp3", ".ogg", ".flac", ".m4a"}
+TEXT_EXTENSIONS = {".txt"}
+# Nested fields stored as JSON strings in Parquet output
+NESTED_FIELDS = ("pauses", "acoustic", "timings", "conditions")
+
+# --------- 1. Inputs ----------------------
+def walk_directory(root: str) -> Iterator[Dict[str, Any]]:
+    for dirpath, _, filenames in os.walk(root):
+        for name in sorted(filenames):
+            path = os.path.join(dirpath, name)
+            ext = os.path.splitext(name)[1].lower()
+            if ext in AUDIO_EXTENSIONS:
+                yield {"id": os.path.relpath(path, root), "path": path, "type": "audio"}
+            elif ext in TEXT_EXTENSIONS:
+                yield {"id": os.path.relpath(path, root), "path": path, "type": "text"}
+
+def read_manifest(path: str) -> Iterator[Dict[str, Any]]:
+    """JSONL with {"path": ...} (audio or .txt) or {"id": ..., "text": ...}
+    per line; a plain list of paths also works."""
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path) as f:
+        for n, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads(line) if line.startswith("{") else {"path": line}
+            if "text" in entry:
+                yield {"id": str(entry.get("id", f"line-{n}")), "type": "text", "text": entry["text"]}
+                continue
+            item_path = entry["path"] if os.path.isabs(entry["path"]) else os.path.join(base, entry["path"])
+            ext = os.path.splitext(item_path)[1].lower()
+            yield {
+                "id": str(entry.get("id", entry["path"])),
+                "path": item_path,
+                "type": "text" if ext in TEXT_EXTENSIONS else "audio",
+            }
+
+# --------- 2. Worker ----------------------
+def init_worker(threads: int, models: List[str]):
+    """Per-process setup: cap intra-op threads so workers don't oversubscribe
+    the CPU, then load this worker's model copies."""
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[var] = str(threads)
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    from model_registry import registry
+    registry.warmup(models)
+
+def analyze_item(item: Dict[str, Any], stt_tier: str) -> Dict[str, Any]:
+    from emotion_detector import detect_emotion
+    from audio_io import decode_to_pcm16k, TARGET_SR
+
+    record = {"id": item["id"], "path": item.get("path"), "type": item["type"]}
+    start = time.perf_counter()
+    try:
+        if item["type"] == "audio":
+            with open(item["path"], "rb") as f:
+                audio = decode_to_pcm16k(f, item["path"])
+            record["duration_s"] = round(len(audio) / TARGET_SR, 3)
+            # Archives are not latency-bound: always use the pinned tier
+            result = detect_emotion({"type": "audio", "content": audio, "sr": TARGET_SR}, stt_tier=stt_tier)
+        else:
+            text = item.get("text")
+            if text is None:
+                with open(item["path"], encoding="utf-8") as f:
+                    text = f.read().strip()
+            result = detect_emotion({"type": "text", "content": text})
+        record.update(result)
+    except Exception as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+    record["seconds"] = round(time.perf_counter() - start, 3)
+    record["analyzed_at"] = datetime.now().isoformat()
+    return record
+
+# --------- 3. Output ----------------------
+class JSONLWriter:
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "a", encoding="utf-8")
+
+    def done_ids(self, retry_errors: bool) -> Set[str]:
+        done = set()
+        if not os.path.exists(self.path):
+            return done
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # partial line from an interrupted run
+                if not (retry_errors and record.get("error")):
+                    done.add(record["id"])
+        return done
+
+    def write(self, records: List[Dict[str, Any]]):
+        for record in records:
+            self._file.write(json.dumps(record, default=float) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+class ParquetWriter:
+    """A directory of part files, one per flush, so every flush is durable
+    and an interrupted run loses at most the unflushed records."""
+
+    def __init__(self, path: str):
+        import pyarrow  # noqa: F401  (optional dependency, fail before any work)
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self._part = len([n for n in os.listdir(path) if n.endswith(".parquet")])
+
+    def _parts(self) -> List[str]:
+        return sorted(os.path.join(self.path, n) for n in os.listdir(self.path) if n.endswith(".parquet"))
+
+    def done_ids(self, retry_errors: bool) -> Set[str]:
+        import pyarrow.parquet as pq
+        done = set()
+        for part in self._parts():
+            table = pq.read_table(part, columns=["id", "error"])
+            for record_id, error in zip(table.column("id").to_pylist(), table.column("error").to_pylist()):
+                if not (retry_errors and error):
+                    done.add(record_id)
+        return done
+
+    def write(self, records: List[Dict[str, Any]]):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        rows = []
+        for record in records:
+            row = dict(record)
+            row.setdefault("error", None)
+            for field in NESTED_FIELDS:
+                if field in row:
+                    row[field] = json.dumps(row[field], default=float)
+            rows.append(row)
+        tmp = os.path.join(self.path, f".part-{self._part:05d}.tmp")
+        pq.write_table(pa.Table.from_pylist(rows), tmp)
+        os.replace(tmp, os.path.join(self.path, f"part-{self._part:05d}.parquet"))
+        self._part += 1
+
+    def close(self):
+        pass
+
+def open_writer(path: str):
+    if not path.endswith(".parquet"):
+        return JSONLWriter(path)
+    try:
+        return ParquetWriter(path)
+    except ImportError:
+        raise SystemExit("❌ Parquet output needs pyarrow (pip install pyarrow), or use a .jsonl path")
+
+# --------- 4. Runner ----------------------
+def add_conditions(records: List[Dict[str, Any]]):
+    """One batched extraction call for the transcripts of a flush."""
+    from profile_manager import extract_conditions_batch
+    pending = [r for r in records if r.get("transcript") and "error" not in r]
+    if not pending:
+        return
+    try:
+        for record, conditions in zip(pending, extract_conditions_batch([r["transcript"] for r in pending])):
+            record["conditions"] = conditions
+    except Exception as e:
+        print(f"⚠️ Condition extraction failed: {e}")
+
+def run(args) -> int:
+    items = read_manifest(args.manifest) if args.manifest else walk_directory(args.input)
+    writer = open_writer(args.out)
+    done = writer.done_ids(args.retry_errors)
+    todo = [item for item in items if item["id"] not in done]
+    print(f"📝 {len(todo)} items to analyze ({len(done)} already in {args.out})")
+    if not todo:
+        return 0
+
+    from model_registry import WHISPER_MODEL, whisper_name
+    stt_tier = args.whisper or WHISPER_MODEL
+    # "whisper"/"whisper_batched" in --models mean the pinned size
+    aliases = {"whisper": whisper_name(stt_tier), "whisper_batched": whisper_name(stt_tier, batched=True)}
+    models = [aliases.get(m, m) for m in args.models.split(",") if m]
+    buffer: List[Dict[str, Any]] = []
+    completed = failed = 0
+    start = time.perf_counter()
+
+    def flush():
+        nonlocal buffer
+        if args.conditions:
+            add_conditions(buffer)
+        writer.write(buffer)
+        buffer = []
+
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker,
+                             initargs=(args.threads, models)) as pool:
+        queue = iter(todo)
+        in_flight = set()
+        try:
+            while True:
+                # Keep a bounded number of items in flight so results stream out
+                while len(in_flight) < args.workers * 2:
+                    item = next(queue, None)
+                    if item is None:
+                        break
+                    in_flight.add(pool.submit(analyze_item, item, stt_tier))
+                if not in_flight:
+                    break
+                finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    record = future.result()
+                    completed += 1
+                    failed += "error" in record
+                    buffer.append(record)
+                if len(buffer) >= args.flush_every:
+                    flush()
+                    rate = completed / (time.perf_counter() - start)
+                    print(f"✅ {completed}/{len(todo)} done ({failed} failed, {rate:.2f} items/s)")
+        finally:
+            # Interrupted or not, keep whatever finished
+            if buffer:
+                flush()
+            writer.close()
+    print(f"✅ Finished {completed} items in {time.perf_counter() - start:.1f}s ({failed} failed)")
+    return 1 if failed else 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch emotion/condition analysis of recordings and transcripts")
+    parser.add_argument("input", nargs="?", help="directory to scan for audio (.webm, .wav, ...) and .txt files")
+    parser.add_argument("--manifest", help="JSONL manifest instead of a directory")
+    parser.add_argument("--out", required=True, help="results .jsonl file, or .parquet directory")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    parser.add_argument("--threads", type=int, default=2, help="intra-op threads per worker")
+    parser.add_argument("--models", default="whisper,whisper_batched,smile,sentiment",
+                        help="models each worker loads up front")
+    parser.add_argument("--whisper", help="Whisper size for every file (default WHISPER_MODEL); "
+                        "the real-time tiering policy is not used offline")
+    parser.add_argument("--conditions", action="store_true", help="also extract conditions with the LLM")
+    parser.add_argument("--flush-every", type=int, default=8, help="records per write")
+    parser.add_argument("--retry-errors", action="store_true", help="re-run items that failed previously")
+    args = parser.parse_args()
+    if not args.input and not args.manifest:
+        parser.error("give a directory or --manifest")
+    sys.exit(run(args))
+
+if __name__ == "__main__":
+    main()
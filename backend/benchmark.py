@@ -0,0 +1,478 @@
+# benchmark.py
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import platform
+import resource
+import threading
+import tempfile
+import subprocess
+import contextlib
+import numpy as np
+from typing import Any, Dict, List, Optional
+
+# Offline benchmark for the chatbot graph and the API endpoints.
+#
+#   python benchmark.py --out bench.json                  # real local models, fake LLM
+#   python benchmark.py --fake-models --out bench.json    # no model weights needed
+#   python benchmark.py --compare base.json bench.json    # diff two runs
+#
+# The Azure LLM is always replaced by FakeAzureChat (fixed latency + jitter,
+# canned replies), so runs are offline and repeatable. All state (chat
+# memory, profile DB, condition queue) lives in a temporary directory.
+
+STAGE_PERCENTILES = (50, 95, 99)
+# The working directory moves to a scratch dir, so pin the backend modules
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# --------- 1. Stand-ins -------------------
+def make_fake_llm(latency_ms: float = 300, jitter_ms: float = 50, chunk_ms: float = 10, seed: int = 0):
+    """A chat model with AzureChatOpenAI's interface and deterministic output.
+
+    The answer depends on which prompt it receives: the fused-mode JSON
+    reply, (batched) condition extraction, the rolling summary, or a plain
+    reply that is streamed word by word."""
+    import re
+    from langchain_core.language_models.chat_models import BaseChatModel
+    from langchain_core.messages import AIMessage, AIMessageChunk
+    from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+    reply = "I'm sorry you're not feeling well. Rest, drink plenty of water and see a doctor if it gets worse."
+    conditions = ["headache", "fever"]
+    rng = random.Random(seed)
+
+    class FakeAzureChat(BaseChatModel):
+        @property
+        def _llm_type(self) -> str:
+            return "fake-azure-chat"
+
+        def _delay(self) -> float:
+            return max(0.0, latency_ms + rng.uniform(-jitter_ms, jitter_ms)) / 1000
+
+        def _answer(self, messages) -> str:
+            prompt = "\n".join(str(m.content) for m in messages)
+            if '{"reply"' in prompt:
+                return json.dumps({"reply": reply, "conditions": conditions})
+            if '{"results"' in prompt:
+                indexes = [int(n) for n in re.findall(r'^(\d+)\. "', prompt, flags=re.M)]
+                return json.dumps({"results": [{"index": i, "conditions": conditions} for i in indexes]})
+            if '{"conditions"' in prompt:
+                return json.dumps({"conditions": conditions})
+            if "Updated summary:" in prompt:
+                return "The user reported a headache and fever; advised rest and fluids."
+            return reply
+
+        def _message(self, messages, content: str) -> AIMessage:
+            prompt_tokens = sum(len(str(m.content)) for m in messages) // 4
+            return AIMessage(content=content, usage_metadata={
+                "input_tokens": prompt_tokens,
+                "output_tokens": len(content) // 4,
+                "total_tokens": prompt_tokens + len(content) // 4,
+            })
+
+        def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+            time.sleep(self._delay())
+            return ChatResult(generations=[ChatGeneration(message=self._message(messages, self._answer(messages)))])
+
+        async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+            await asyncio.sleep(self._delay())
+            return ChatResult(generations=[ChatGeneration(message=self._message(messages, self._answer(messages)))])
+
+        async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+            await asyncio.sleep(self._delay())
+            for word in self._answer(messages).split(" "):
+                await asyncio.sleep(chunk_ms / 1000)
+                chunk = ChatGenerationChunk(message=AIMessageChunk(content=word + " "))
+                if run_manager:
+                    await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+                yield chunk
+
+    return FakeAzureChat()
+
+class FakeSentiment:
+    """Deterministic [neg, neu, pos] probabilities; ~1 ms per text."""
+    version = "fake"
+
+    def predict(self, texts: List[str]) -> np.ndarray:
+        time.sleep(0.001 * len(texts))
+        out = []
+        for text in texts:
+            r = random.Random(text)
+            p = np.array([r.random(), r.random(), r.random()], dtype=np.float32)
+            out.append(p / p.sum())
+        return np.stack(out)
+
+class _Segment:
+    def __init__(self, text: str):
+        self.text = text
+
+class FakeWhisper:
+    """Sleeps for rtf x audio duration and returns a fixed sentence."""
+
+    def __init__(self, rtf: float = 0.05):
+        self.rtf = rtf
+
+    def transcribe(self, audio, clip_timestamps=None, **kwargs):
+        if clip_timestamps:
+            # Like faster_whisper's collect_chunks: bounds are sample indices
+            for c in clip_timestamps:
+                assert isinstance(c["start"], int) and isinstance(c["end"], int), "clip bounds must be sample indices"
+                assert 0 <= c["start"] < c["end"] <= len(audio), "clip bounds out of range"
+            seconds = sum(c["end"] - c["start"] for c in clip_timestamps) / 16000
+        else:
+            seconds = len(audio) / 16000
+        time.sleep(self.rtf * seconds)
+        return [_Segment(" I have had a headache and a fever since yesterday.")], None
+
+class _Functionals:
+    def __init__(self, row: Dict[str, float]):
+        self.iloc = [row]
+
+class FakeSmile:
+    def process_signal(self, audio, sr):
+        time.sleep(0.01 + 0.002 * len(audio) / sr)
+        loudness = float(np.sqrt(np.mean(np.square(audio)))) * 10
+        return _Functionals({
+            "loudness_sma3_amean": loudness,
+            "F0semitoneFrom27.5Hz_sma3nz_stddevNorm": 0.15,
+            "loudnessPeaksPerSec": 3.5,
+        })
+
+def install_stand_ins(args):
+    from model_registry import registry
+    registry.override("llm", make_fake_llm(args.llm_latency_ms, args.llm_jitter_ms, args.llm_chunk_ms, args.seed))
+    if args.fake_models:
+        registry.override("sentiment", FakeSentiment())
+        # --stt-rtf is the WHISPER_MODEL speed; other tiers scale with the
+        # tiering policy's default cost estimates
+        from model_registry import WHISPER_MODEL, WHISPER_TIERS, whisper_name
+        from stt_tiering import DEFAULT_RTF
+        base = DEFAULT_RTF.get(WHISPER_MODEL, 0.5)
+        for size in set(WHISPER_TIERS) | {WHISPER_MODEL}:
+            whisper = FakeWhisper(args.stt_rtf * DEFAULT_RTF.get(size, base) / base)
+            registry.override(whisper_name(size), whisper)
+            registry.override(whisper_name(size, batched=True), whisper)
+        registry.override("smile", FakeSmile())
+
+# --------- 2. Synthetic Audio -------------
+def synth_speech(seconds: float, sr: int = 16000, seed: int = 0) -> np.ndarray:
+    """Speech-like test signal: voiced "syllables" (harmonic stack with a
+    drifting pitch, ~4 Hz envelope) separated by short pauses, over low
+    background noise. Passes webrtcvad as speech."""
+    rng = np.random.default_rng(seed)
+    n = int(seconds * sr)
+    t = np.arange(n) / sr
+    f0 = 120 + 30 * np.sin(2 * np.pi * 0.3 * t + rng.uniform(0, np.pi))
+    phase = 2 * np.pi * np.cumsum(f0) / sr
+    voiced = sum(np.sin(k * phase) / k for k in range(1, 8))
+    envelope = np.clip(np.sin(2 * np.pi * 4 * t), 0, None) ** 0.5
+    # ~0.4 s pause every 2.5 s
+    envelope[(t % 2.5) > 2.1] = 0
+    audio = 0.25 * voiced * envelope + 0.003 * rng.standard_normal(n)
+    return audio.astype(np.float32)
+
+def load_clips(args) -> Dict[str, np.ndarray]:
+    clips = {}
+    if args.audio_dir:
+        from audio_io import decode_to_pcm16k
+        for name in sorted(os.listdir(args.audio_dir)):
+            with open(os.path.join(args.audio_dir, name), "rb") as f:
+                clips[os.path.splitext(name)[0]] = decode_to_pcm16k(f, name)
+    else:
+        for seconds in args.audio_seconds:
+            clips[f"{seconds:g}s"] = synth_speech(seconds, seed=args.seed)
+    return clips
+
+def wav_bytes(audio: np.ndarray, sr: int = 16000) -> bytes:
+    import io
+    import soundfile as sf
+    buf = io.BytesIO()
+    sf.write(buf, audio, sr, format="WAV", subtype="PCM_16")
+    return buf.getvalue()
+
+# --------- 3. Runner ----------------------
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    if not samples:
+        return {"count": 0}
+    arr = np.asarray(samples) * 1000
+    out = {"count": len(samples), "mean_ms": round(float(arr.mean()), 3)}
+    for p in STAGE_PERCENTILES:
+        out[f"p{p}_ms"] = round(float(np.percentile(arr, p)), 3)
+    return out
+
+def current_rss_mb() -> Optional[float]:
+    """Resident set size right now, or None if it cannot be read."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / (1024 * 1024)
+    except ImportError:
+        return None
+
+def lifetime_peak_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+class RSSSampler:
+    """Polls RSS on a thread while a scenario runs, so each scenario gets its
+    own peak instead of the process-lifetime ru_maxrss high-water mark."""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.start_mb = self.peak_mb = current_rss_mb()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+
+    def _sample(self):
+        rss = current_rss_mb()
+        if rss is not None:
+            self.peak_mb = max(self.peak_mb or 0.0, rss)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+
+    def result(self) -> Dict[str, float]:
+        if self.peak_mb is None:  # no RSS source: fall back to the lifetime mark
+            return {"peak_rss_mb": round(lifetime_peak_rss_mb(), 1)}
+        return {
+            "peak_rss_mb": round(self.peak_mb, 1),
+            "rss_growth_mb": round(self.peak_mb - self.start_mb, 1),
+        }
+
+async def run_scenario(name: str, make_call, iterations: int, concurrency: int, warmup: int) -> Dict[str, Any]:
+    from metrics import add_observer, remove_observer
+
+    for i in range(warmup):
+        await make_call(-1 - i)
+
+    stages: Dict[str, List[float]] = {}
+    def observe(stage: str, seconds: float):
+        stages.setdefault(stage, []).append(seconds)
+
+    latencies: List[float] = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i: int):
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await make_call(i)
+            except Exception as e:
+                errors += 1
+                print(f"⚠️ {name} #{i} failed: {e}", file=sys.stderr)
+                return
+            latencies.append(time.perf_counter() - start)
+
+    add_observer(observe)
+    start = time.perf_counter()
+    try:
+        with RSSSampler() as rss:
+            await asyncio.gather(*(one(i) for i in range(iterations)))
+    finally:
+        remove_observer(observe)
+    wall = time.perf_counter() - start
+
+    result = percentiles(latencies)
+    result.update({
+        "errors": errors,
+        "concurrency": concurrency,
+        "wall_seconds": round(wall, 3),
+        "throughput_rps": round(len(latencies) / wall, 3) if wall else 0.0,
+        **rss.result(),
+        "stages": {stage: percentiles(samples) for stage, samples in sorted(stages.items())},
+    })
+    return result
+
+def build_scenarios(args, clips: Dict[str, np.ndarray]) -> Dict[str, Any]:
+    import httpx
+    from orchestrator import chatbot
+    from api_server import app
+
+    # Unique text per call so result caches don't turn the run into a cache benchmark
+    def text_input(i: int) -> str:
+        return f"I have had a headache and a fever since yesterday ({i})"
+
+    async def graph_text(i: int):
+        inputs = {"user_input": {"type": "text", "content": text_input(i)}}
+        await chatbot.ainvoke(inputs, config={"configurable": {"thread_id": f"bench-graph-{i % 8}"}})
+
+    def graph_audio(audio: np.ndarray):
+        async def call(i: int):
+            # A little noise makes every clip distinct for the STT cache
+            noisy = audio + np.float32(1e-4) * np.random.default_rng(i + 1000).standard_normal(len(audio)).astype(np.float32)
+            inputs = {"user_input": {"type": "audio", "content": noisy, "sr": 16000, "filename": "bench"}}
+            await chatbot.ainvoke(inputs, config={"configurable": {"thread_id": f"bench-graph-{i % 8}"}})
+        return call
+
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=None)
+
+    async def api_check_user(i: int):
+        r = await client.post("/check-user", json={"user_id": f"bench-api-{i % 8}"})
+        r.raise_for_status()
+
+    async def api_text(i: int):
+        body = {"user_id": f"bench-api-{i % 8}", "messages": [{"role": "user", "content": text_input(i)}]}
+        r = await client.post("/text", json=body)
+        r.raise_for_status()
+
+    async def api_text_stream(i: int):
+        body = {"user_id": f"bench-api-{i % 8}", "messages": [{"role": "user", "content": text_input(i)}]}
+        async with client.stream("POST", "/text/stream", json=body) as r:
+            r.raise_for_status()
+            async for _ in r.aiter_bytes():
+                pass
+
+    def api_voice(audio: np.ndarray):
+        async def call(i: int):
+            noisy = audio + np.float32(1e-4) * np.random.default_rng(i + 2000).standard_normal(len(audio)).astype(np.float32)
+            files = {"file": ("bench.wav", wav_bytes(noisy), "audio/wav")}
+            r = await client.post("/voice", files=files, data={"user_id": f"bench-api-{i % 8}"})
+            r.raise_for_status()
+        return call
+
+    scenarios = {"graph_text": graph_text}
+    for label, audio in clips.items():
+        scenarios[f"graph_audio_{label}"] = graph_audio(audio)
+    scenarios["api_check_user"] = api_check_user
+    scenarios["api_text"] = api_text
+    scenarios["api_text_stream"] = api_text_stream
+    for label, audio in clips.items():
+        scenarios[f"api_voice_{label}"] = api_voice(audio)
+    return scenarios
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except Exception:
+        return None
+
+async def run_all(args) -> Dict[str, Any]:
+    install_stand_ins(args)
+    clips = load_clips(args)
+    scenarios = build_scenarios(args, clips)
+    selected = [name for name in scenarios if not args.only or any(token in name for token in args.only)]
+
+    results = {}
+    for name in selected:
+        sink = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(open(os.devnull, "w"))
+        with sink:
+            results[name] = await run_scenario(name, scenarios[name], args.iterations, args.concurrency, args.warmup)
+        r = results[name]
+        print(f"{name:28s} p50 {r.get('p50_ms', 0):9.1f} ms  p95 {r.get('p95_ms', 0):9.1f} ms  "
+              f"p99 {r.get('p99_ms', 0):9.1f} ms  {r['throughput_rps']:7.2f} req/s  "
+              f"rss {r['peak_rss_mb']:7.1f} MB (+{r.get('rss_growth_mb', 0):.1f})  errors {r['errors']}")
+    return {
+        "meta": {
+            "revision": git_revision(),
+            "timestamp": time.time(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "fake_models": args.fake_models,
+            "iterations": args.iterations,
+            "concurrency": args.concurrency,
+            "llm_latency_ms": args.llm_latency_ms,
+            "llm_jitter_ms": args.llm_jitter_ms,
+        },
+        "scenarios": results,
+    }
+
+# --------- 4. Comparison ------------------
+def compare(base_path: str, new_path: str, threshold_pct: float) -> int:
+    """Print p50/p95/p99 changes per scenario; returns the number of
+    regressions beyond threshold_pct."""
+    with open(base_path) as f:
+        base = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print(f"base {base['meta'].get('revision')}  ->  new {new['meta'].get('revision')}")
+    regressions = 0
+    for name, after in new["scenarios"].items():
+        before = base["scenarios"].get(name)
+        if not before:
+            print(f"{name:28s} (new scenario)")
+            continue
+        cells = []
+        for key in ("p50_ms", "p95_ms", "p99_ms"):
+            if key not in before or key not in after or not before[key]:
+                continue
+            delta = (after[key] - before[key]) / before[key] * 100
+            flag = ""
+            if delta > threshold_pct:
+                flag = " ⚠️"
+                regressions += 1
+            cells.append(f"{key[:-3]} {before[key]:.1f} -> {after[key]:.1f} ms ({delta:+.1f}%){flag}")
+        print(f"{name:28s} " + "  ".join(cells))
+    return regressions
+
+# --------- 5. CLI -------------------------
+def main():
+    parser = argparse.ArgumentParser(description="Offline latency/throughput benchmark for the chatbot backend")
+    parser.add_argument("--out", help="write JSON results here")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"), help="compare two result files and exit")
+    parser.add_argument("--threshold", type=float, default=10.0, help="regression threshold in percent for --compare")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--warmup", type=int, default=2, help="untimed calls per scenario (model loading, JIT)")
+    parser.add_argument("--only", nargs="*", help="run scenarios whose name contains any of these")
+    parser.add_argument("--audio-seconds", type=float, nargs="*", default=[2, 8, 20])
+    parser.add_argument("--audio-dir", help="use the clips in this directory instead of synthetic audio")
+    parser.add_argument("--fake-models", action="store_true", help="replace Whisper/RoBERTa/openSMILE with stand-ins")
+    parser.add_argument("--stt-rtf", type=float, default=0.05, help="fake Whisper real-time factor")
+    parser.add_argument("--llm-latency-ms", type=float, default=300)
+    parser.add_argument("--llm-jitter-ms", type=float, default=50)
+    parser.add_argument("--llm-chunk-ms", type=float, default=10, help="delay between streamed tokens")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--warm-cache", action="store_true", help="keep result caches enabled")
+    parser.add_argument("--verbose", action="store_true", help="keep the app's own console output")
+    args = parser.parse_args()
+
+    if args.compare:
+        raise SystemExit(1 if compare(*args.compare, args.threshold) else 0)
+
+    # Everything below imports the app, so configure it first: no network,
+    # state in a scratch directory, quiet logs, caches off unless asked.
+    workdir = tempfile.mkdtemp(prefix="chatbot-bench-")
+    os.environ.setdefault("HF_HUB_OFFLINE", "1")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    os.environ["PROFILE_DB_PATH"] = os.path.join(workdir, "user_profiles.db")
+    os.environ["CONDITION_QUEUE_PATH"] = os.path.join(workdir, "condition_queue.db")
+    os.environ["RESULT_CACHE_DIR"] = ""
+    if not args.warm_cache:
+        os.environ["CACHE_MAX_ENTRIES"] = "0"
+    # A handful of bench users send every request: per-user rate limits
+    # would turn the run into a 429 test
+    os.environ.setdefault("USER_RATE_PER_MINUTE", "0")
+    out_path = os.path.abspath(args.out) if args.out else None
+    os.chdir(workdir)
+
+    results = asyncio.run(run_all(args))
+    if out_path:
+        with open(out_path, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"✅ Results written to {out_path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+# chat_memory.py
+
+import os
+import json
+import time
+import argparse
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import BaseMessage, message_to_dict, messages_from_dict
+from metrics import timed
+from dotenv import load_dotenv
+
+load_dotenv()
+
+MEMORY_DIR = "chat_memory"
+# Retention applied by compact(); 0 disables the limit.
+MEMORY_RETENTION_MESSAGES = int(os.getenv("MEMORY_RETENTION_MESSAGES", "0"))
+MEMORY_RETENTION_DAYS = float(os.getenv("MEMORY_RETENTION_DAYS", "0"))
+# Logs larger than this are compacted automatically on append (when a
+# retention limit is configured).
+MEMORY_COMPACT_BYTES = int(os.getenv("MEMORY_COMPACT_BYTES", str(1024 * 1024)))
+
+_locks = {}
+_locks_guard = threading.Lock()
+# Log size at which each file is next considered for automatic compaction
+_compact_at: Dict[str, int] = {}
+
+def _lock_for(path: str) -> threading.Lock:
+    with _locks_guard:
+        return _locks.setdefault(path, threading.Lock())
+
+def _read_tail_lines(path: str, k: int, block_size: int = 8192) -> List[bytes]:
+    """Return the last k non-empty lines of a file, reading backwards in
+    blocks so only the tail of the log is touched."""
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        data = b""
+        # One extra newline guarantees the oldest returned line is complete.
+        while pos > 0 and data.count(b"\n") <= k:
+            step = min(block_size, pos)
+            pos -= step
+            f.seek(pos)
+            data = f.read(step) + data
+    lines = [line for line in data.split(b"\n") if line.strip()]
+    return lines[-k:]
+
+# --------- 1. Append-Only History ---------
+class AppendOnlyChatMessageHistory(BaseChatMessageHistory):
+    """Chat history stored as one JSON record per line in
+    chat_memory/<thread_id>.jsonl. Appends never rewrite the file and tail(k)
+    reads only the end of it. Legacy FileChatMessageHistory files
+    (<thread_id>.json) are migrated on first use. A rolling summary of older
+    turns lives next to the log in <thread_id>.summary.json."""
+
+    def __init__(self, thread_id: str, memory_dir: str = MEMORY_DIR):
+        os.makedirs(memory_dir, exist_ok=True)
+        self.thread_id = thread_id
+        self.path = os.path.join(memory_dir, f"{thread_id}.jsonl")
+        self.legacy_path = os.path.join(memory_dir, f"{thread_id}.json")
+        self.summary_path = os.path.join(memory_dir, f"{thread_id}.summary.json")
+        self._lock = _lock_for(self.path)
+        self._migrate_legacy()
+
+    def _migrate_legacy(self):
+        if os.path.exists(self.path) or not os.path.exists(self.legacy_path):
+            return
+        with self._lock:
+            if os.path.exists(self.path):
+                return
+            with open(self.legacy_path, "r") as f:
+                legacy = json.load(f)
+            now = time.time()
+            tmp = self.path + ".tmp"
+            with open(tmp, "w") as f:
+                for item in legacy:
+                    f.write(json.dumps({"ts": now, "message": item}) + "\n")
+            os.replace(tmp, self.path)
+            os.replace(self.legacy_path, self.legacy_path + ".migrated")
+
+    @staticmethod
+    def _decode(lines: Sequence[bytes]) -> List[BaseMessage]:
+        return messages_from_dict([json.loads(line)["message"] for line in lines])
+
+    @property
+    def messages(self) -> List[BaseMessage]:  # type: ignore[override]
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, "rb") as f:
+            return self._decode([line for line in f if line.strip()])
+
+    @timed("memory_read")
+    def tail(self, k: int) -> List[BaseMessage]:
+        """Last k messages without parsing the whole history."""
+        if k <= 0 or not os.path.exists(self.path):
+            return []
+        return self._decode(_read_tail_lines(self.path, k))
+
+    @timed("memory_read")
+    def since(self, offset: int) -> List[Tuple[int, BaseMessage]]:
+        """Messages stored after byte offset, each paired with the offset
+        just past its record."""
+        if not os.path.exists(self.path):
+            return []
+        ends, lines = [], []
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            for line in f:
+                offset += len(line)
+                if line.strip():
+                    ends.append(offset)
+                    lines.append(line)
+        return list(zip(ends, self._decode(lines)))
+
+    # The summary covers every record before "offset" in the log.
+    def load_summary(self) -> Dict:
+        if not os.path.exists(self.summary_path):
+            return {"summary": "", "offset": 0, "updated": None}
+        with open(self.summary_path, "r") as f:
+            return json.load(f)
+
+    def save_summary(self, summary: str, offset: int) -> None:
+        tmp = self.summary_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"summary": summary, "offset": offset, "updated": time.time()}, f)
+        os.replace(tmp, self.summary_path)
+
+    @timed("memory_write")
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        now = time.time()
+        payload = "".join(json.dumps({"ts": now, "message": message_to_dict(m)}) + "\n" for m in messages)
+        with self._lock:
+            with open(self.path, "a") as f:
+                f.write(payload)
+                size = f.tell()
+        if size > _compact_at.get(self.path, MEMORY_COMPACT_BYTES) and (MEMORY_RETENTION_MESSAGES or MEMORY_RETENTION_DAYS):
+            self.compact()
+            # Retention may leave the log above the threshold (e.g. a long
+            # age window); wait for it to grow by half again so appends stay
+            # cheap instead of re-reading the whole file every time.
+            size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+            _compact_at[self.path] = max(MEMORY_COMPACT_BYTES, size + size // 2)
+
+    def add_message(self, message: BaseMessage) -> None:
+        self.add_messages([message])
+
+    def clear(self) -> None:
+        with self._lock:
+            for path in (self.path, self.summary_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            _compact_at.pop(self.path, None)
+
+    def compact(self, max_messages: Optional[int] = None, max_age_days: Optional[float] = None) -> int:
+        """Rewrite the log keeping only records within the retention limits.
+        Returns the number of records dropped."""
+        max_messages = MEMORY_RETENTION_MESSAGES if max_messages is None else max_messages
+        max_age_days = MEMORY_RETENTION_DAYS if max_age_days is None else max_age_days
+        with self._lock:
+            if not os.path.exists(self.path):
+                return 0
+            with open(self.path, "rb") as f:
+                records = [line for line in f if line.strip()]
+            kept = records
+            if max_age_days:
+                cutoff = time.time() - max_age_days * 86400
+                kept = [line for line in kept if json.loads(line).get("ts", 0) >= cutoff]
+            if max_messages:
+                kept = kept[-max_messages:]
+            if len(kept) == len(records):
+                return 0
+            tmp = self.path + ".tmp"
+            with open(tmp, "wb") as f:
+                f.writelines(kept)
+            os.replace(tmp, self.path)
+            # Dropped records are the oldest ones, so shift the summary offset
+            summary = self.load_summary()
+            if summary["offset"]:
+                dropped_bytes = sum(len(line) for line in records) - sum(len(line) for line in kept)
+                self.save_summary(summary["summary"], max(0, summary["offset"] - dropped_bytes))
+            return len(records) - len(kept)
+
+# --------- 2. Maintenance -----------------
+def migrate_all(memory_dir: str = MEMORY_DIR) -> int:
+    """Convert every legacy <thread_id>.json history in memory_dir."""
+    count = 0
+    if not os.path.isdir(memory_dir):
+        return count
+    for name in os.listdir(memory_dir):
+        if name.endswith(".json") and not name.endswith(".summary.json"):
+            thread_id = name[: -len(".json")]
+            if not os.path.exists(os.path.join(memory_dir, f"{thread_id}.jsonl")):
+                AppendOnlyChatMessageHistory(thread_id, memory_dir)
+                count += 1
+    return count
+
+def compact_all(memory_dir: str = MEMORY_DIR) -> int:
+    dropped = 0
+    if not os.path.isdir(memory_dir):
+        return dropped
+    for name in os.listdir(memory_dir):
+        if name.endswith(".jsonl"):
+            dropped += AppendOnlyChatMessageHistory(name[: -len(".jsonl")], memory_dir).compact()
+    return dropped
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrate and compact chat memory logs")
+    parser.add_argument("--dir", default=MEMORY_DIR)
+    parser.add_argument("--migrate", action="store_true", help="convert legacy .json histories")
+    parser.add_argument("--compact", action="store_true", help="apply retention limits")
+    args = parser.parse_args()
+    if args.migrate:
+        print(f"✅ Migrated {migrate_all(args.dir)} histories")
+    if args.compact:
+        print(f"✅ Dropped {compact_all(args.dir)} records")
@@ -0,0 +1,58 @@
+# concurrency.py
+
+import os
+import time
+import asyncio
+import contextvars
+import weakref
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from metrics import STAGE_QUEUE_SECONDS
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# --------- 1. Bounded Executor -------------
+# CPU-bound model work (decode, VAD, Whisper) runs here so the
+# uvicorn event loop stays free for other requests.
+MODEL_WORKERS = int(os.getenv("MODEL_WORKERS", "4"))
+executor = ThreadPoolExecutor(max_workers=MODEL_WORKERS, thread_name_prefix="model")
+
+# Blocking I/O (sync LLM calls, profile/memory files) gets its own pool so a
+# slow Azure round-trip never occupies a model worker.
+IO_WORKERS = int(os.getenv("IO_WORKERS", "16"))
+io_executor = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix="io")
+IO_STAGES = {"llm", "profile"}
+
+# --------- 2. Per-Stage Limits ------------
+# Max number of in-flight calls per pipeline stage. Override with e.g.
+# STT_CONCURRENCY=2 in .env.
+STAGE_LIMITS = {
+    "decode": int(os.getenv("DECODE_CONCURRENCY", "4")),
+    "stt": int(os.getenv("STT_CONCURRENCY", "1")),
+    "acoustic": int(os.getenv("ACOUSTIC_CONCURRENCY", "2")),
+    "llm": int(os.getenv("LLM_CONCURRENCY", "16")),
+    "profile": int(os.getenv("PROFILE_CONCURRENCY", "4")),
+}
+
+# asyncio primitives are bound to the loop that first uses them, and the CLI
+# runs one loop per turn, so keep a set of semaphores per loop.
+_semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict]" = weakref.WeakKeyDictionary()
+
+def stage_limit(stage: str) -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    per_loop = _semaphores.setdefault(loop, {})
+    if stage not in per_loop:
+        per_loop[stage] = asyncio.Semaphore(STAGE_LIMITS.get(stage, MODEL_WORKERS))
+    return per_loop[stage]
+
+async def run_stage(stage: str, fn, *args, **kwargs):
+    """Run a blocking call on the stage's executor under the stage's limit.
+    The caller's context (trace ID) is carried into the worker thread."""
+    pool = io_executor if stage in IO_STAGES else executor
+    queued = time.perf_counter()
+    async with stage_limit(stage):
+        STAGE_QUEUE_SECONDS.labels(stage).observe(time.perf_counter() - queued)
+        loop = asyncio.get_running_loop()
+        ctx = contextvars.copy_context()
+        return await loop.run_in_executor(pool, partial(ctx.run, fn, *args, **kwargs))
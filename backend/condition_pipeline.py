@@ -0,0 +1,239 @@
+# condition_pipeline.py
+
+import os
+import time
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional
+from dotenv import load_dotenv
+from profile_manager import extract_conditions_batch
+from profile_store import get_profile_store
+from metrics import timed
+
+load_dotenv()
+
+# Symptom extraction runs here, off the response path: turns enqueue their
+# transcript into a durable SQLite queue and background workers batch pending
+# transcripts (across turns and users) into one extraction call.
+CONDITION_QUEUE_PATH = os.getenv("CONDITION_QUEUE_PATH", "condition_queue.db")
+CONDITION_WORKERS = int(os.getenv("CONDITION_WORKERS", "1"))
+CONDITION_BATCH_SIZE = int(os.getenv("CONDITION_BATCH_SIZE", "8"))
+CONDITION_BATCH_WAIT_MS = float(os.getenv("CONDITION_BATCH_WAIT_MS", "200"))
+CONDITION_MAX_ATTEMPTS = int(os.getenv("CONDITION_MAX_ATTEMPTS", "3"))
+# A claimed job is handed to another worker once its claim is this old, so
+# jobs of a process that died are retried without stealing live work from
+# other processes sharing the queue. Each expired claim counts as an attempt.
+CONDITION_LEASE_S = float(os.getenv("CONDITION_LEASE_S", "300"))
+
+# --------- 1. Durable Queue ---------------
+class ConditionQueue:
+    def __init__(self, path: str = CONDITION_QUEUE_PATH, lease_seconds: float = CONDITION_LEASE_S):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self._local = threading.local()
+        self._claim_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT NOT NULL,"
+            " transcript TEXT NOT NULL, enqueued_at REAL NOT NULL,"
+            " status TEXT NOT NULL DEFAULT 'pending', attempts INTEGER NOT NULL DEFAULT 0,"
+            " claimed_at REAL)"
+        )
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+        if "claimed_at" not in columns:
+            conn.execute("ALTER TABLE jobs ADD COLUMN claimed_at REAL")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, id)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def put(self, user_id: str, transcript: str):
+        self._conn().execute(
+            "INSERT INTO jobs (user_id, transcript, enqueued_at) VALUES (?, ?, ?)",
+            (user_id, transcript, time.time()),
+        )
+        self.notify()
+
+    def claim(self, limit: int) -> List[tuple]:
+        with self._claim_lock:
+            conn = self._conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                # Pending jobs, plus claimed ones whose lease has expired
+                rows = conn.execute(
+                    "SELECT id, user_id, transcript, enqueued_at, attempts, status FROM jobs"
+                    " WHERE status = 'pending'"
+                    " OR (status = 'processing' AND (claimed_at IS NULL OR claimed_at < ?))"
+                    " ORDER BY id LIMIT ?",
+                    (now - self.lease_seconds, limit),
+                ).fetchall()
+                claimed, failed = [], []
+                for job_id, user_id, transcript, enqueued_at, attempts, status in rows:
+                    # An expired lease counts as a failed attempt, so a job
+                    # that kills or hangs its worker is eventually given up
+                    if status == "processing":
+                        attempts += 1
+                        if attempts >= CONDITION_MAX_ATTEMPTS:
+                            failed.append((attempts, job_id))
+                            continue
+                    claimed.append((job_id, user_id, transcript, enqueued_at, attempts))
+                conn.executemany(
+                    "UPDATE jobs SET status = 'failed', attempts = ?, claimed_at = NULL WHERE id = ?", failed
+                )
+                conn.executemany(
+                    "UPDATE jobs SET status = 'processing', attempts = ?, claimed_at = ? WHERE id = ?",
+                    [(r[4], now, r[0]) for r in claimed],
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return claimed
+
+    def ack(self, ids: List[int]):
+        self._conn().executemany("DELETE FROM jobs WHERE id = ?", [(i,) for i in ids])
+
+    def retry(self, rows: List[tuple]):
+        conn = self._conn()
+        for job_id, _, _, _, attempts in rows:
+            status = "failed" if attempts + 1 >= CONDITION_MAX_ATTEMPTS else "pending"
+            conn.execute(
+                "UPDATE jobs SET status = ?, attempts = attempts + 1, claimed_at = NULL WHERE id = ?",
+                (status, job_id),
+            )
+
+    def notify(self):
+        self._wakeup.set()
+
+    def wait_for_work(self, timeout: float):
+        self._wakeup.wait(timeout)
+        self._wakeup.clear()
+
+    def pending_count(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM jobs WHERE status = 'pending'").fetchone()[0]
+
+    def stats(self) -> Dict[str, float]:
+        conn = self._conn()
+        counts = dict(conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        oldest = conn.execute("SELECT MIN(enqueued_at) FROM jobs WHERE status != 'failed'").fetchone()[0]
+        return {
+            "depth": counts.get("pending", 0),
+            "in_flight": counts.get("processing", 0),
+            "failed": counts.get("failed", 0),
+            "lag_seconds": time.time() - oldest if oldest else 0.0,
+        }
+
+# --------- 2. Workers ---------------------
+class ConditionPipeline:
+    def __init__(self, queue: ConditionQueue, workers: int = CONDITION_WORKERS):
+        self.queue = queue
+        self.workers = workers
+        self._threads: List[threading.Thread] = []
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._stats = {
+            "enqueued": 0,
+            "processed": 0,
+            "conditions_added": 0,
+            "batches": 0,
+            "errors": 0,
+            "last_batch_seconds": 0.0,
+            "last_apply_lag_seconds": 0.0,
+        }
+
+    def start(self):
+        with self._lock:
+            self._threads = [t for t in self._threads if t.is_alive()]
+            if self._threads:
+                return
+            self._stop.clear()
+            for i in range(self.workers):
+                t = threading.Thread(target=self._run, name=f"condition-worker-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        self.queue.notify()
+        for t in self._threads:
+            t.join(timeout)
+
+    def enqueue(self, user_id: str, transcript: str):
+        """Queue a transcript for background extraction. Users without a
+        profile are skipped, as before."""
+        if not transcript or not get_profile_store().exists(user_id):
+            return
+        self.queue.put(user_id, transcript)
+        with self._lock:
+            self._stats["enqueued"] += 1
+        self.start()
+
+    def _next_batch(self) -> List[tuple]:
+        rows = self.queue.claim(CONDITION_BATCH_SIZE)
+        if rows and len(rows) < CONDITION_BATCH_SIZE:
+            # Give concurrent turns a moment to join this batch.
+            time.sleep(CONDITION_BATCH_WAIT_MS / 1000.0)
+            rows += self.queue.claim(CONDITION_BATCH_SIZE - len(rows))
+        return rows
+
+    def _run(self):
+        while not self._stop.is_set():
+            rows = self._next_batch()
+            if not rows:
+                self.queue.wait_for_work(1.0)
+                continue
+            self.process(rows)
+
+    def process(self, rows: List[tuple]):
+        start = time.perf_counter()
+        try:
+            extracted = extract_conditions_batch([r[2] for r in rows])
+        except Exception as e:
+            print(f"⚠️ Condition extraction failed: {e}")
+            self.queue.retry(rows)
+            with self._lock:
+                self._stats["errors"] += 1
+            self._stop.wait(1.0)  # back off before the retry is claimed
+            return
+
+        store = get_profile_store()
+        added = 0
+        with timed("profile_write"):
+            for (_, user_id, _, enqueued_at, _), conditions in zip(rows, extracted):
+                timestamp = datetime.fromtimestamp(enqueued_at).isoformat()
+                added += store.add_conditions(user_id, conditions, timestamp=timestamp)
+        self.queue.ack([r[0] for r in rows])
+
+        with self._lock:
+            self._stats["processed"] += len(rows)
+            self._stats["conditions_added"] += added
+            self._stats["batches"] += 1
+            self._stats["last_batch_seconds"] = time.perf_counter() - start
+            self._stats["last_apply_lag_seconds"] = time.time() - min(r[3] for r in rows)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            s = dict(self._stats)
+        s.update(self.queue.stats())
+        s["workers_alive"] = sum(t.is_alive() for t in self._threads)
+        return s
+
+# --------- 3. Default Pipeline ------------
+_pipeline: Optional[ConditionPipeline] = None
+_pipeline_lock = threading.Lock()
+
+def get_condition_pipeline() -> ConditionPipeline:
+    global _pipeline
+    with _pipeline_lock:
+        if _pipeline is None:
+            _pipeline = ConditionPipeline(ConditionQueue(CONDITION_QUEUE_PATH))
+        return _pipeline
@@ -0,0 +1,195 @@
+# context_builder.py
+
+import os
+import asyncio
+import contextvars
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, SystemMessage
+from chat_memory import AppendOnlyChatMessageHistory
+from concurrency import run_stage, stage_limit
+from model_registry import get_llm
+from metrics import timed
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Upper bound for the whole prompt (system prompt + summary + history).
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "3000"))
+# Recent messages sent verbatim; older ones are folded into the summary.
+HISTORY_MAX_MESSAGES = int(os.getenv("HISTORY_MAX_MESSAGES", "10"))
+# Summarize once this many messages have fallen out of the recent window.
+SUMMARY_BATCH_MESSAGES = int(os.getenv("SUMMARY_BATCH_MESSAGES", "6"))
+SUMMARY_MAX_WORDS = int(os.getenv("SUMMARY_MAX_WORDS", "150"))
+MAX_PROFILE_CONDITIONS = int(os.getenv("MAX_PROFILE_CONDITIONS", "12"))
+
+# --------- 1. Token Counting --------------
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("o200k_base")
+
+    def count_tokens(text: str) -> int:
+        return len(_encoding.encode(text or "", disallowed_special=()))
+except Exception:  # tiktoken missing or its encoding files unavailable
+    _encoding = None
+
+    def count_tokens(text: str) -> int:
+        # ~4 characters per token for English text
+        return (len(text or "") + 3) // 4
+
+def message_tokens(message: BaseMessage) -> int:
+    # A few tokens of per-message framing in the chat format
+    return count_tokens(str(message.content)) + 4
+
+# --------- 2. Profile Block ---------------
+def aggregate_conditions(conditions: List[Dict[str, str]]) -> List[Dict[str, Any]]:
+    """Collapse repeated condition entries into one row per condition with
+    a count and first/last-seen timestamps, most recent first."""
+    merged: Dict[str, Dict[str, Any]] = {}
+    for entry in conditions:
+        name = " ".join(str(entry.get("condition", "")).split())
+        if not name:
+            continue
+        ts = entry.get("timestamp") or ""
+        row = merged.setdefault(name.lower(), {"condition": name, "count": 0, "first_seen": ts, "last_seen": ts})
+        row["count"] += 1
+        row["first_seen"] = min(row["first_seen"], ts) if row["first_seen"] else ts
+        if ts >= row["last_seen"]:
+            row["last_seen"] = ts
+            row["condition"] = name
+    return sorted(merged.values(), key=lambda r: (r["last_seen"], r["count"]), reverse=True)
+
+def _day(ts: str) -> str:
+    try:
+        return datetime.fromisoformat(ts).strftime("%Y-%m-%d")
+    except (TypeError, ValueError):
+        return "unknown"
+
+def format_profile(profile: Dict[str, Any], max_conditions: int = MAX_PROFILE_CONDITIONS) -> str:
+    rows = aggregate_conditions(profile.get("conditions", []))
+    if rows:
+        shown = [
+            f"{r['condition']} (mentioned {r['count']}x, last {_day(r['last_seen'])})"
+            for r in rows[:max_conditions]
+        ]
+        if len(rows) > max_conditions:
+            shown.append(f"{len(rows) - max_conditions} older conditions omitted")
+        formatted_conditions = "; ".join(shown)
+    else:
+        formatted_conditions = "None"
+    return (
+        f"User Profile:\n"
+        f"- Name: {profile.get('name', 'Unknown')}\n"
+        f"- Age: {profile.get('age', 'Unknown')}\n"
+        f"- Known Conditions: {formatted_conditions}\n\n"
+    )
+
+# --------- 3. Prompt Assembly -------------
+@timed("context_build")
+def build_context(system_prompt: str, memory: AppendOnlyChatMessageHistory,
+                  budget: int = PROMPT_TOKEN_BUDGET, turn_prompt: str = "") -> Dict[str, Any]:
+    """Assemble [system + summary] + recent history + [turn prompt] within
+    the token budget.
+
+    Only the trailing turn prompt changes on every turn. The history window
+    starts at the summary's offset and only moves when the summary is
+    updated, so the messages before the turn prompt repeat the previous
+    request's prompt and providers can serve them from their prompt cache
+    (which only applies past roughly 1024 identical leading tokens).
+
+    History stops at HISTORY_MAX_MESSAGES plus the batch awaiting
+    summarization, or when the budget runs out. The newest message, the
+    current user turn, is always kept."""
+    window = HISTORY_MAX_MESSAGES + SUMMARY_BATCH_MESSAGES
+    summary = memory.load_summary()
+    if summary["summary"]:
+        system_prompt += f"Summary of the earlier conversation:\n{summary['summary']}\n\n"
+        records = memory.since(summary["offset"])[-window:]
+        history = [m for _, m in records]
+    else:
+        history = memory.tail(window)
+
+    system_msg = HumanMessage(content=system_prompt)
+    turn_msgs = [SystemMessage(content=turn_prompt)] if turn_prompt else []
+    used = message_tokens(system_msg) + sum(message_tokens(m) for m in turn_msgs)
+    kept: List[BaseMessage] = []
+    for message in reversed(history):
+        cost = message_tokens(message)
+        if kept and used + cost > budget:
+            break
+        kept.append(message)
+        used += cost
+    kept.reverse()
+
+    return {
+        "messages": [system_msg] + kept + turn_msgs,
+        "prompt_tokens": used,
+        "history_messages": len(kept),
+        "dropped_messages": len(history) - len(kept),
+    }
+
+# --------- 4. Rolling Summary -------------
+SUMMARY_PROMPT = (
+    "You maintain a running summary of a conversation between a user and a healthcare assistant. "
+    "Update the summary with the new messages. Keep symptoms, their timing and severity, medications, "
+    "advice already given and the user's preferences; drop greetings and small talk. "
+    f"Answer with the updated summary only, at most {SUMMARY_MAX_WORDS} words.\n\n"
+    "Current summary:\n{summary}\n\nNew messages:\n{transcript}\n\nUpdated summary:"
+)
+
+_summary_tasks = set()
+_summary_threads = set()
+
+def _render(messages: List[BaseMessage]) -> str:
+    lines = []
+    for m in messages:
+        role = "Assistant" if isinstance(m, AIMessage) else "User"
+        lines.append(f"{role}: {m.content}")
+    return "\n".join(lines)
+
+async def update_summary(memory: AppendOnlyChatMessageHistory) -> bool:
+    """Fold the messages that have left the recent window into the summary.
+    Returns True if the summary was updated."""
+    summary = await run_stage("profile", memory.load_summary)
+    records = await run_stage("profile", memory.since, summary["offset"])
+    overflow = len(records) - HISTORY_MAX_MESSAGES
+    if overflow < SUMMARY_BATCH_MESSAGES:
+        return False
+
+    # Fold at most a few batches per update; a long history that predates
+    # summaries only contributes its most recent part.
+    batch = records[:overflow][-4 * SUMMARY_BATCH_MESSAGES:]
+    prompt = SUMMARY_PROMPT.format(
+        summary=summary["summary"] or "(none yet)",
+        transcript=_render([m for _, m in batch]),
+    )
+    async with stage_limit("llm"), timed("llm_summary"):
+        response = await get_llm().ainvoke([HumanMessage(content=prompt)])
+    await run_stage("profile", memory.save_summary, str(response.content).strip(), batch[-1][0])
+    return True
+
+async def _update_summary_safely(memory: AppendOnlyChatMessageHistory):
+    try:
+        await update_summary(memory)
+    except Exception as e:
+        print(f"⚠️ Summary update failed for {memory.thread_id}: {e}")
+    finally:
+        _summary_threads.discard(memory.thread_id)
+
+def schedule_summary_update(memory: AppendOnlyChatMessageHistory) -> Optional[asyncio.Task]:
+    """Update the summary in the background, at most one update per thread
+    at a time. The task runs in a fresh context so its LLM call is not
+    reported as part of the current turn's event stream."""
+    if memory.thread_id in _summary_threads:
+        return None
+    _summary_threads.add(memory.thread_id)
+    loop = asyncio.get_running_loop()
+    task = loop.create_task(_update_summary_safely(memory), context=contextvars.Context())
+    _summary_tasks.add(task)
+    task.add_done_callback(_summary_tasks.discard)
+    return task
+
+async def wait_for_summaries():
+    """Let pending summary updates finish (the CLI closes its loop per turn)."""
+    if _summary_tasks:
+        await asyncio.gather(*list(_summary_tasks), return_exceptions=True)
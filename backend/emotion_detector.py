@@ -1,39 +1,177 @@
 # emotion_detector.py
 
+import time
+import asyncio
 import numpy as np
-from emotion_test import remove_silence, stt_transcribe, text_probs, EMOTION_LABELS
+from emotion_test import (
+    vad_segments, join_segments, pause_features, stt_transcribe, stt_transcribe_segments,
+    acoustic_features, text_probs, atext_probs, EMOTION_LABELS,
+)
+from concurrency import run_stage, executor
+from stt_tiering import policy as stt_policy
 
-def detect_emotion(input_data: dict):
+# --------- Multimodal Fusion -------------
+def _clip01(x: float) -> float:
+    return float(min(max(x, 0.0), 1.0))
+
+def estimate_arousal(features, voiced_audio) -> float:
+    """Arousal in [0, 1] from GeMAPS loudness, pitch variability and
+    loudness-peak rate. Falls back to mean amplitude when the clip was too
+    short for openSMILE."""
+    if not features:
+        return _clip01(float(np.mean(np.abs(voiced_audio))) * 10)
+    loudness = _clip01((features.get("loudness", 0.0) - 0.2) / 1.3)
+    pitch_var = _clip01(features.get("pitch_variability", 0.0) / 0.3)
+    tempo = _clip01(features.get("loudness_peaks_per_sec", 0.0) / 6.0)
+    return 0.5 * loudness + 0.3 * pitch_var + 0.2 * tempo
+
+def fuse_emotion(valence: float, arousal: float) -> str:
+    """Map the text valence and acoustic arousal to one emotion label from
+    the circumplex quadrants the response prompts understand."""
+    if valence > 0.25:
+        if arousal >= 0.6:
+            return "excited"
+        return "relieved" if arousal < 0.35 else "happy"
+    if valence < -0.25:
+        if arousal >= 0.6:
+            return "anxious"
+        return "sad" if arousal < 0.35 else "upset"
+    return "neutral"
+
+def _text_result(text, probs):
+    return {
+        "emotion": EMOTION_LABELS[np.argmax(probs)],
+        "valence": float(probs[2] - probs[0]),
+        "arousal": None,
+        "transcript": text
+    }
+
+def _audio_result(transcript, probs, features, voiced_audio, pauses, timings, stt_tier):
+    valence = float(probs[2] - probs[0])
+    arousal = estimate_arousal(features, voiced_audio)
+    return {
+        "emotion": fuse_emotion(valence, arousal),
+        "text_emotion": EMOTION_LABELS[np.argmax(probs)],
+        "valence": valence,
+        "arousal": arousal,
+        "transcript": transcript,
+        "pauses": pauses,
+        "acoustic": features or {},
+        "timings": timings,
+        "stt_tier": stt_tier
+    }
+
+def _timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+# --------- STT Tiering -------------------
+# The tier is chosen from the voiced duration once silence is removed;
+# see stt_tiering.py. Offline callers pin a tier and skip the policy, which
+# is tuned for real-time latency.
+def _transcribe(audio, sr, segments, voiced_seconds, tier=None):
+    if tier is not None:
+        transcript, t_stt = _timed(stt_transcribe_segments, audio, sr, segments, tier)
+        return transcript, t_stt, tier
+    plan = stt_policy.plan(voiced_seconds)
+    try:
+        transcript, t_stt = _timed(stt_transcribe_segments, audio, sr, segments, plan.tier)
+    except BaseException:
+        stt_policy.done(plan)
+        raise
+    stt_policy.done(plan, t_stt, t_stt)
+    return transcript, t_stt, plan.tier
+
+async def _atranscribe(voiced_seconds, fn, *args):
+    """Run fn(*args, tier) on the STT stage with the planned tier."""
+    plan = stt_policy.plan(voiced_seconds)
+    queued = time.perf_counter()
+    try:
+        transcript, t_stt = await run_stage("stt", _timed, fn, *args, plan.tier)
+    except BaseException:
+        stt_policy.done(plan)
+        raise
+    stt_policy.done(plan, t_stt, time.perf_counter() - queued)
+    return transcript, t_stt, plan.tier
+
+async def atranscribe_clip(audio, sr):
+    """Transcribe one speech segment (WebSocket channel); returns the text
+    and the tier that decoded it."""
+    transcript, _, tier = await _atranscribe(len(audio) / sr, stt_transcribe, audio, sr)
+    return transcript.strip(), tier
+
+def detect_emotion(input_data: dict, stt_tier: str = None):
+    """Synchronous emotion detection. stt_tier pins the Whisper size instead
+    of letting the real-time tiering policy choose one."""
     if input_data["type"] == "text":
         text = input_data["content"]
-        probs = text_probs(text)
-        emotion = EMOTION_LABELS[np.argmax(probs)]
-        valence = probs[2] - probs[0]
-        return {
-            "emotion": emotion,
-            "valence": float(valence),
-            "arousal": None,
-            "transcript": text
+        return _text_result(text, text_probs(text))
+
+    elif input_data["type"] == "audio":
+        audio = input_data["content"]
+        sr = input_data["sr"]
+        start = time.perf_counter()
+
+        segments, t_vad = _timed(vad_segments, audio, sr)
+        voiced = join_segments(audio, sr, segments)
+        # openSMILE runs on a worker while Whisper decodes in this thread
+        acoustic = executor.submit(_timed, acoustic_features, voiced, sr)
+        transcript, t_stt, tier = _transcribe(audio, sr, segments, len(voiced) / sr, stt_tier)
+        features, t_acoustic = acoustic.result()
+        probs, t_sentiment = _timed(text_probs, transcript)
+
+        timings = {
+            "vad": t_vad,
+            "stt": t_stt,
+            "acoustic": t_acoustic,
+            "sentiment": t_sentiment,
+            "total": time.perf_counter() - start,
         }
+        pauses = pause_features(segments, len(audio) / sr)
+        return _audio_result(transcript, probs, features, voiced, pauses, timings, tier)
+
+    else:
+        raise ValueError("Input type must be 'text' or 'audio'")
+
+
+async def adetect_emotion(input_data: dict):
+    """Async variant of detect_emotion that offloads each model stage to the
+    bounded executor so the event loop is never blocked."""
+    if input_data["type"] == "text":
+        text = input_data["content"]
+        return _text_result(text, await atext_probs(text))
 
     elif input_data["type"] == "audio":
         audio = input_data["content"]
         sr = input_data["sr"]
-        filename = input_data.get("filename", "unknown.wav")
-
-        audio = remove_silence(audio, sr)
-        transcript = stt_transcribe(audio, sr)
-        probs = text_probs(transcript)
-        emotion = EMOTION_LABELS[np.argmax(probs)]
-        valence = probs[2] - probs[0]
-        arousal = float(np.mean(np.abs(audio)))
-
-        return {
-            "emotion": emotion,
-            "valence": float(valence),
-            "arousal": arousal,
-            "transcript": transcript
+        start = time.perf_counter()
+
+        segments, t_vad = await run_stage("decode", _timed, vad_segments, audio, sr)
+        voiced = join_segments(audio, sr, segments)
+
+        # Acoustic features and STT run side by side; the branch finishes in
+        # roughly the time Whisper alone takes.
+        acoustic = run_stage("acoustic", _timed, acoustic_features, voiced, sr)
+        if input_data.get("transcript") is not None:
+            # Already segmented and transcribed incrementally (WebSocket channel)
+            (features, t_acoustic) = await acoustic
+            transcript, t_stt, tier = input_data["transcript"], 0.0, input_data.get("stt_tier")
+        else:
+            stt = _atranscribe(len(voiced) / sr, stt_transcribe_segments, audio, sr, segments)
+            (features, t_acoustic), (transcript, t_stt, tier) = await asyncio.gather(acoustic, stt)
+
+        t0 = time.perf_counter()
+        probs = await atext_probs(transcript)
+        timings = {
+            "vad": t_vad,
+            "stt": t_stt,
+            "acoustic": t_acoustic,
+            "sentiment": time.perf_counter() - t0,
+            "total": time.perf_counter() - start,
         }
+        pauses = pause_features(segments, len(audio) / sr)
+        return _audio_result(transcript, probs, features, voiced, pauses, timings, tier)
 
     else:
         raise ValueError("Input type must be 'text' or 'audio'")
@@ -1,90 +1,235 @@
-import io, wave, json, torch, torchaudio, opensmile
 from fastapi import FastAPI, UploadFile
-from transformers import AutoTokenizer, AutoModelForSequenceClassification
 import numpy as np
-import webrtcvad
-import tempfile
-import soundfile as sf
 import os
-from faster_whisper import WhisperModel
 from datetime import datetime
-import os
+import asyncio
+from sentiment_batcher import SentimentBatcher
+from model_registry import registry, WHISPER_MODEL, whisper_name
+from stt_tiering import stt_options
+from sentiment_engine import SENTIMENT_MODEL, SENTIMENT_ENGINE
+from result_cache import ResultCache, content_key, normalize_text
+from vad_stream import new_vad
+from audio_io import spool_upload, decode_to_pcm16k, resample, TARGET_SR
+from metrics import timed
+from analytics_log import emotion_log
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
 
 # ---------- 0. MODELS & HELPERS ---------------------------
-vad = webrtcvad.Vad(3)
-whisper = WhisperModel("medium", device="cpu", compute_type="int8")
+# Whisper, openSMILE and the RoBERTa sentiment model are loaded lazily through
+# the model registry (see model_registry.py), so importing this module is
+# cheap and text-only workers never load the audio models. webrtcvad keeps
+# per-stream state, so each clip gets its own detector (vad_stream.new_vad).
 
-smile = opensmile.Smile(
-    feature_set=opensmile.FeatureSet.GeMAPSv01b,
-    feature_level=opensmile.FeatureLevel.Functionals,
-)
+EMOTION_LABELS = ["negative", "neutral", "positive"]
+SENTIMENT_MAX_BATCH = int(os.getenv("SENTIMENT_MAX_BATCH", "16"))
+SENTIMENT_MAX_WAIT_MS = float(os.getenv("SENTIMENT_MAX_WAIT_MS", "5"))
 
-tokenizer = AutoTokenizer.from_pretrained("cardiffnlp/twitter-roberta-base-sentiment")
-text_net = AutoModelForSequenceClassification.from_pretrained(
-    "cardiffnlp/twitter-roberta-base-sentiment"
-).eval()
+# Content-addressed result caches (see result_cache.py)
+sentiment_cache = ResultCache("sentiment", encode=lambda p: [float(x) for x in p], decode=np.array)
+stt_cache = ResultCache("stt")
 
-EMOTION_LABELS = ["negative", "neutral", "positive"]
-LOG_FILE = "emotion_log.jsonl"
+# VAD segmentation (see vad_segments)
+VAD_FRAME_MS = 30
+VAD_PADDING_MS = int(os.getenv("VAD_PADDING_MS", "90"))
+VAD_MERGE_GAP_MS = int(os.getenv("VAD_MERGE_GAP_MS", "300"))
+VAD_MIN_SPEECH_MS = int(os.getenv("VAD_MIN_SPEECH_MS", "90"))
+WHISPER_BATCH_SIZE = int(os.getenv("WHISPER_BATCH_SIZE", "8"))
+WHISPER_MAX_CLIP_S = 30.0  # Whisper's context window
 
 # ---------- 1. UTILITIES ---------------------------
-def frame_generator(frame_duration_ms, audio, sample_rate):
-    n = int(sample_rate * (frame_duration_ms / 1000.0) * 2)
-    offset = 0
-    while offset + n <= len(audio):
-        yield audio[offset:offset + n]
-        offset += n
-
-def remove_silence(waveform, sr=16000):
+def speech_flags(waveform, sr=16000, frame_ms=VAD_FRAME_MS):
+    """Per-frame webrtcvad decisions as a bool array. Frames are memoryview
+    slices of a single int16 buffer, so no per-frame bytes objects are built."""
     assert sr == 16000, "webrtcvad requires 16000Hz sample rate"
-    int16_audio = (waveform * 32768).astype("int16").tobytes()
-
-    voiced_frames = []
-    for frame in frame_generator(30, int16_audio, sr):
-        if vad.is_speech(frame, sr):
-            voiced_frames.append(frame)
-
-    if not voiced_frames:
+    pcm = np.clip(np.asarray(waveform) * 32768, -32768, 32767).astype(np.int16)
+    frame_len = sr * frame_ms // 1000
+    n_frames = len(pcm) // frame_len
+    buf = memoryview(pcm[: n_frames * frame_len].tobytes())
+    step = frame_len * 2
+    vad = new_vad()
+    return np.fromiter(
+        (vad.is_speech(buf[i * step:(i + 1) * step], sr) for i in range(n_frames)),
+        dtype=bool,
+        count=n_frames,
+    )
+
+@timed("vad")
+def vad_segments(waveform, sr=16000, frame_ms=VAD_FRAME_MS, padding_ms=VAD_PADDING_MS,
+                 merge_gap_ms=VAD_MERGE_GAP_MS, min_speech_ms=VAD_MIN_SPEECH_MS):
+    """Speech regions as [(start_s, end_s), ...]. Each voiced run is padded by
+    padding_ms on both sides (hangover), runs separated by less than
+    merge_gap_ms are merged, and regions shorter than min_speech_ms dropped."""
+    flags = speech_flags(waveform, sr, frame_ms)
+    if not flags.any():
+        return []
+    edges = np.diff(np.concatenate(([0], flags.view(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+
+    pad = padding_ms // frame_ms
+    starts = np.maximum(starts - pad, 0)
+    ends = np.minimum(ends + pad, len(flags))
+
+    merged = []
+    gap = merge_gap_ms // frame_ms
+    for start, end in zip(starts, ends):
+        if merged and start - merged[-1][1] <= gap:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+
+    min_frames = min_speech_ms // frame_ms
+    sec = frame_ms / 1000.0
+    return [(float(start * sec), float(end * sec)) for start, end in merged if end - start >= min_frames]
+
+def join_segments(waveform, sr, segments):
+    if not segments:
         return np.zeros(1, dtype=np.float32)
+    return np.concatenate([waveform[int(s * sr):int(e * sr)] for s, e in segments]).astype(np.float32, copy=False)
+
+def pause_features(segments, duration_s):
+    """Cheap paralinguistic features from the VAD pause structure."""
+    speech = sum(e - s for s, e in segments)
+    pauses = [b[0] - a[1] for a, b in zip(segments, segments[1:])]
+    return {
+        "speech_segments": len(segments),
+        "speech_seconds": round(float(speech), 3),
+        "pause_count": len(pauses),
+        "mean_pause_seconds": round(float(np.mean(pauses)), 3) if pauses else 0.0,
+        "max_pause_seconds": round(float(max(pauses)), 3) if pauses else 0.0,
+        "speech_ratio": round(float(speech / duration_s), 3) if duration_s > 0 else 0.0,
+    }
+
+# GeMAPS functionals used for the acoustic arousal estimate
+ACOUSTIC_FEATURES = {
+    "loudness": "loudness_sma3_amean",
+    "loudness_peaks_per_sec": "loudnessPeaksPerSec",
+    "pitch_mean": "F0semitoneFrom27.5Hz_sma3nz_amean",
+    "pitch_variability": "F0semitoneFrom27.5Hz_sma3nz_stddevNorm",
+    "jitter": "jitterLocal_sma3nz_amean",
+    "shimmer": "shimmerLocaldB_sma3nz_amean",
+    "hnr": "HNRdBACF_sma3nz_amean",
+    "voiced_segments_per_sec": "VoicedSegmentsPerSec",
+}
+
+@timed("acoustic")
+def acoustic_features(waveform, sr=16000):
+    """openSMILE GeMAPS functionals for a voiced clip, or None if the clip
+    is too short to analyse."""
+    if len(waveform) < sr // 4:
+        return None
+    df = registry.get("smile").process_signal(np.asarray(waveform, dtype=np.float32), sr)
+    row = df.iloc[0]
+    return {name: float(row[column]) for name, column in ACOUSTIC_FEATURES.items() if column in row}
 
-    combined = b''.join(voiced_frames)
-    return np.frombuffer(combined, dtype=np.int16).astype(np.float32) / 32768
+def remove_silence(waveform, sr=16000):
+    return join_segments(waveform, sr, vad_segments(waveform, sr))
+
+def _audio_key(audio_np, tier, *extra):
+    return content_key(np.ascontiguousarray(audio_np, dtype=np.float32).tobytes(), tier, stt_options(), *extra)
+
+@timed("stt")
+def stt_transcribe(audio_np, sr, tier=WHISPER_MODEL):
+    # faster_whisper takes a 16 kHz float32 array directly, no temp file
+    audio_np = resample(np.asarray(audio_np, dtype=np.float32), sr, TARGET_SR)
+    key = _audio_key(audio_np, tier)
+    cached = stt_cache.get(key)
+    if cached is not None:
+        return cached
+    segments, _ = registry.get(whisper_name(tier)).transcribe(audio_np, **stt_options())
+    transcript = " ".join([seg.text for seg in segments])
+    stt_cache.set(key, transcript)
+    return transcript
+
+@timed("stt")
+def stt_transcribe_segments(audio_np, sr, segments, tier=WHISPER_MODEL):
+    """Transcribe only the given speech regions with the given Whisper size,
+    decoding them as a batch. Regions longer than Whisper's 30 s window are
+    split."""
+    if not segments:
+        return ""
+    # Segment times are in seconds; BatchedInferencePipeline takes clip
+    # bounds as sample indices into the 16 kHz audio
+    audio_np = resample(np.asarray(audio_np, dtype=np.float32), sr, TARGET_SR)
+    max_clip = int(WHISPER_MAX_CLIP_S * TARGET_SR)
+    clips = []
+    for start_s, end_s in segments:
+        start = int(start_s * TARGET_SR)
+        end = min(int(end_s * TARGET_SR), len(audio_np))
+        while end - start > max_clip:
+            clips.append({"start": start, "end": start + max_clip})
+            start += max_clip
+        if end > start:
+            clips.append({"start": start, "end": end})
+    if not clips:
+        return ""
+    key = _audio_key(audio_np, tier, clips)
+    cached = stt_cache.get(key)
+    if cached is not None:
+        return cached
+    pipeline = registry.get(whisper_name(tier, batched=True))
+    results, _ = pipeline.transcribe(
+        audio_np,
+        clip_timestamps=clips,
+        vad_filter=False,
+        batch_size=WHISPER_BATCH_SIZE,
+        without_timestamps=True,
+        **stt_options(),
+    )
+    transcript = " ".join(seg.text.strip() for seg in results)
+    stt_cache.set(key, transcript)
+    return transcript
+
+def text_probs_batch(texts):
+    return list(registry.get("sentiment").predict(texts))
+
+sentiment_batcher = SentimentBatcher(
+    text_probs_batch,
+    max_batch_size=SENTIMENT_MAX_BATCH,
+    max_wait_ms=SENTIMENT_MAX_WAIT_MS,
+)
 
-def stt_transcribe(audio_np, sr):
-    with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as tmp:
-        sf.write(tmp.name, audio_np, sr)
-        segments, _ = whisper.transcribe(tmp.name)
-        os.unlink(tmp.name)
-    return " ".join([seg.text for seg in segments])
+def _sentiment_key(text):
+    return content_key(normalize_text(text), SENTIMENT_MODEL, SENTIMENT_ENGINE)
 
+@timed("sentiment")
 def text_probs(text):
-    inp = tokenizer(text, return_tensors="pt")
-    with torch.no_grad():
-        logits = text_net(**inp).logits
-        probs = torch.softmax(logits, dim=-1)
-    return probs.numpy().flatten()
+    key = _sentiment_key(text)
+    probs = sentiment_cache.get(key)
+    if probs is None:
+        probs = sentiment_batcher.submit(text).result()
+        sentiment_cache.set(key, probs)
+    return probs
+
+@timed("sentiment")
+async def atext_probs(text):
+    key = _sentiment_key(text)
+    probs = sentiment_cache.get(key)
+    if probs is None:
+        probs = await asyncio.wrap_future(sentiment_batcher.submit(text))
+        sentiment_cache.set(key, probs)
+    return probs
 
 def log_result(result: dict):
+    # Written to emotion_log.jsonl by analytics_log's background thread
     result["timestamp"] = datetime.utcnow().isoformat()
-    with open(LOG_FILE, "a") as f:
-        f.write(json.dumps(result) + "\n")
+    emotion_log.log(dict(result))
 
 # ---------- 2. FASTAPI ENDPOINT ---------------------------
 app = FastAPI()
 
 @app.post("/emotion")
 async def emotion(file: UploadFile):
-    raw = await file.read()
     filename = file.filename  # <--- Get the uploaded file name
-
-    wav = wave.open(io.BytesIO(raw))
-    sr = wav.getframerate()
-    audio = np.frombuffer(wav.readframes(wav.getnframes()), dtype=np.int16).astype(np.float32) / 32768
-    audio = remove_silence(audio, sr)
+    with await spool_upload(file) as spool:
+        audio = decode_to_pcm16k(spool, filename)
+    sr = TARGET_SR
+    segments = vad_segments(audio, sr)
 
     # Transcription
-    transcript = stt_transcribe(audio, sr)
+    transcript = stt_transcribe_segments(audio, sr, segments)
+    pauses = pause_features(segments, len(audio) / sr)
+    audio = join_segments(audio, sr, segments)
     p_tx = text_probs(transcript)
     text_emotion = EMOTION_LABELS[np.argmax(p_tx)]
     confidence_matrix = {EMOTION_LABELS[i]: float(p_tx[i]) for i in range(len(EMOTION_LABELS))}
@@ -97,7 +242,8 @@ async def emotion(file: UploadFile):
         "valence": valence,
         "arousal": arousal,
         "transcript": transcript.strip(),
-        "confidence_matrix": confidence_matrix
+        "confidence_matrix": confidence_matrix,
+        "pauses": pauses
     }
 
     log_result(result)
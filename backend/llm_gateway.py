@@ -0,0 +1,373 @@
+# llm_gateway.py
+
+import os
+import time
+import random
+import asyncio
+import argparse
+import threading
+import logging
+import weakref
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional
+import httpx
+import openai
+from pydantic import PrivateAttr
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+from metrics import LLM_CALL_SECONDS, LLM_TOKENS, LLM_RETRIES, LLM_HEDGES, log_event
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Every node reaches Azure OpenAI through one GatewayChatModel (registry
+# "llm"). It keeps pooled keep-alive HTTP connections, bounds each call by a
+# deadline, retries transient failures with jittered backoff, can hedge slow
+# non-streaming calls with a second request, and records latency and token
+# usage per call. Point AZURE_OPENAI_ENDPOINT at frontend/mockserver to run it
+# locally (python llm_gateway.py --check).
+LLM_GATEWAY = os.getenv("LLM_GATEWAY", "true").lower() == "true"
+LLM_DEADLINE_S = float(os.getenv("LLM_DEADLINE_S", "30"))
+LLM_ATTEMPT_TIMEOUT_S = float(os.getenv("LLM_ATTEMPT_TIMEOUT_S", "15"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_BACKOFF_BASE_S = float(os.getenv("LLM_BACKOFF_BASE_S", "0.25"))
+LLM_BACKOFF_MAX_S = float(os.getenv("LLM_BACKOFF_MAX_S", "4"))
+# Start a second identical request if the first has not answered after this
+# long (0 = off). Doubles the cost of the slowest calls, so keep it near p95.
+LLM_HEDGE_AFTER_MS = float(os.getenv("LLM_HEDGE_AFTER_MS", "0"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "32"))
+LLM_KEEPALIVE_S = float(os.getenv("LLM_KEEPALIVE_S", "60"))
+
+RETRYABLE = (
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+    httpx.TransportError,
+    asyncio.TimeoutError,
+)
+
+class LLMDeadlineExceeded(TimeoutError):
+    """The call did not finish within LLM_DEADLINE_S, retries included."""
+
+def azure_chat(max_retries: int = 0, **client_kwargs):
+    """The underlying AzureChatOpenAI; behind the gateway, retries are the
+    gateway's job."""
+    from langchain_openai import AzureChatOpenAI
+    return AzureChatOpenAI(
+        openai_api_type="azure",
+        openai_api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+        openai_api_version=os.getenv("AZURE_OPENAI_API_VERSION"),
+        azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+        deployment_name=os.getenv("AZURE_OPENAI_DEPLOYMENT_GPT_4o_mini"),
+        timeout=LLM_ATTEMPT_TIMEOUT_S,
+        max_retries=max_retries,
+        stream_usage=True,
+        **client_kwargs,
+    )
+
+def _pool_limits() -> httpx.Limits:
+    return httpx.Limits(max_connections=LLM_MAX_CONNECTIONS, max_keepalive_connections=LLM_MAX_CONNECTIONS,
+                        keepalive_expiry=LLM_KEEPALIVE_S)
+
+def _usage(message) -> Dict[str, int]:
+    usage = getattr(message, "usage_metadata", None) or {}
+    return {"prompt": usage.get("input_tokens", 0), "completion": usage.get("output_tokens", 0)}
+
+class GatewayChatModel(BaseChatModel):
+    deadline_s: float = LLM_DEADLINE_S
+    attempt_timeout_s: float = LLM_ATTEMPT_TIMEOUT_S
+    max_retries: int = LLM_MAX_RETRIES
+    hedge_after_ms: float = LLM_HEDGE_AFTER_MS
+
+    _factory: Dict[str, Callable[..., BaseChatModel]] = PrivateAttr(default_factory=dict)
+    _sync_model: Optional[BaseChatModel] = PrivateAttr(default=None)
+    # httpx.AsyncClient is bound to the loop it first ran on, and the CLI
+    # runs one loop per turn, so async clients are kept per loop.
+    _async_models: Any = PrivateAttr(default_factory=weakref.WeakKeyDictionary)
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+    _stats: Dict[str, float] = PrivateAttr(default_factory=lambda: {
+        "calls": 0, "errors": 0, "retries": 0, "hedges": 0, "hedges_won": 0,
+        "prompt_tokens": 0, "completion_tokens": 0, "seconds": 0.0,
+    })
+
+    def __init__(self, factory: Callable[..., BaseChatModel] = azure_chat, **kwargs):
+        super().__init__(**kwargs)
+        # Kept in a dict: pydantic would bind a bare function as a method
+        self._factory = {"build": factory}
+
+    @property
+    def _llm_type(self) -> str:
+        return "llm-gateway"
+
+    # --------- Pooled clients ---------
+    def _sync(self) -> BaseChatModel:
+        with self._lock:
+            if self._sync_model is None:
+                self._sync_model = self._factory["build"](http_client=httpx.Client(limits=_pool_limits()))
+            return self._sync_model
+
+    def _async(self) -> BaseChatModel:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            model = self._async_models.get(loop)
+            if model is None:
+                model = self._factory["build"](http_async_client=httpx.AsyncClient(limits=_pool_limits()))
+                self._async_models[loop] = model
+            return model
+
+    # --------- Tools / structured output ---------
+    def bind_tools(self, tools, **kwargs):
+        # Let the Azure model format the tools, but keep calls going
+        # through the gateway
+        return self.bind(**self._sync().bind_tools(tools, **kwargs).kwargs)
+
+    def with_structured_output(self, schema, *, method: str = "function_calling", include_raw: bool = False, **kwargs):
+        if method != "function_calling":
+            raise NotImplementedError(f"LLM gateway only supports function calling, not {method}")
+        return super().with_structured_output(schema, include_raw=include_raw, **kwargs)
+
+    # --------- Accounting ---------
+    def _backoff(self, attempt: int, error: BaseException) -> float:
+        delay = random.uniform(0, min(LLM_BACKOFF_MAX_S, LLM_BACKOFF_BASE_S * 2 ** attempt))
+        response = getattr(error, "response", None)
+        retry_after = response.headers.get("retry-after") if response is not None else None
+        if retry_after:
+            try:
+                delay = max(delay, float(retry_after))
+            except ValueError:
+                pass
+        return delay
+
+    def _retrying(self, attempt: int, error: BaseException, deadline: float) -> Optional[float]:
+        """Delay before the next attempt, or None to give up."""
+        if attempt >= self.max_retries:
+            return None
+        delay = self._backoff(attempt, error)
+        if time.monotonic() + delay >= deadline:
+            return None
+        with self._lock:
+            self._stats["retries"] += 1
+        LLM_RETRIES.labels(type(error).__name__).inc()
+        return delay
+
+    def _record(self, start: float, outcome: str, usage: Dict[str, int], attempts: int, hedged: bool = False):
+        elapsed = time.perf_counter() - start
+        LLM_CALL_SECONDS.labels(outcome).observe(elapsed)
+        with self._lock:
+            self._stats["calls"] += 1
+            self._stats["errors"] += outcome != "ok"
+            self._stats["seconds"] += elapsed
+            self._stats["prompt_tokens"] += usage.get("prompt", 0)
+            self._stats["completion_tokens"] += usage.get("completion", 0)
+        for kind in ("prompt", "completion"):
+            if usage.get(kind):
+                LLM_TOKENS.labels(kind).inc(usage[kind])
+        log_event("llm_call", level=logging.DEBUG, duration_ms=round(elapsed * 1000, 1), outcome=outcome, attempts=attempts,
+                  hedged=hedged, prompt_tokens=usage.get("prompt", 0), completion_tokens=usage.get("completion", 0))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["mean_seconds"] = round(stats["seconds"] / stats["calls"], 4) if stats["calls"] else 0.0
+        stats["seconds"] = round(stats["seconds"], 3)
+        return stats
+
+    # --------- Sync calls ---------
+    def _generate(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs) -> ChatResult:
+        model, start = self._sync(), time.perf_counter()
+        deadline = time.monotonic() + self.deadline_s
+        for attempt in range(self.max_retries + 1):
+            # The client enforces the timeout, so hand it what is left of
+            # the deadline rather than a full attempt
+            timeout = min(self.attempt_timeout_s, deadline - time.monotonic())
+            if timeout <= 0:
+                self._record(start, "timeout", {}, attempt)
+                raise LLMDeadlineExceeded(f"LLM call did not finish within {self.deadline_s}s")
+            try:
+                result = model._generate(messages, stop=stop, timeout=timeout, **kwargs)
+                self._record(start, "ok", _usage(result.generations[0].message), attempt + 1)
+                return result
+            except RETRYABLE as e:
+                delay = self._retrying(attempt, e, deadline)
+                if delay is None:
+                    timed_out = isinstance(e, (openai.APITimeoutError, httpx.TimeoutException))
+                    self._record(start, "timeout" if timed_out else "error", {}, attempt + 1)
+                    if timed_out:
+                        raise LLMDeadlineExceeded(f"LLM call did not finish within {self.deadline_s}s") from e
+                    raise
+                time.sleep(delay)
+            except Exception:
+                self._record(start, "error", {}, attempt + 1)
+                raise
+
+    def _stream(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs) -> Iterator[ChatGenerationChunk]:
+        model, start = self._sync(), time.perf_counter()
+        deadline = time.monotonic() + self.deadline_s
+        usage: Dict[str, int] = {}
+        for attempt in range(self.max_retries + 1):
+            emitted = False
+            try:
+                for chunk in model._stream(messages, stop=stop, run_manager=run_manager, **kwargs):
+                    emitted = True
+                    usage = _usage(chunk.message) if getattr(chunk.message, "usage_metadata", None) else usage
+                    yield chunk
+                self._record(start, "ok", usage, attempt + 1)
+                return
+            except RETRYABLE as e:
+                # Output already sent cannot be taken back: only retry
+                # failures before the first chunk
+                delay = None if emitted else self._retrying(attempt, e, deadline)
+                if delay is None:
+                    self._record(start, "error", usage, attempt + 1)
+                    raise
+                time.sleep(delay)
+            except Exception:
+                self._record(start, "error", usage, attempt + 1)
+                raise
+
+    # --------- Async calls ---------
+    async def _hedged(self, call: Callable[[], Any]):
+        """Run call(); if it is still pending after hedge_after_ms, race a
+        second copy and return whichever succeeds first."""
+        if self.hedge_after_ms <= 0:
+            return await call(), False
+        first = asyncio.ensure_future(call())
+        done, _ = await asyncio.wait({first}, timeout=self.hedge_after_ms / 1000)
+        if done:
+            return first.result(), False
+        with self._lock:
+            self._stats["hedges"] += 1
+        second = asyncio.ensure_future(call())
+        pending = {first, second}
+        error: Optional[BaseException] = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        won = task is second
+                        with self._lock:
+                            self._stats["hedges_won"] += won
+                        LLM_HEDGES.labels("hedge" if won else "original").inc()
+                        return task.result(), True
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _agenerate(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs) -> ChatResult:
+        model, start = self._async(), time.perf_counter()
+        deadline = time.monotonic() + self.deadline_s
+        hedged = False
+        for attempt in range(self.max_retries + 1):
+            timeout = min(self.attempt_timeout_s, deadline - time.monotonic())
+            try:
+                result, hedged = await asyncio.wait_for(
+                    self._hedged(lambda: model._agenerate(messages, stop=stop, **kwargs)), timeout
+                )
+                self._record(start, "ok", _usage(result.generations[0].message), attempt + 1, hedged)
+                return result
+            except RETRYABLE as e:
+                delay = self._retrying(attempt, e, deadline)
+                if delay is None:
+                    self._record(start, "timeout" if isinstance(e, asyncio.TimeoutError) else "error", {}, attempt + 1, hedged)
+                    if isinstance(e, asyncio.TimeoutError):
+                        raise LLMDeadlineExceeded(f"LLM call did not finish within {self.deadline_s}s") from e
+                    raise
+                await asyncio.sleep(delay)
+            except Exception:
+                self._record(start, "error", {}, attempt + 1, hedged)
+                raise
+
+    async def _astream(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs) -> AsyncIterator[ChatGenerationChunk]:
+        model, start = self._async(), time.perf_counter()
+        deadline = time.monotonic() + self.deadline_s
+        usage: Dict[str, int] = {}
+        for attempt in range(self.max_retries + 1):
+            emitted = False
+            chunks = model._astream(messages, stop=stop, run_manager=run_manager, **kwargs)
+            try:
+                while True:
+                    # Each chunk (the first one included) must arrive within
+                    # the attempt timeout and before the overall deadline
+                    timeout = min(self.attempt_timeout_s, deadline - time.monotonic())
+                    try:
+                        chunk = await asyncio.wait_for(chunks.__anext__(), max(timeout, 0.0))
+                    except StopAsyncIteration:
+                        break
+                    emitted = True
+                    if getattr(chunk.message, "usage_metadata", None):
+                        usage = _usage(chunk.message)
+                    yield chunk
+                self._record(start, "ok", usage, attempt + 1)
+                return
+            except RETRYABLE as e:
+                delay = None if emitted else self._retrying(attempt, e, deadline)
+                if delay is None:
+                    self._record(start, "timeout" if isinstance(e, asyncio.TimeoutError) else "error", usage, attempt + 1)
+                    if isinstance(e, asyncio.TimeoutError):
+                        raise LLMDeadlineExceeded(f"LLM stream stalled or exceeded {self.deadline_s}s") from e
+                    raise
+                await asyncio.sleep(delay)
+            except Exception:
+                self._record(start, "error", usage, attempt + 1)
+                raise
+            finally:
+                await chunks.aclose()
+
+def gateway_stats() -> Dict[str, Any]:
+    """Counters of the registry's gateway (empty until it is loaded)."""
+    from model_registry import registry
+    llm = registry.get("llm") if registry.is_loaded("llm") else None
+    return llm.stats() if isinstance(llm, GatewayChatModel) else {}
+
+def build_llm() -> BaseChatModel:
+    """The registry's "llm": the gateway, or a plain AzureChatOpenAI with
+    LLM_GATEWAY=false."""
+    if not LLM_GATEWAY:
+        return azure_chat(max_retries=LLM_MAX_RETRIES)
+    return GatewayChatModel()
+
+# --------- Self-check against an endpoint ---------
+async def _check(n: int, concurrency: int, stream: bool):
+    from langchain_core.messages import HumanMessage
+    llm = GatewayChatModel()
+    sem = asyncio.Semaphore(concurrency)
+    latencies, failures = [], 0
+
+    async def one(i):
+        nonlocal failures
+        async with sem:
+            t0 = time.perf_counter()
+            try:
+                messages = [HumanMessage(content=f"Say something kind ({i})")]
+                if stream:
+                    async for _ in llm.astream(messages):
+                        pass
+                else:
+                    await llm.ainvoke(messages)
+                latencies.append(time.perf_counter() - t0)
+            except Exception as e:
+                failures += 1
+                print(f"⚠️ Call {i} failed: {type(e).__name__}: {e}")
+
+    await asyncio.gather(*(one(i) for i in range(n)))
+    if latencies:
+        latencies.sort()
+        pick = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000
+        print(f"✅ {len(latencies)}/{n} ok  p50 {pick(0.5):.1f} ms  p95 {pick(0.95):.1f} ms  max {latencies[-1] * 1000:.1f} ms")
+    print(f"📝 {llm.stats()} ({failures} failed)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Exercise the LLM gateway against AZURE_OPENAI_ENDPOINT (e.g. the mockserver)")
+    parser.add_argument("--check", action="store_true", help="send test calls and print latency, retries and token usage")
+    parser.add_argument("-n", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--stream", action="store_true")
+    args = parser.parse_args()
+    if args.check:
+        asyncio.run(_check(args.n, args.concurrency, args.stream))
+    else:
+        parser.print_help()
@@ -1,11 +1,9 @@
-import os
-import json
-import numpy as np
-import soundfile as sf
+import asyncio
 import sounddevice as sd
 from orchestrator import chatbot
-
-PROFILE_PATH = "user_profiles.json"
+from profile_store import get_profile_store
+from condition_pipeline import get_condition_pipeline
+from context_builder import wait_for_summaries
 
 def load_audio_from_mic(duration=5, sr=16000):
     print("🎙️ Listening... (Speak now)")
@@ -15,25 +13,16 @@ def load_audio_from_mic(duration=5, sr=16000):
     return audio.flatten(), sr
 
 def load_user_profile(user_id):
-    if os.path.exists(PROFILE_PATH):
-        with open(PROFILE_PATH, "r") as f:
-            return json.load(f).get(user_id, None)
-    return None
+    return get_profile_store().get_profile(user_id)
 
 def save_user_profile(user_id, name, age):
-    data = {}
-    if os.path.exists(PROFILE_PATH):
-        with open(PROFILE_PATH, "r") as f:
-            data = json.load(f)
-
-    data[user_id] = {
-        "name": name,
-        "age": age,
-        "conditions": []  # This will be inferred from chat history over time
-    }
-
-    with open(PROFILE_PATH, "w") as f:
-        json.dump(data, f, indent=2)
+    # Conditions start empty and are inferred from chat history over time
+    get_profile_store().create_profile(user_id, name, age)
+async def run_turn(inputs, user_id):
+    final_state = await chatbot.ainvoke(inputs, config={"configurable": {"thread_id": user_id}})
+    await wait_for_summaries()
+    return final_state
+
 def main():
     user_id = input("Enter your user ID: ").strip()
 
@@ -52,6 +41,7 @@ def main():
         user_input = input("\nYou (type 'text <message>' or 'mic' to record or 'END'): ").strip()
 
         if user_input.upper() == "END":
+            get_condition_pipeline().stop()
             print("👋 Exiting chatbot. Goodbye!")
             break
 
@@ -84,7 +74,7 @@ def main():
             print("⚠️ Invalid input. Use 'text <msg>' or 'mic'")
             continue
 
-        final_state = chatbot.invoke(inputs, config={"configurable": {"thread_id": user_id}})
+        final_state = asyncio.run(run_turn(inputs, user_id))
 
         if inputs["user_input"]["type"] == "audio":
             print(f"\n📝 You (Transcript): {final_state.get('transcript', '[No transcript]')}\n")
@@ -0,0 +1,237 @@
+# metrics.py
+
+import os
+import sys
+import json
+import time
+import uuid
+import inspect
+import logging
+import threading
+import functools
+import contextvars
+from collections import Counter as Tally
+from typing import Callable, Dict, List, Optional
+from prometheus_client import Counter, Histogram, CONTENT_TYPE_LATEST, REGISTRY, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Sampling profiler rate; 0 keeps it off. Samples are served on /debug/profile.
+PROFILER_SAMPLE_HZ = float(os.getenv("PROFILER_SAMPLE_HZ", "0"))
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+
+# --------- 1. Metrics ---------------------
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+NODE_SECONDS = Histogram("chatbot_node_seconds", "LangGraph node latency", ["node"], buckets=LATENCY_BUCKETS)
+STAGE_SECONDS = Histogram("chatbot_stage_seconds", "Sub-stage latency (model calls, LLM, storage I/O)", ["stage"], buckets=LATENCY_BUCKETS)
+STAGE_ERRORS = Counter("chatbot_stage_errors_total", "Sub-stage and node failures", ["stage"])
+STAGE_QUEUE_SECONDS = Histogram("chatbot_stage_queue_seconds", "Time spent waiting for a stage's concurrency slot", ["stage"], buckets=LATENCY_BUCKETS)
+HTTP_SECONDS = Histogram("chatbot_http_request_seconds", "HTTP request latency", ["method", "route"], buckets=LATENCY_BUCKETS)
+HTTP_REQUESTS = Counter("chatbot_http_requests_total", "HTTP requests", ["method", "route", "status"])
+LLM_CALL_SECONDS = Histogram("chatbot_llm_call_seconds", "LLM gateway call latency, retries included", ["outcome"], buckets=LATENCY_BUCKETS)
+LLM_TOKENS = Counter("chatbot_llm_tokens_total", "Tokens reported by the LLM API", ["kind"])
+LLM_RETRIES = Counter("chatbot_llm_retries_total", "LLM gateway retries by error type", ["error"])
+LLM_HEDGES = Counter("chatbot_llm_hedges_total", "Hedged LLM calls by which request answered first", ["winner"])
+ADMISSION_WAIT_SECONDS = Histogram("chatbot_admission_wait_seconds", "Time a turn waited for an admission slot", ["endpoint_class"], buckets=LATENCY_BUCKETS)
+ADMISSION_REJECTED = Counter("chatbot_admission_rejected_total", "Turns turned away by admission control", ["endpoint_class", "reason"])
+STT_TIER_SECONDS = Histogram("chatbot_stt_tier_seconds", "Whisper decode time by model tier", ["tier"], buckets=LATENCY_BUCKETS)
+PROMPT_TOKENS = Histogram("chatbot_prompt_tokens", "Tokens in each reply prompt", buckets=(250, 500, 1000, 1500, 2000, 3000, 4000, 6000, 8000))
+HISTORY_MESSAGES = Histogram("chatbot_prompt_history_messages", "History messages in each reply prompt", buckets=(0, 1, 2, 4, 8, 12, 16, 24, 32))
+STT_SLO_MISSES = Counter("chatbot_stt_slo_misses_total", "STT requests (queueing included) slower than STT_LATENCY_SLO_MS", ["tier"])
+
+class timed:
+    """Record the duration of a block or function in a histogram.
+
+    Works as a context manager (sync or async) and as a decorator for both
+    plain and coroutine functions:
+
+        @timed("stt")
+        def stt_transcribe(...): ...
+
+        async with timed("llm"):
+            response = await llm.ainvoke(...)
+    """
+
+    def __init__(self, stage: str, histogram: Histogram = STAGE_SECONDS):
+        self.stage = stage
+        self.histogram = histogram
+
+    # Start times live on a context-local stack, so one instance can time
+    # overlapping blocks in different threads or tasks.
+    def __enter__(self):
+        _starts.set(_starts.get() + (time.perf_counter(),))
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        stack = _starts.get()
+        _starts.set(stack[:-1])
+        elapsed = time.perf_counter() - stack[-1]
+        self.histogram.labels(self.stage).observe(elapsed)
+        for observer in _observers:
+            observer(self.stage, elapsed)
+        if exc_type is not None:
+            STAGE_ERRORS.labels(self.stage).inc()
+        return False
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return self.__exit__(exc_type, exc, tb)
+
+    def __call__(self, fn: Callable):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                async with self:
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with self:
+                return fn(*args, **kwargs)
+        return wrapper
+
+_starts: contextvars.ContextVar[tuple] = contextvars.ContextVar("timer_starts", default=())
+_observers: List[Callable[[str, float], None]] = []
+
+def add_observer(observer: Callable[[str, float], None]):
+    """Also hand every timing to observer(stage, seconds), e.g. to keep raw
+    samples for exact percentiles in benchmarks."""
+    _observers.append(observer)
+
+def remove_observer(observer: Callable[[str, float], None]):
+    if observer in _observers:
+        _observers.remove(observer)
+
+def timed_node(node: str) -> timed:
+    return timed(node, histogram=NODE_SECONDS)
+
+# --------- 2. Existing Stats as Gauges ----
+_stats_sources: Dict[str, Callable[[], Dict]] = {}
+
+def register_stats(prefix: str, source: Callable[[], Dict]):
+    """Expose a stats() dict (numbers, optionally nested one level by name,
+    e.g. per-cache stats) as chatbot_<prefix>_<key> gauges."""
+    _stats_sources[prefix] = source
+
+class _StatsCollector:
+    def collect(self):
+        for prefix, source in list(_stats_sources.items()):
+            try:
+                stats = source()
+            except Exception as e:
+                log_event("stats_error", level=logging.WARNING, source=prefix, error=str(e))
+                continue
+            flat, nested = {}, {}
+            for key, value in stats.items():
+                if isinstance(value, dict):
+                    for sub_key, sub_value in value.items():
+                        nested.setdefault(sub_key, {})[key] = sub_value
+                else:
+                    flat[key] = value
+            for key, value in flat.items():
+                if isinstance(value, (int, float)):
+                    yield GaugeMetricFamily(f"chatbot_{prefix}_{key}", f"{prefix} {key}", value=float(value))
+            for key, by_name in nested.items():
+                family = GaugeMetricFamily(f"chatbot_{prefix}_{key}", f"{prefix} {key}", labels=["name"])
+                for name, value in by_name.items():
+                    if isinstance(value, (int, float)):
+                        family.add_metric([name], float(value))
+                yield family
+
+REGISTRY.register(_StatsCollector())
+
+def render_metrics():
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+# --------- 3. Trace IDs and Structured Logs
+trace_id_var: contextvars.ContextVar[str] = contextvars.ContextVar("trace_id", default="-")
+
+def new_trace_id(incoming: Optional[str] = None) -> str:
+    trace_id = incoming or uuid.uuid4().hex
+    trace_id_var.set(trace_id)
+    return trace_id
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "event": record.getMessage(),
+            "trace_id": trace_id_var.get(),
+        }
+        entry.update(getattr(record, "fields", {}))
+        return json.dumps(entry, default=str)
+
+logger = logging.getLogger("chatbot")
+if not logger.handlers:
+    _handler = logging.StreamHandler(sys.stdout)
+    _handler.setFormatter(JSONFormatter())
+    logger.addHandler(_handler)
+    logger.setLevel(LOG_LEVEL)
+    logger.propagate = False
+
+def log_event(event: str, level: int = logging.INFO, **fields):
+    """One JSON log line tagged with the current request's trace ID."""
+    logger.log(level, event, extra={"fields": fields})
+
+# --------- 4. Sampling Profiler -----------
+class SamplingProfiler:
+    """Low-overhead wall-clock profiler: a daemon thread snapshots every
+    thread's stack at a fixed rate and counts collapsed stacks
+    ("outer;inner;leaf"), the input format for flame graph tools."""
+
+    def __init__(self, hz: float = PROFILER_SAMPLE_HZ, max_depth: int = 48):
+        self.interval = 1.0 / hz if hz > 0 else 0.01
+        self.max_depth = max_depth
+        self.samples: Tally = Tally()
+        self.total = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+            self._thread = None
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            with self._lock:
+                for ident, frame in frames.items():
+                    if ident == own:
+                        continue
+                    stack = []
+                    while frame is not None and len(stack) < self.max_depth:
+                        code = frame.f_code
+                        stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                        frame = frame.f_back
+                    self.samples[";".join(reversed(stack))] += 1
+                self.total += 1
+
+    def collapsed(self, limit: int = 200) -> str:
+        with self._lock:
+            top = self.samples.most_common(limit)
+        return "\n".join(f"{stack} {count}" for stack, count in top)
+
+    def reset(self):
+        with self._lock:
+            self.samples.clear()
+            self.total = 0
+
+profiler = SamplingProfiler()
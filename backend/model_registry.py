@@ -0,0 +1,145 @@
+# model_registry.py
+
+import os
+import time
+import threading
+from functools import partial
+from typing import Any, Callable, Dict, Iterable
+from dotenv import load_dotenv
+
+load_dotenv()
+
+WHISPER_MODEL = os.getenv("WHISPER_MODEL", "medium")
+# Whisper sizes available to STT tiering (stt_tiering.py), smallest first.
+# Each is registered as "whisper:<size>" and loaded on first use.
+WHISPER_TIERS = [t.strip() for t in os.getenv("WHISPER_TIERS", "tiny,base,small,medium").split(",") if t.strip()]
+# Models that must be loaded before /readyz reports ready.
+REQUIRED_MODELS = [m for m in os.getenv("REQUIRED_MODELS", "sentiment,llm").split(",") if m.strip()]
+# Models loaded in the background at API startup (defaults to the required
+# ones, so a text-only deployment never loads whisper/smile). Everything
+# else loads on first use.
+WARMUP_MODELS = [m for m in os.getenv("WARMUP_MODELS", ",".join(REQUIRED_MODELS)).split(",") if m.strip()]
+# When set, Whisper, sentiment and openSMILE run in a shared model server
+# process (model_server.py) and these entries become thin clients.
+MODEL_SERVER_ADDRESS = os.getenv("MODEL_SERVER_ADDRESS", "")
+
+# --------- 1. Registry --------------------
+class ModelRegistry:
+    """Loads each model once, on first get() or via warmup(), and records
+    its load state and load time for the health endpoints."""
+
+    def __init__(self):
+        self._loaders: Dict[str, Callable[[], Any]] = {}
+        self._models: Dict[str, Any] = {}
+        self._status: Dict[str, Dict[str, Any]] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._guard = threading.Lock()
+
+    def register(self, name: str, loader: Callable[[], Any]):
+        with self._guard:
+            self._loaders[name] = loader
+            self._locks.setdefault(name, threading.Lock())
+            self._status.setdefault(name, {"state": "not_loaded", "load_seconds": None, "error": None})
+
+    def get(self, name: str) -> Any:
+        model = self._models.get(name)
+        if model is not None:
+            return model
+        if name not in self._loaders:
+            raise KeyError(f"Unknown model: {name}")
+        with self._locks[name]:
+            if name in self._models:
+                return self._models[name]
+            self._status[name] = {"state": "loading", "load_seconds": None, "error": None}
+            start = time.perf_counter()
+            try:
+                model = self._loaders[name]()
+            except Exception as e:
+                self._status[name] = {"state": "failed", "load_seconds": None, "error": str(e)}
+                raise
+            self._models[name] = model
+            self._status[name] = {"state": "ready", "load_seconds": round(time.perf_counter() - start, 3), "error": None}
+            print(f"✅ Loaded model '{name}' in {self._status[name]['load_seconds']}s")
+            return model
+
+    def override(self, name: str, model: Any):
+        """Install an already-built model (e.g. a fake LLM for benchmarks)."""
+        with self._guard:
+            self._locks.setdefault(name, threading.Lock())
+        self._models[name] = model
+        self._status[name] = {"state": "ready", "load_seconds": 0.0, "error": None}
+
+    def is_loaded(self, name: str) -> bool:
+        return name in self._models
+
+    def warmup(self, names: Iterable[str]):
+        for name in names:
+            try:
+                self.get(name.strip())
+            except Exception as e:
+                print(f"⚠️ Warmup of '{name}' failed: {e}")
+
+    def status(self) -> Dict[str, Dict[str, Any]]:
+        return {name: dict(s) for name, s in self._status.items()}
+
+# --------- 2. Loaders ---------------------
+# Heavy imports live inside the loaders so a text-only worker never imports
+# faster_whisper or opensmile.
+def _remote(kind: str, *args):
+    import model_server
+    return getattr(model_server, kind)(model_server.get_model_client(), *args)
+
+def whisper_name(size: str = WHISPER_MODEL, batched: bool = False) -> str:
+    """Registry name for a Whisper size; WHISPER_MODEL keeps the plain
+    "whisper"/"whisper_batched" names so it is never loaded twice."""
+    base = "whisper_batched" if batched else "whisper"
+    return base if size == WHISPER_MODEL else f"{base}:{size}"
+
+def _load_whisper(size: str = WHISPER_MODEL):
+    if MODEL_SERVER_ADDRESS:
+        return _remote("RemoteWhisper", whisper_name(size))
+    from faster_whisper import WhisperModel
+    return WhisperModel(size, device="cpu", compute_type="int8")
+
+def _load_whisper_batched(size: str = WHISPER_MODEL):
+    # Batched decoding of several speech segments per forward pass
+    if MODEL_SERVER_ADDRESS:
+        return _remote("RemoteWhisper", whisper_name(size, batched=True))
+    from faster_whisper import BatchedInferencePipeline
+    return BatchedInferencePipeline(model=registry.get(whisper_name(size)))
+
+def _load_smile():
+    if MODEL_SERVER_ADDRESS:
+        return _remote("RemoteSmile")
+    import opensmile
+    return opensmile.Smile(
+        feature_set=opensmile.FeatureSet.GeMAPSv01b,
+        feature_level=opensmile.FeatureLevel.Functionals,
+    )
+
+def _load_sentiment():
+    # PyTorch or quantized ONNX Runtime, chosen by SENTIMENT_ENGINE
+    if MODEL_SERVER_ADDRESS:
+        return _remote("RemoteSentiment")
+    from sentiment_engine import load_engine
+    return load_engine()
+
+def _load_llm():
+    # Azure OpenAI behind the pooled, retrying gateway (llm_gateway.py)
+    from llm_gateway import build_llm
+    return build_llm()
+
+registry = ModelRegistry()
+registry.register("whisper", _load_whisper)
+registry.register("whisper_batched", _load_whisper_batched)
+for _size in WHISPER_TIERS:
+    if _size != WHISPER_MODEL:
+        registry.register(whisper_name(_size), partial(_load_whisper, _size))
+        registry.register(whisper_name(_size, batched=True), partial(_load_whisper_batched, _size))
+registry.register("smile", _load_smile)
+registry.register("sentiment", _load_sentiment)
+registry.register("llm", _load_llm)
+
+def get_llm():
+    """The shared chat model used by every graph node."""
+    return registry.get("llm")
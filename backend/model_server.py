@@ -0,0 +1,406 @@
+# model_server.py
+
+import os
+import time
+import queue
+import pickle
+import secrets
+import ipaddress
+import argparse
+import itertools
+import threading
+import numpy as np
+from concurrent.futures import Future
+from multiprocessing import shared_memory, resource_tracker
+from multiprocessing.connection import Client, Connection, Listener
+from typing import Any, Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# One process holds Whisper, RoBERTa and openSMILE; any number of uvicorn
+# workers talk to it over local IPC instead of loading their own copies.
+# Audio goes through shared memory, text batches and results are pickled
+# over the connection. Set MODEL_SERVER_ADDRESS in the API workers (several
+# comma-separated addresses spread load over a pool of servers).
+MODEL_SERVER_ADDRESS = os.getenv("MODEL_SERVER_ADDRESS", "")
+# Connections carry pickles, so every peer must know the key. Without
+# MODEL_SERVER_AUTHKEY the server only binds to loopback/Unix sockets and
+# writes a random key to MODEL_SERVER_KEY_FILE (mode 0600) for the API
+# workers of the same user to read.
+MODEL_SERVER_AUTHKEY = os.getenv("MODEL_SERVER_AUTHKEY", "")
+MODEL_SERVER_KEY_FILE = os.getenv("MODEL_SERVER_KEY_FILE", "model_server.key")
+MODEL_SERVER_MODELS = os.getenv("MODEL_SERVER_MODELS", "sentiment,whisper,whisper_batched,smile")
+# Per-lane queue bounds; a full lane answers "busy" instead of queueing.
+MODEL_SERVER_QUEUE = int(os.getenv("MODEL_SERVER_QUEUE", "32"))
+MODEL_SERVER_STT_WORKERS = int(os.getenv("MODEL_SERVER_STT_WORKERS", "1"))
+MODEL_SERVER_TIMEOUT = float(os.getenv("MODEL_SERVER_TIMEOUT", "120"))
+# Longest wait between attempts to reconnect to a server that went away
+MODEL_SERVER_RECONNECT_MAX_S = float(os.getenv("MODEL_SERVER_RECONNECT_MAX_S", "10"))
+
+class ModelServerBusy(Exception):
+    """The model server's queue for this kind of work is full."""
+
+class ModelServerError(Exception):
+    pass
+
+def parse_address(address: str):
+    """"host:port" for TCP (host defaults to 127.0.0.1), anything else is a
+    Unix socket path."""
+    host, sep, port = address.rpartition(":")
+    if sep and port.isdigit():
+        return (host or "127.0.0.1", int(port))
+    return address
+
+def is_local_address(address: str) -> bool:
+    parsed = parse_address(address)
+    if isinstance(parsed, str):
+        return True  # Unix socket
+    host = parsed[0]
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+def server_authkey(address: str) -> bytes:
+    """MODEL_SERVER_AUTHKEY, or a fresh random key written to
+    MODEL_SERVER_KEY_FILE for local-only servers."""
+    if MODEL_SERVER_AUTHKEY:
+        return MODEL_SERVER_AUTHKEY.encode()
+    if not is_local_address(address):
+        raise ModelServerError(f"Refusing to listen on {address} without MODEL_SERVER_AUTHKEY")
+    key = secrets.token_hex(32)
+    fd = os.open(MODEL_SERVER_KEY_FILE, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        os.fchmod(f.fileno(), 0o600)  # in case the file already existed
+        f.write(key)
+    return key.encode()
+
+def client_authkey() -> bytes:
+    if MODEL_SERVER_AUTHKEY:
+        return MODEL_SERVER_AUTHKEY.encode()
+    try:
+        with open(MODEL_SERVER_KEY_FILE) as f:
+            return f.read().strip().encode()
+    except FileNotFoundError:
+        raise ModelServerError(
+            f"No model server key: set MODEL_SERVER_AUTHKEY or start the model server first "
+            f"(it writes {MODEL_SERVER_KEY_FILE})"
+        ) from None
+
+# --------- 1. Shared-Memory Audio ---------
+def share_audio(audio: np.ndarray) -> Tuple[shared_memory.SharedMemory, Dict[str, Any]]:
+    audio = np.ascontiguousarray(audio, dtype=np.float32)
+    shm = shared_memory.SharedMemory(create=True, size=max(audio.nbytes, 1))
+    np.ndarray(audio.shape, dtype=np.float32, buffer=shm.buf)[:] = audio
+    return shm, {"shm": shm.name, "length": len(audio)}
+
+def read_shared_audio(ref: Dict[str, Any]) -> np.ndarray:
+    shm = shared_memory.SharedMemory(name=ref["shm"])
+    try:
+        # The client owns (and unlinks) the segment
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return np.ndarray((ref["length"],), dtype=np.float32, buffer=shm.buf).copy()
+    finally:
+        shm.close()
+
+# --------- 2. Server ----------------------
+class _Lane:
+    """A bounded queue of jobs served by a fixed number of threads."""
+
+    def __init__(self, name: str, workers: int, maxsize: int):
+        self.name = name
+        self.jobs: "queue.Queue[tuple]" = queue.Queue(maxsize=maxsize)
+        self._lock = threading.Lock()
+        self._stats = {"served": 0, "rejected": 0, "errors": 0, "busy_seconds": 0.0}
+        for i in range(workers):
+            threading.Thread(target=self._run, name=f"{name}-{i}", daemon=True).start()
+
+    def offer(self, job: tuple) -> bool:
+        try:
+            self.jobs.put_nowait(job)
+            return True
+        except queue.Full:
+            self._count("rejected")
+            return False
+
+    def _count(self, key: str, amount: float = 1):
+        with self._lock:
+            self._stats[key] += amount
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._stats, depth=self.jobs.qsize())
+
+    def _run(self):
+        while True:
+            fn, args, reply = self.jobs.get()
+            start = time.perf_counter()
+            try:
+                reply("ok", fn(*args))
+                self._count("served")
+            except Exception as e:
+                self._count("errors")
+                reply("error", f"{type(e).__name__}: {e}")
+            self._count("busy_seconds", time.perf_counter() - start)
+
+class ModelServer:
+    def __init__(self, address: str, models: List[str], queue_size: int = MODEL_SERVER_QUEUE,
+                 stt_workers: int = MODEL_SERVER_STT_WORKERS):
+        from model_registry import registry
+        from sentiment_batcher import SentimentBatcher
+        self.address = address
+        self.registry = registry
+        self.models = models
+        # Requests from every API worker share one micro-batcher
+        self.batcher = SentimentBatcher(lambda texts: list(registry.get("sentiment").predict(texts)))
+        self.lanes = {
+            "sentiment": _Lane("sentiment", 8, queue_size),
+            "stt": _Lane("stt", stt_workers, queue_size),
+            "acoustic": _Lane("acoustic", 2, queue_size),
+        }
+        self.started = time.time()
+
+    # Handlers run on lane threads
+    def _sentiment(self, texts: List[str]) -> np.ndarray:
+        futures = [self.batcher.submit(text) for text in texts]
+        return np.stack([f.result() for f in futures])
+
+    def _transcribe(self, ref: Dict[str, Any], model: str, kwargs: Dict[str, Any]):
+        segments, _ = self.registry.get(model).transcribe(read_shared_audio(ref), **kwargs)
+        return [(seg.start, seg.end, seg.text) for seg in segments]
+
+    def _acoustic(self, ref: Dict[str, Any], sr: int):
+        return self.registry.get("smile").process_signal(read_shared_audio(ref), sr)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "uptime_seconds": round(time.time() - self.started, 1),
+            "models": self.registry.status(),
+            "lanes": {name: lane.stats() for name, lane in self.lanes.items()},
+            "sentiment_batcher": self.batcher.stats(),
+        }
+
+    def _dispatch(self, op: str, payload: tuple, reply):
+        if op == "ping":
+            return reply("ok", "pong")
+        if op == "stats":
+            return reply("ok", self.stats())
+        if op == "sentiment":
+            lane, job = "sentiment", (self._sentiment, payload)
+        elif op == "transcribe":
+            lane, job = "stt", (self._transcribe, payload)
+        elif op == "acoustic":
+            lane, job = "acoustic", (self._acoustic, payload)
+        else:
+            return reply("error", f"Unknown op: {op}")
+        if not self.lanes[lane].offer(job + (reply,)):
+            reply("busy", lane)
+
+    def _serve_connection(self, conn: Connection):
+        send_lock = threading.Lock()
+        while True:
+            try:
+                request_id, op, payload = conn.recv()
+            except (EOFError, OSError):
+                break
+
+            def reply(status, result, request_id=request_id):
+                with send_lock:
+                    try:
+                        conn.send((request_id, status, result))
+                    except (OSError, pickle.PicklingError) as e:
+                        print(f"⚠️ Could not send model server reply: {e}")
+
+            self._dispatch(op, payload, reply)
+        conn.close()
+
+    def serve_forever(self):
+        authkey = server_authkey(self.address)
+        self.registry.warmup(self.models)
+        listener = Listener(parse_address(self.address), authkey=authkey)
+        print(f"✅ Model server listening on {self.address} with {', '.join(self.models)}")
+        while True:
+            try:
+                conn = listener.accept()
+            except Exception as e:  # failed handshake, e.g. wrong authkey
+                print(f"⚠️ Rejected model server connection: {e}")
+                continue
+            threading.Thread(target=self._serve_connection, args=(conn,), daemon=True).start()
+
+# --------- 3. Client ----------------------
+class ModelClient:
+    """Thread-safe client multiplexing concurrent requests over one
+    connection per server; requests go to the connected server with the
+    fewest in flight. A lost connection fails its pending requests and is
+    re-established in the background with exponential backoff."""
+
+    def __init__(self, addresses: str = MODEL_SERVER_ADDRESS, timeout: float = MODEL_SERVER_TIMEOUT):
+        self.timeout = timeout
+        self._ids = itertools.count()
+        self._pending: Dict[int, Future] = {}
+        self._lock = threading.Lock()
+        self._conns = []
+        for address in [a.strip() for a in addresses.split(",") if a.strip()]:
+            entry = {"conn": self._connect(address), "send_lock": threading.Lock(), "in_flight": 0, "address": address}
+            self._conns.append(entry)
+            threading.Thread(target=self._read, args=(entry,), name=f"model-client-{address}", daemon=True).start()
+        if not self._conns:
+            raise ModelServerError("MODEL_SERVER_ADDRESS is empty")
+
+    @staticmethod
+    def _connect(address: str) -> Connection:
+        # Read the key on every connect: a restarted server without
+        # MODEL_SERVER_AUTHKEY writes a new one
+        return Client(parse_address(address), authkey=client_authkey())
+
+    def _read(self, entry):
+        while True:
+            self._receive(entry)
+            # Connection lost: take it out of rotation, fail everything
+            # still waiting on it and reconnect
+            with self._lock:
+                conn, entry["conn"], entry["in_flight"] = entry["conn"], None, 0
+                lost = [rid for rid, fut in self._pending.items() if getattr(fut, "entry", None) is entry]
+                for rid in lost:
+                    self._pending.pop(rid).set_exception(ModelServerError(f"Lost connection to {entry['address']}"))
+            conn.close()
+            print(f"⚠️ Lost connection to model server {entry['address']}, reconnecting")
+            self._reconnect(entry)
+
+    def _receive(self, entry):
+        """Resolve replies until the connection drops."""
+        while True:
+            try:
+                request_id, status, result = entry["conn"].recv()
+            except (EOFError, OSError):
+                return
+            with self._lock:
+                fut = self._pending.pop(request_id, None)
+                if fut is not None:  # None: the caller timed out and already cleaned up
+                    entry["in_flight"] -= 1
+            if fut is None:
+                continue
+            if status == "ok":
+                fut.set_result(result)
+            elif status == "busy":
+                fut.set_exception(ModelServerBusy(f"Model server {entry['address']} {result} queue is full"))
+            else:
+                fut.set_exception(ModelServerError(result))
+
+    def _reconnect(self, entry):
+        delay = 0.1
+        while True:
+            time.sleep(delay)
+            try:
+                conn = self._connect(entry["address"])
+            except Exception:  # still down, or restarted with another key
+                delay = min(delay * 2, MODEL_SERVER_RECONNECT_MAX_S)
+                continue
+            with self._lock:
+                entry["conn"] = conn
+            print(f"✅ Reconnected to model server {entry['address']}")
+            return
+
+    def call(self, op: str, *payload, entry: Optional[Dict[str, Any]] = None) -> Any:
+        """Send op to the least-loaded connected server, or to entry (one
+        of self._conns) when given."""
+        fut: Future = Future()
+        with self._lock:
+            if entry is None:
+                live = [e for e in self._conns if e["conn"] is not None]
+                if not live:
+                    raise ModelServerError("No model server connection")
+                entry = min(live, key=lambda e: e["in_flight"])
+            elif entry["conn"] is None:
+                raise ModelServerError(f"Lost connection to {entry['address']}")
+            conn = entry["conn"]
+            request_id = next(self._ids)
+            fut.entry = entry
+            self._pending[request_id] = fut
+            entry["in_flight"] += 1
+        try:
+            with entry["send_lock"]:
+                conn.send((request_id, op, payload))
+            return fut.result(timeout=self.timeout)
+        except BaseException:
+            # Timed out or failed to send: stop tracking the request so a late
+            # reply is ignored and the server's in-flight count stays right
+            with self._lock:
+                if self._pending.pop(request_id, None) is not None:
+                    entry["in_flight"] -= 1
+            raise
+
+    def call_with_audio(self, op: str, audio: np.ndarray, *payload) -> Any:
+        shm, ref = share_audio(audio)
+        try:
+            return self.call(op, ref, *payload)
+        finally:
+            shm.close()
+            shm.unlink()
+
+    def stats(self) -> Dict[str, Any]:
+        stats = {}
+        for entry in self._conns:
+            try:
+                stats[entry["address"]] = self.call("stats", entry=entry)
+            except Exception as e:
+                stats[entry["address"]] = {"error": f"{type(e).__name__}: {e}"}
+        return stats
+
+# --------- 4. Registry Proxies ------------
+# Same interfaces as the local models, so emotion_test works unchanged.
+class _RemoteSegment:
+    def __init__(self, start, end, text):
+        self.start, self.end, self.text = start, end, text
+
+class RemoteWhisper:
+    def __init__(self, client: ModelClient, model: str):
+        self.client = client
+        self.model = model
+
+    def transcribe(self, audio, **kwargs):
+        segments = self.client.call_with_audio("transcribe", audio, self.model, kwargs)
+        return [_RemoteSegment(*s) for s in segments], None
+
+class RemoteSentiment:
+    version = "remote"
+
+    def __init__(self, client: ModelClient):
+        self.client = client
+
+    def predict(self, texts: List[str]) -> np.ndarray:
+        return self.client.call("sentiment", list(texts))
+
+class RemoteSmile:
+    def __init__(self, client: ModelClient):
+        self.client = client
+
+    def process_signal(self, audio, sr):
+        return self.client.call_with_audio("acoustic", audio, sr)
+
+_client: Optional[ModelClient] = None
+_client_lock = threading.Lock()
+
+def get_model_client() -> ModelClient:
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = ModelClient()
+        return _client
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve Whisper/RoBERTa/openSMILE to API workers over local IPC")
+    parser.add_argument("--address", default=MODEL_SERVER_ADDRESS or "127.0.0.1:6100",
+                        help="host:port or Unix socket path")
+    parser.add_argument("--models", default=MODEL_SERVER_MODELS, help="models to load before accepting connections")
+    parser.add_argument("--queue", type=int, default=MODEL_SERVER_QUEUE)
+    parser.add_argument("--stt-workers", type=int, default=MODEL_SERVER_STT_WORKERS)
+    args = parser.parse_args()
+    # This process is the model server: the registry must load models
+    # locally even if the shared .env points API workers here.
+    os.environ["MODEL_SERVER_ADDRESS"] = ""
+    models = [m.strip() for m in args.models.split(",") if m.strip()]
+    ModelServer(args.address, models, args.queue, args.stt_workers).serve_forever()
@@ -1,19 +1,39 @@
 # orchestrator.py
 
 import os
-import json
-from typing import TypedDict, Dict, Any
+import logging
+from typing import TypedDict
 from langgraph.graph import StateGraph, END
-from langchain_core.runnables import Runnable
+from langchain_core.runnables import Runnable, RunnableConfig
 from langchain_core.messages import HumanMessage, AIMessage
-from langchain_openai import AzureChatOpenAI
-from langchain_community.chat_message_histories import FileChatMessageHistory
-from emotion_detector import detect_emotion
+from model_registry import get_llm
+from chat_memory import AppendOnlyChatMessageHistory, MEMORY_DIR
+from emotion_detector import adetect_emotion
+from concurrency import run_stage, stage_limit
+from metrics import timed, timed_node, log_event, PROMPT_TOKENS, HISTORY_MESSAGES
 from dotenv import load_dotenv
-from profile_manager import log_conditions  # <-- NEW IMPORT
+from condition_pipeline import get_condition_pipeline
+from profile_store import get_profile_store
+from context_builder import build_context, schedule_summary_update
+from user_context import user_contexts, STATIC_SYSTEM_PROMPT
+from profile_manager import TurnResult, structured_llm, remember_conditions
 
 load_dotenv()
 
+# One structured LLM call returns both the reply and the extracted conditions
+# (instead of a reply call plus a background extraction call).
+FUSED_LLM_CALL = os.getenv("FUSED_LLM_CALL", "false").lower() == "true"
+
+FUSED_INSTRUCTIONS = (
+    "Also extract every medical symptom or health condition mentioned in the user's latest message, "
+    "explicit or implied, including layman terms like sore throat, body aches or feeling sick; leave out "
+    "general emotions unless they clearly indicate a medical concern. "
+    "Return a JSON object {\"reply\": \"<your reply>\", \"conditions\": [\"...\"]}.\n\n"
+)
+
+# Shared by every user and turn, so it is sent first (provider prompt caching)
+SYSTEM_PREFIX = STATIC_SYSTEM_PROMPT + (FUSED_INSTRUCTIONS if FUSED_LLM_CALL else "")
+
 # --------- 1. Define Chat State ----------
 class ChatState(TypedDict):
     user_input: dict
@@ -21,54 +41,45 @@ class ChatState(TypedDict):
     valence: float
     arousal: float
     transcript: str
+    pauses: dict
+    timings: dict
+    stt_tier: str
+    prompt_tokens: int
     bot_response: str
 
 # --------- 2. Azure LLM Setup ------------
-llm = AzureChatOpenAI(
-    openai_api_type="azure",
-    openai_api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-    openai_api_version=os.getenv("AZURE_OPENAI_API_VERSION"),
-    azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
-    deployment_name=os.getenv("AZURE_OPENAI_DEPLOYMENT_GPT_4o_mini"),
-)
+# The shared LLM client (llm_gateway.py) lives in model_registry (get_llm()).
 
 # --------- 3. Persistent Memory Setup ----
-MEMORY_DIR = "chat_memory"
-PROFILE_PATH = "user_profiles.json"
-
-def get_memory(thread_id: str) -> FileChatMessageHistory:
-    os.makedirs(MEMORY_DIR, exist_ok=True)
-    filepath = os.path.join(MEMORY_DIR, f"{thread_id}.json")
-    return FileChatMessageHistory(filepath)
-
-def load_user_profile(user_id: str) -> Dict[str, Any]:
-    if not os.path.exists(PROFILE_PATH):
-        return {}
-    with open(PROFILE_PATH, "r") as f:
-        profiles = json.load(f)
-    return profiles.get(user_id, {})
+def get_memory(thread_id: str) -> AppendOnlyChatMessageHistory:
+    return AppendOnlyChatMessageHistory(thread_id, MEMORY_DIR)
 
 # --------- 4. Node: Detect Emotion -------
-def detect_emotion_node(state: ChatState, config: Dict) -> ChatState:
+@timed_node("detect_emotion")
+async def detect_emotion_node(state: ChatState, config: RunnableConfig) -> ChatState:
     user_input = state["user_input"]
     thread_id = config.get("configurable", {}).get("thread_id", "default_user")
 
-    result = detect_emotion(user_input)
+    result = await adetect_emotion(user_input)
 
     # Show transcript if it's audio
     if user_input["type"] == "audio":
         print(f"\n📝 You (Transcript): {result['transcript']}\n")
 
-    # Log new symptoms if transcript exists
-    if result["transcript"]:
-        log_conditions(thread_id, result["transcript"])
+    # Queue new symptoms for background extraction if transcript exists
+    # (fused mode extracts them in the response call instead)
+    if result["transcript"] and not FUSED_LLM_CALL:
+        await run_stage("profile", get_condition_pipeline().enqueue, thread_id, result["transcript"])
 
     return {
         **state,
         "emotion": result["emotion"],
         "valence": result["valence"],
         "arousal": result["arousal"],
-        "transcript": result["transcript"]
+        "transcript": result["transcript"],
+        "pauses": result.get("pauses", {}),
+        "timings": result.get("timings", {}),
+        "stt_tier": result.get("stt_tier")
     }
 
 # # --------- 5. Node: Generate Response -----
@@ -95,61 +106,54 @@ def detect_emotion_node(state: ChatState, config: Dict) -> ChatState:
 #     }
 
 # --------- 5. Node: Generate Response -----
-def generate_response_node(state: ChatState, config: Dict) -> ChatState:
+async def fused_response(messages, thread_id: str, transcript: str, config: RunnableConfig) -> AIMessage:
+    """Reply and condition extraction in one structured call; conditions are
+    stored directly rather than queued."""
+    try:
+        async with stage_limit("llm"), timed("llm"):
+            result = await structured_llm(TurnResult).ainvoke(messages, config)
+    except ValueError as e:  # invalid or non-conforming structured output
+        print(f"⚠️ Fused response could not be parsed: {e}")
+        return AIMessage(content="I'm here to listen.")
+
+    conditions = remember_conditions(transcript, result.conditions)
+    if conditions:
+        with timed("profile_write"):
+            await run_stage("profile", get_profile_store().add_conditions, thread_id, conditions)
+    return AIMessage(content=result.reply)
+
+@timed_node("generate_response")
+async def generate_response_node(state: ChatState, config: RunnableConfig) -> ChatState:
     thread_id = config.get("configurable", {}).get("thread_id", "default_user")
     memory = get_memory(thread_id)
-    profile = load_user_profile(thread_id)
+    # Profile block and emotion prompts are cached per user until the profile changes
+    user_context = user_contexts.peek(thread_id) or await run_stage("profile", user_contexts.get, thread_id)
 
     user_msg = HumanMessage(content=state["transcript"])
-    emotion = state["emotion"]
-
-    # Format profile context
-    conditions = profile.get('conditions', [])
-    formatted_conditions = ', '.join([c["condition"] for c in conditions]) if conditions else "None"
-    profile_str = (
-        f"User Profile:\n"
-        f"- Name: {profile.get('name', 'Unknown')}\n"
-        f"- Age: {profile.get('age', 'Unknown')}\n"
-        f"- Known Conditions: {formatted_conditions}\n\n"
-    )
-
-    # Generate emotion-specific system prompt
-    def get_emotion_prompt(emotion: str) -> str:
-        emotion = emotion.lower()
-        if emotion in ["sad", "angry", "anxious", "frustrated", "upset", "negative"]:
-            return (
-                f"{profile_str}"
-                "You are a calm and supportive healthcare assistant. "
-                f"The user is currently feeling {emotion}. "
-                "Respond with empathy, be brief, comforting, and directly address their concerns."
-            )
-        elif emotion in ["happy", "excited", "relieved","positive"]:
-            return (
-                f"{profile_str}"
-                "You are a warm and encouraging healthcare assistant. "
-                f"The user is currently feeling {emotion}. "
-                "Respond positively, include relevant health information, and feel free to elaborate helpfully."
-            )
-        else:  # neutral or unrecognized emotion
-            return (
-                f"{profile_str}"
-                "You are a helpful healthcare assistant. "
-                f"The user is currently feeling {emotion}. "
-                "Respond clearly, respectfully, and offer relevant medical guidance or follow-up questions.Be concise in your response & talk to them as a friend."
-            )
-
-    system_msg = HumanMessage(content=get_emotion_prompt(emotion))
-
-    # Add to memory and get LLM response
-    memory.add_message(user_msg)
-    history = memory.messages[-10:]
-    full_prompt = [system_msg] + history
-
-    response = llm.invoke(full_prompt)
-    memory.add_message(response)
+
+    # Static prefix + profile lead the prompt; the emotion guidance follows the history
+    system_prompt = SYSTEM_PREFIX + user_context.profile_block
+    turn_prompt = user_context.emotion_prompt(state["emotion"])
+
+    # Add to memory and build a prompt within the token budget
+    await run_stage("profile", memory.add_message, user_msg)
+    context = await run_stage("profile", build_context, system_prompt, memory, turn_prompt=turn_prompt)
+    PROMPT_TOKENS.observe(context["prompt_tokens"])
+    HISTORY_MESSAGES.observe(context["history_messages"])
+    log_event("prompt_built", level=logging.DEBUG, prompt_tokens=context["prompt_tokens"],
+              history_messages=context["history_messages"])
+
+    if FUSED_LLM_CALL:
+        response = await fused_response(context["messages"], thread_id, state["transcript"], config)
+    else:
+        async with stage_limit("llm"), timed("llm"):
+            response = await get_llm().ainvoke(context["messages"], config)
+    await run_stage("profile", memory.add_message, response)
+    schedule_summary_update(memory)
 
     return {
         **state,
+        "prompt_tokens": context["prompt_tokens"],
         "bot_response": response.content
     }
 
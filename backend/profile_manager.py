@@ -1,79 +1,146 @@
 # profile_manager.py
 
 import os
-import json
-from datetime import datetime
-from typing import List, Dict
+import re
+from typing import List, Dict, Type, TypeVar
+from pydantic import BaseModel, Field, ValidationError
+from langchain_core.runnables import Runnable, RunnableLambda
 from dotenv import load_dotenv
-from langchain_openai import AzureChatOpenAI
+from model_registry import get_llm
+from profile_store import get_profile_store
+from result_cache import ResultCache, content_key, normalize_text
+from metrics import timed
 
 load_dotenv()
 
-PROFILE_PATH = "user_profiles.json"
+# The Azure OpenAI LLM is shared with the orchestrator via model_registry
 
-# Setup Azure OpenAI LLM
-llm = AzureChatOpenAI(
-    openai_api_type="azure",
-    openai_api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-    openai_api_version=os.getenv("AZURE_OPENAI_API_VERSION"),
-    azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
-    deployment_name=os.getenv("AZURE_OPENAI_DEPLOYMENT_GPT_4o_mini"),
-)
+# Extraction results keyed by normalized transcript + deployment, so repeated
+# messages ("I have a headache") skip the LLM call
+condition_cache = ResultCache("conditions")
+
+def _condition_key(text: str) -> str:
+    return content_key(normalize_text(text).lower(), os.getenv("AZURE_OPENAI_DEPLOYMENT_GPT_4o_mini"))
+
+# --------- Structured Output --------------
+# LLM answers are validated against these schemas instead of being eval'd.
+class ExtractedConditions(BaseModel):
+    conditions: List[str] = Field(default_factory=list, description="Distinct symptoms or health conditions")
+
+class NumberedConditions(BaseModel):
+    index: int = Field(description="Paragraph number")
+    conditions: List[str] = Field(default_factory=list)
+
+class BatchConditions(BaseModel):
+    results: List[NumberedConditions] = Field(default_factory=list)
+
+class TurnResult(BaseModel):
+    reply: str = Field(description="The assistant's reply to the user")
+    conditions: List[str] = Field(default_factory=list, description="Symptoms or health conditions in the user's latest message")
 
-# Load all user profiles
-def load_all_profiles() -> Dict[str, Dict]:
-    if os.path.exists(PROFILE_PATH):
-        with open(PROFILE_PATH, "r") as f:
-            return json.load(f)
-    return {}
+Schema = TypeVar("Schema", bound=BaseModel)
 
-# Save updated profiles
-def save_profiles(data: Dict[str, Dict]):
-    with open(PROFILE_PATH, "w") as f:
-        json.dump(data, f, indent=2)
+def parse_structured(content: str, schema: Type[Schema]) -> Schema:
+    """Validate a JSON answer (optionally wrapped in a code fence) against
+    schema. Raises ValidationError on anything else."""
+    text = re.sub(r"^```(?:json)?\s*|\s*```$", "", str(content).strip())
+    return schema.model_validate_json(text)
+
+def structured_llm(schema: Type[Schema]) -> Runnable:
+    """The shared LLM returning validated schema instances: native
+    function-calling where the model supports it, otherwise the JSON reply
+    is parsed with parse_structured (prompts also ask for JSON)."""
+    llm = get_llm()
+    try:
+        return llm.with_structured_output(schema, method="function_calling")
+    except NotImplementedError:
+        return llm | RunnableLambda(lambda message: parse_structured(message.content, schema))
+
+def clean_conditions(items: List[str]) -> List[str]:
+    return [item.strip() for item in items if item and item.strip()]
+
+def remember_conditions(text: str, conditions: List[str]) -> List[str]:
+    """Cache conditions extracted elsewhere (e.g. by the fused reply call)."""
+    extracted = clean_conditions(conditions)
+    condition_cache.set(_condition_key(text), extracted)
+    return extracted
 
 # Ensure user profile exists
 def ensure_user_profile(user_id: str, name: str = "Unknown", age: str = "Unknown") -> Dict:
-    profiles = load_all_profiles()
-    if user_id not in profiles:
-        profiles[user_id] = {
-            "name": name,
-            "age": age,
-            "conditions": []
-        }
-        save_profiles(profiles)
-    return profiles[user_id]
+    return get_profile_store().ensure_profile(user_id, name, age)
+
+# Extraction instructions shared by the single and batched prompts; only the
+# subject and the output format differ.
+CONDITION_INSTRUCTIONS = (
+    "You are a highly trained medical assistant. From {subject}, extract all possible medical symptoms or health conditions mentioned, whether explicitly stated or implied. This includes physical symptoms, psychological symptoms, behavioral signs, neurological issues, or any detail relevant to medical diagnosis or history. "
+    "Do not exclude symptoms that are described in layman terms or as everyday experiences if they could be medically relevant. All terms like sick, pain, sore throat, body aches, fever, cough, cold, headache, etc. should be captured. "
+    "Do not include general emotions or vague feelings unless they clearly indicate a medical concern. "
+)
 
 # Extract health-related information using the LLM
+@timed("condition_extraction")
 def extract_conditions_from_text(text: str) -> List[str]:
+    cached = condition_cache.get(_condition_key(text))
+    if cached is not None:
+        return cached
+    return _extract_conditions_llm(text)
+
+def _extract_conditions_llm(text: str) -> List[str]:
     system_prompt = (
-        "You are a highly trained medical assistant. From the following patient-written paragraph, extract all possible medical symptoms or health conditions mentioned, whether explicitly stated or implied. This includes physical symptoms, psychological symptoms, behavioral signs, neurological issues, or any detail relevant to medical diagnosis or history."
-        "Do not exclude symptoms that are described in layman terms or as everyday experiences if they could be medically relevant. All pterms like sick , pain, sore throat, body aches, fever, cough, cold, headache, etc should be captured. "
-        "Return only a Python list of strings, each representing a distinct symptom or health condition. Do not include general emotions or vague feelings unless they clearly indicate a medical concern."
-        "Only return the list — no explanations, no summaries.\n\n"
+        CONDITION_INSTRUCTIONS.format(subject="the following patient-written paragraph")
+        + "Return only a JSON object of the form {\"conditions\": [\"...\"]}, one string per distinct symptom or health condition — no explanations, no summaries.\n\n"
         f"Text: \"{text}\""
     )
 
-    response = llm.invoke(system_prompt)
     try:
-        extracted = eval(response.content.strip())
-        if isinstance(extracted, list):
-            return [item.strip() for item in extracted]
-        return []
-    except Exception:
+        result = structured_llm(ExtractedConditions).invoke(system_prompt)
+    except (ValidationError, ValueError) as e:
+        print(f"⚠️ Could not parse extracted conditions: {e}")
         return []
+    extracted = clean_conditions(result.conditions)
+    condition_cache.set(_condition_key(text), extracted)
+    return extracted
+
+# Extract conditions for several transcripts in one LLM call
+@timed("condition_extraction")
+def extract_conditions_batch(texts: List[str]) -> List[List[str]]:
+    keys = [_condition_key(text) for text in texts]
+    results = [condition_cache.get(key) for key in keys]
+    missing = [i for i, r in enumerate(results) if r is None]
+    if not missing:
+        return results
+    if len(missing) == 1:
+        results[missing[0]] = _extract_conditions_llm(texts[missing[0]])
+        return results
+
+    numbered = "\n".join(f"{n + 1}. \"{texts[i]}\"" for n, i in enumerate(missing))
+    system_prompt = (
+        CONDITION_INSTRUCTIONS.format(subject="each of the following numbered patient-written paragraphs")
+        + "Return only a JSON object of the form {\"results\": [{\"index\": 1, \"conditions\": [\"...\"]}]} with one entry per paragraph, one string per distinct symptom or health condition, using an empty list when there are none. "
+        "No explanations, no summaries.\n\n"
+        f"Texts:\n{numbered}"
+    )
+
+    for i in missing:
+        results[i] = []
+    try:
+        parsed = structured_llm(BatchConditions).invoke(system_prompt)
+    except (ValidationError, ValueError) as e:
+        print(f"⚠️ Could not parse extracted conditions: {e}")
+        return results
+    for entry in parsed.results:
+        n = entry.index - 1
+        if 0 <= n < len(missing):
+            i = missing[n]
+            results[i] = clean_conditions(entry.conditions)
+            condition_cache.set(keys[i], results[i])
+    return results
 
 # Update user profile with timestamped conditions
 def log_conditions(user_id: str, transcript: str):
-    profiles = load_all_profiles()
-    if user_id not in profiles:
+    store = get_profile_store()
+    if not store.exists(user_id):
         return
 
     extracted = extract_conditions_from_text(transcript)
-    for cond in extracted:
-        profiles[user_id]["conditions"].append({
-            "condition": cond,
-            "timestamp": datetime.now().isoformat()
-        })
-
-    save_profiles(profiles)
+    store.add_conditions(user_id, extracted)
@@ -0,0 +1,250 @@
+# profile_store.py
+
+import os
+import json
+import time
+import copy
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+PROFILE_PATH = "user_profiles.json"  # legacy whole-file format
+PROFILE_DB_PATH = os.getenv("PROFILE_DB_PATH", "user_profiles.db")
+PROFILE_STORE = os.getenv("PROFILE_STORE", "sqlite")  # "sqlite" or "json"
+PROFILE_CACHE_TTL = float(os.getenv("PROFILE_CACHE_TTL", "30"))
+
+# Profiles are returned in the legacy shape:
+# {"name": str, "age": str, "conditions": [{"condition": str, "timestamp": str}]}
+
+# Called with a user_id after that user's profile is written through a store
+# in this process (None: any profile may have changed).
+_change_listeners: List[Callable[[Optional[str]], None]] = []
+
+def on_profile_change(callback: Callable[[Optional[str]], None]):
+    _change_listeners.append(callback)
+
+def _notify_change(user_id: Optional[str]):
+    for callback in _change_listeners:
+        callback(user_id)
+
+# --------- 1. Store Interface -------------
+class ProfileStore:
+    def get_profile(self, user_id: str) -> Optional[Dict]:
+        raise NotImplementedError
+
+    def create_profile(self, user_id: str, name: str, age: str) -> Dict:
+        raise NotImplementedError
+
+    def add_conditions(self, user_id: str, conditions: List[str], timestamp: Optional[str] = None) -> int:
+        """Append conditions to an existing profile. Returns the number added."""
+        raise NotImplementedError
+
+    def exists(self, user_id: str) -> bool:
+        return self.get_profile(user_id) is not None
+
+    def ensure_profile(self, user_id: str, name: str = "Unknown", age: str = "Unknown") -> Dict:
+        profile = self.get_profile(user_id)
+        if profile is None:
+            profile = self.create_profile(user_id, name, age)
+        return profile
+
+# --------- 2. Legacy JSON Backend ---------
+class JSONProfileStore(ProfileStore):
+    """Whole-file user_profiles.json store, kept for compatibility. Every
+    write rewrites the file, so only use it for small single-process setups."""
+
+    def __init__(self, path: str = PROFILE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _load(self) -> Dict[str, Dict]:
+        if os.path.exists(self.path):
+            with open(self.path, "r") as f:
+                return json.load(f)
+        return {}
+
+    def _save(self, data: Dict[str, Dict]):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp, self.path)
+
+    def get_profile(self, user_id: str) -> Optional[Dict]:
+        with self._lock:
+            return self._load().get(user_id)
+
+    def create_profile(self, user_id: str, name: str, age: str) -> Dict:
+        with self._lock:
+            data = self._load()
+            data[user_id] = {"name": name, "age": age, "conditions": []}
+            self._save(data)
+        _notify_change(user_id)
+        return {"name": name, "age": age, "conditions": []}
+
+    def add_conditions(self, user_id: str, conditions: List[str], timestamp: Optional[str] = None) -> int:
+        timestamp = timestamp or datetime.now().isoformat()
+        with self._lock:
+            data = self._load()
+            if user_id not in data:
+                return 0
+            for cond in conditions:
+                data[user_id]["conditions"].append({"condition": cond, "timestamp": timestamp})
+            self._save(data)
+        _notify_change(user_id)
+        return len(conditions)
+
+# --------- 3. SQLite Backend --------------
+class SQLiteProfileStore(ProfileStore):
+    """Embedded SQLite store in WAL mode. Reads touch one user's rows,
+    conditions are append-only inserts, and reads are served from an
+    in-process cache that is invalidated on every write through this store
+    (and expires after PROFILE_CACHE_TTL for writes from other processes)."""
+
+    def __init__(self, path: str = PROFILE_DB_PATH, legacy_json_path: Optional[str] = PROFILE_PATH, cache_ttl: float = PROFILE_CACHE_TTL):
+        self.path = path
+        self.cache_ttl = cache_ttl
+        self._local = threading.local()
+        self._cache: Dict[str, tuple] = {}
+        self._cache_lock = threading.Lock()
+        self._init_schema()
+        if legacy_json_path:
+            self.import_legacy_json(legacy_json_path)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _init_schema(self):
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS profiles ("
+            " user_id TEXT PRIMARY KEY, name TEXT, age TEXT, created_at TEXT)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS conditions ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT NOT NULL,"
+            " condition TEXT NOT NULL, timestamp TEXT NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_conditions_user ON conditions(user_id, id)")
+
+    def _invalidate(self, user_id: str):
+        with self._cache_lock:
+            self._cache.pop(user_id, None)
+        _notify_change(user_id)
+
+    def import_legacy_json(self, json_path: str) -> int:
+        """One-time import of a legacy user_profiles.json into an empty
+        database. Returns the number of profiles imported."""
+        if not os.path.exists(json_path):
+            return 0
+        conn = self._conn()
+        if conn.execute("SELECT 1 FROM profiles LIMIT 1").fetchone():
+            return 0
+        with open(json_path, "r") as f:
+            data = json.load(f)
+        now = datetime.now().isoformat()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for user_id, profile in data.items():
+                conn.execute(
+                    "INSERT OR IGNORE INTO profiles (user_id, name, age, created_at) VALUES (?, ?, ?, ?)",
+                    (user_id, profile.get("name", "Unknown"), str(profile.get("age", "Unknown")), now),
+                )
+                conn.executemany(
+                    "INSERT INTO conditions (user_id, condition, timestamp) VALUES (?, ?, ?)",
+                    [(user_id, c["condition"], c.get("timestamp", now)) for c in profile.get("conditions", [])],
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        with self._cache_lock:
+            self._cache.clear()
+        _notify_change(None)
+        return len(data)
+
+    def get_profile(self, user_id: str) -> Optional[Dict]:
+        with self._cache_lock:
+            cached = self._cache.get(user_id)
+        if cached and time.monotonic() - cached[0] < self.cache_ttl:
+            return copy.deepcopy(cached[1])
+
+        conn = self._conn()
+        row = conn.execute("SELECT name, age FROM profiles WHERE user_id = ?", (user_id,)).fetchone()
+        if row is None:
+            return None
+        conditions = conn.execute(
+            "SELECT condition, timestamp FROM conditions WHERE user_id = ? ORDER BY id", (user_id,)
+        ).fetchall()
+        profile = {
+            "name": row[0],
+            "age": row[1],
+            "conditions": [{"condition": c, "timestamp": ts} for c, ts in conditions],
+        }
+        with self._cache_lock:
+            self._cache[user_id] = (time.monotonic(), profile)
+        return copy.deepcopy(profile)
+
+    def exists(self, user_id: str) -> bool:
+        with self._cache_lock:
+            if user_id in self._cache:
+                return True
+        row = self._conn().execute("SELECT 1 FROM profiles WHERE user_id = ?", (user_id,)).fetchone()
+        return row is not None
+
+    def create_profile(self, user_id: str, name: str, age: str) -> Dict:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM conditions WHERE user_id = ?", (user_id,))
+            conn.execute(
+                "INSERT OR REPLACE INTO profiles (user_id, name, age, created_at) VALUES (?, ?, ?, ?)",
+                (user_id, name, age, datetime.now().isoformat()),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self._invalidate(user_id)
+        return {"name": name, "age": age, "conditions": []}
+
+    def add_conditions(self, user_id: str, conditions: List[str], timestamp: Optional[str] = None) -> int:
+        if not conditions or not self.exists(user_id):
+            return 0
+        timestamp = timestamp or datetime.now().isoformat()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "INSERT INTO conditions (user_id, condition, timestamp) VALUES (?, ?, ?)",
+                [(user_id, cond, timestamp) for cond in conditions],
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self._invalidate(user_id)
+        return len(conditions)
+
+# --------- 4. Default Store ---------------
+_store: Optional[ProfileStore] = None
+_store_lock = threading.Lock()
+
+def get_profile_store() -> ProfileStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            if PROFILE_STORE == "json":
+                _store = JSONProfileStore(PROFILE_PATH)
+            else:
+                _store = SQLiteProfileStore(PROFILE_DB_PATH, legacy_json_path=PROFILE_PATH)
+        return _store
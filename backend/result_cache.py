@@ -0,0 +1,150 @@
+# result_cache.py
+
+import os
+import re
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "2048"))
+CACHE_TTL_SECONDS = float(os.getenv("CACHE_TTL_SECONDS", "86400"))
+# Directory for the on-disk tier; leave empty to keep caches in memory only.
+RESULT_CACHE_DIR = os.getenv("RESULT_CACHE_DIR", "")
+CACHE_DISK_MAX_ENTRIES = int(os.getenv("CACHE_DISK_MAX_ENTRIES", "100000"))
+# Expired and surplus disk rows are deleted every this many writes
+CACHE_DISK_PRUNE_EVERY = 256
+
+_caches: Dict[str, "ResultCache"] = {}
+
+def normalize_text(text: str) -> str:
+    return re.sub(r"\s+", " ", text or "").strip()
+
+def content_key(*parts) -> str:
+    """sha256 over the given parts; bytes are hashed as-is, everything else
+    via its str()."""
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(part if isinstance(part, (bytes, bytearray, memoryview)) else str(part).encode("utf-8"))
+        h.update(b"\x00")
+    return h.hexdigest()
+
+# --------- 1. Cache -----------------------
+class ResultCache:
+    """Content-addressed LRU cache with TTL expiry and an optional SQLite
+    tier that survives restarts. The disk tier drops expired rows and keeps
+    at most disk_maxsize of the newest ones. Values go through encode/decode
+    so they can be stored as JSON on disk."""
+
+    def __init__(self, name: str, maxsize: int = CACHE_MAX_ENTRIES, ttl: float = CACHE_TTL_SECONDS,
+                 disk_dir: str = RESULT_CACHE_DIR, disk_maxsize: int = CACHE_DISK_MAX_ENTRIES,
+                 encode: Callable[[Any], Any] = lambda v: v, decode: Callable[[Any], Any] = lambda v: v):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.disk_maxsize = disk_maxsize
+        self.encode = encode
+        self.decode = decode
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0, "disk_evictions": 0}
+        self._disk_writes = 0
+        self._disk_path = None
+        self._local = threading.local()
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._disk_path = os.path.join(disk_dir, f"{name}.cache.db")
+            conn = self._disk()
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS cache_created ON cache (created)")
+            self.prune()
+        _caches[name] = self
+
+    def _disk(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self._disk_path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[Any]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if now - entry[0] < self.ttl:
+                    self._entries.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return entry[1]
+                del self._entries[key]
+
+        if self._disk_path:
+            row = self._disk().execute("SELECT value, created FROM cache WHERE key = ?", (key,)).fetchone()
+            if row and now - row[1] < self.ttl:
+                value = self.decode(json.loads(row[0]))
+                self._remember(key, value, row[1])
+                with self._lock:
+                    self._stats["disk_hits"] += 1
+                return value
+
+        with self._lock:
+            self._stats["misses"] += 1
+        return None
+
+    def _remember(self, key: str, value: Any, created: float):
+        with self._lock:
+            self._entries[key] = (created, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def set(self, key: str, value: Any):
+        now = time.time()
+        self._remember(key, value, now)
+        if self._disk_path:
+            self._disk().execute(
+                "INSERT OR REPLACE INTO cache (key, value, created) VALUES (?, ?, ?)",
+                (key, json.dumps(self.encode(value)), now),
+            )
+            with self._lock:
+                self._disk_writes += 1
+                due = self._disk_writes % CACHE_DISK_PRUNE_EVERY == 0
+            if due:
+                self.prune()
+
+    def prune(self) -> int:
+        """Delete expired disk rows, then the oldest ones beyond
+        disk_maxsize. Returns the number of rows deleted."""
+        if not self._disk_path:
+            return 0
+        conn = self._disk()
+        deleted = conn.execute("DELETE FROM cache WHERE created < ?", (time.time() - self.ttl,)).rowcount
+        deleted += conn.execute(
+            "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY created DESC LIMIT -1 OFFSET ?)",
+            (self.disk_maxsize,),
+        ).rowcount
+        with self._lock:
+            self._stats["disk_evictions"] += deleted
+        return deleted
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            s = dict(self._stats)
+            s["size"] = len(self._entries)
+        lookups = s["hits"] + s["disk_hits"] + s["misses"]
+        s["hit_rate"] = (s["hits"] + s["disk_hits"]) / lookups if lookups else 0.0
+        s["disk_tier"] = bool(self._disk_path)
+        return s
+
+def all_cache_stats() -> Dict[str, Dict[str, float]]:
+    return {name: cache.stats() for name, cache in _caches.items()}
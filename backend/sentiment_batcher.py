@@ -0,0 +1,105 @@
+# sentiment_batcher.py
+
+import time
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Callable, List, Dict, Any
+
+# Collects text_probs requests from concurrent callers and runs them through
+# the sentiment model as one padded batch. A batch is flushed once it reaches
+# max_batch_size or the oldest request has waited max_wait_ms.
+class SentimentBatcher:
+    def __init__(self, infer_batch: Callable[[List[str]], Any], max_batch_size: int = 16, max_wait_ms: float = 5.0):
+        self.infer_batch = infer_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue: "queue.Queue[tuple]" = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._started_at = time.monotonic()
+        self._stats = {
+            "requests": 0,
+            "batches": 0,
+            "errors": 0,
+            "max_batch_size_seen": 0,
+            "infer_seconds": 0.0,
+        }
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="sentiment-batcher", daemon=True)
+                self._thread.start()
+
+    def submit(self, text: str) -> Future:
+        """Queue one text; the future resolves to its probability vector."""
+        self._ensure_worker()
+        fut: Future = Future()
+        self._queue.put((text, fut))
+        return fut
+
+    def _collect(self) -> List[tuple]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            # Drop requests whose caller has given up (e.g. a cancelled
+            # asyncio.wrap_future); the rest can no longer be cancelled
+            batch = [(text, fut) for text, fut in batch if fut.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                self._process(batch)
+            except Exception as e:  # never let one batch end the worker
+                print(f"⚠️ Sentiment batch failed: {e}")
+                for _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+
+    def _process(self, batch: List[tuple]):
+        texts = [text for text, _ in batch]
+        start = time.perf_counter()
+        try:
+            probs = list(self.infer_batch(texts))
+            if len(probs) != len(batch):
+                raise RuntimeError(f"sentiment model returned {len(probs)} results for {len(batch)} texts")
+        except Exception as e:
+            for _, fut in batch:
+                fut.set_exception(e)
+            with self._lock:
+                self._stats["errors"] += 1
+            return
+        elapsed = time.perf_counter() - start
+
+        for (_, fut), p in zip(batch, probs):
+            fut.set_result(p)
+
+        with self._lock:
+            self._stats["requests"] += len(batch)
+            self._stats["batches"] += 1
+            self._stats["infer_seconds"] += elapsed
+            self._stats["max_batch_size_seen"] = max(self._stats["max_batch_size_seen"], len(batch))
+
+    def stats(self) -> Dict[str, float]:
+        """Throughput counters since startup."""
+        with self._lock:
+            s = dict(self._stats)
+        uptime = time.monotonic() - self._started_at
+        s["queue_depth"] = self._queue.qsize()
+        s["avg_batch_size"] = s["requests"] / s["batches"] if s["batches"] else 0.0
+        s["requests_per_second"] = s["requests"] / uptime if uptime > 0 else 0.0
+        s["max_batch_size"] = self.max_batch_size
+        s["max_wait_ms"] = self.max_wait * 1000.0
+        return s
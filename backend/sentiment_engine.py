@@ -0,0 +1,153 @@
+# sentiment_engine.py
+
+import os
+import argparse
+import numpy as np
+from typing import List, Dict
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SENTIMENT_MODEL = os.getenv("SENTIMENT_MODEL", "cardiffnlp/twitter-roberta-base-sentiment")
+# "torch" (full-precision PyTorch) or "onnx" (int8 dynamic-quantized ONNX Runtime)
+SENTIMENT_ENGINE = os.getenv("SENTIMENT_ENGINE", "torch")
+SENTIMENT_ONNX_DIR = os.getenv("SENTIMENT_ONNX_DIR", os.path.join("models", "sentiment-onnx"))
+SENTIMENT_MAX_LENGTH = 512
+
+# Reference sentences for verify_engines()
+VERIFY_TEXTS = [
+    "hi",
+    "thanks",
+    "I have a headache",
+    "I've had a terrible fever for three days and I can't sleep",
+    "I feel much better today, thank you so much!",
+    "My chest hurts when I breathe and I'm scared",
+    "The medicine isn't working at all",
+    "What should I eat when I have a cold?",
+    "I'm so relieved the test came back negative",
+    "I am anxious about my appointment tomorrow",
+    "ok",
+    "My back pain is getting worse every morning",
+]
+
+def _softmax(logits: np.ndarray) -> np.ndarray:
+    z = logits - logits.max(axis=-1, keepdims=True)
+    e = np.exp(z)
+    return e / e.sum(axis=-1, keepdims=True)
+
+# --------- 1. Engines ---------------------
+# Both engines take a batch of strings and return an (n, 3) float32 array of
+# [negative, neutral, positive] probabilities.
+class TorchSentimentEngine:
+    version = "torch-fp32"
+
+    def __init__(self, model_name: str = SENTIMENT_MODEL):
+        import torch
+        from transformers import AutoTokenizer, AutoModelForSequenceClassification
+        self._torch = torch
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.model = AutoModelForSequenceClassification.from_pretrained(model_name).eval()
+
+    def predict(self, texts: List[str]) -> np.ndarray:
+        inp = self.tokenizer(texts, padding=True, truncation=True, max_length=SENTIMENT_MAX_LENGTH, return_tensors="pt")
+        with self._torch.no_grad():
+            logits = self.model(**inp).logits
+            probs = self._torch.softmax(logits, dim=-1)
+        return probs.numpy().astype(np.float32)
+
+class OnnxSentimentEngine:
+    version = "onnx-int8"
+
+    def __init__(self, model_name: str = SENTIMENT_MODEL, onnx_dir: str = SENTIMENT_ONNX_DIR):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+        path = os.path.join(onnx_dir, "model.int8.onnx")
+        if not os.path.exists(path):
+            export_onnx(model_name, onnx_dir)
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.tokenizer = AutoTokenizer.from_pretrained(onnx_dir)
+
+    def predict(self, texts: List[str]) -> np.ndarray:
+        inp = self.tokenizer(texts, padding=True, truncation=True, max_length=SENTIMENT_MAX_LENGTH, return_tensors="np")
+        (logits,) = self.session.run(
+            ["logits"],
+            {"input_ids": inp["input_ids"].astype(np.int64), "attention_mask": inp["attention_mask"].astype(np.int64)},
+        )
+        return _softmax(logits).astype(np.float32)
+
+def export_onnx(model_name: str = SENTIMENT_MODEL, onnx_dir: str = SENTIMENT_ONNX_DIR) -> str:
+    """Export the PyTorch model to ONNX and apply int8 dynamic quantization
+    to its weights. Returns the quantized model path."""
+    import torch
+    from transformers import AutoTokenizer, AutoModelForSequenceClassification
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    os.makedirs(onnx_dir, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModelForSequenceClassification.from_pretrained(model_name).eval()
+    tokenizer.save_pretrained(onnx_dir)
+
+    fp32_path = os.path.join(onnx_dir, "model.onnx")
+    int8_path = os.path.join(onnx_dir, "model.int8.onnx")
+    sample = tokenizer(["export sample"], return_tensors="pt")
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            (sample["input_ids"], sample["attention_mask"]),
+            fp32_path,
+            input_names=["input_ids", "attention_mask"],
+            output_names=["logits"],
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "sequence"},
+                "attention_mask": {0: "batch", 1: "sequence"},
+                "logits": {0: "batch"},
+            },
+            opset_version=14,
+        )
+    quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+    print(f"✅ Exported quantized sentiment model to {int8_path}")
+    return int8_path
+
+def load_engine(name: str = SENTIMENT_ENGINE):
+    if name == "onnx":
+        return OnnxSentimentEngine()
+    if name == "torch":
+        return TorchSentimentEngine()
+    raise ValueError(f"Unknown SENTIMENT_ENGINE: {name}")
+
+# --------- 2. Verification ----------------
+def verify_engines(texts: List[str] = VERIFY_TEXTS, max_delta: float = 0.1, min_agreement: float = 0.9) -> Dict:
+    """Compare the ONNX engine against the PyTorch reference. Passes when
+    the argmax label agrees on at least min_agreement of the texts and no
+    class probability differs by more than max_delta."""
+    reference = TorchSentimentEngine().predict(texts)
+    candidate = OnnxSentimentEngine().predict(texts)
+    agreement = float(np.mean(reference.argmax(axis=1) == candidate.argmax(axis=1)))
+    deltas = np.abs(reference - candidate)
+    report = {
+        "texts": len(texts),
+        "label_agreement": agreement,
+        "max_prob_delta": float(deltas.max()),
+        "mean_prob_delta": float(deltas.mean()),
+        "max_delta_allowed": max_delta,
+        "min_agreement_required": min_agreement,
+    }
+    report["passed"] = agreement >= min_agreement and report["max_prob_delta"] <= max_delta
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export and verify the quantized ONNX sentiment engine")
+    parser.add_argument("--export", action="store_true", help="export + quantize the model to SENTIMENT_ONNX_DIR")
+    parser.add_argument("--verify", action="store_true", help="check ONNX outputs against the PyTorch reference")
+    parser.add_argument("--max-delta", type=float, default=0.1)
+    parser.add_argument("--min-agreement", type=float, default=0.9)
+    args = parser.parse_args()
+    if args.export:
+        export_onnx()
+    if args.verify:
+        report = verify_engines(max_delta=args.max_delta, min_agreement=args.min_agreement)
+        for key, value in report.items():
+            print(f"{key}: {value}")
+        raise SystemExit(0 if report["passed"] else 1)
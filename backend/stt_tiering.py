@@ -0,0 +1,115 @@
+# stt_tiering.py
+
+import os
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict
+from model_registry import WHISPER_MODEL, WHISPER_TIERS
+from metrics import STT_TIER_SECONDS, STT_SLO_MISSES
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Picks a Whisper size per request: the largest tier whose predicted
+# latency (STT work already queued + this clip) fits the SLO. Short clips
+# are capped at a small tier, since a one-word answer gains nothing from
+# "medium". Set STT_TIERING=false to always use WHISPER_MODEL.
+STT_TIERING = os.getenv("STT_TIERING", "true").lower() == "true"
+STT_LATENCY_SLO_MS = float(os.getenv("STT_LATENCY_SLO_MS", "3000"))
+# Voiced audio shorter than this is transcribed with at most STT_SHORT_CLIP_TIER.
+STT_SHORT_CLIP_S = float(os.getenv("STT_SHORT_CLIP_S", "2.0"))
+STT_SHORT_CLIP_TIER = os.getenv("STT_SHORT_CLIP_TIER", "base")
+STT_CONCURRENCY = int(os.getenv("STT_CONCURRENCY", "1"))
+
+# Decoding options shared by every tier. A fixed language skips language
+# detection; beam size 1 is greedy decoding (faster_whisper defaults to 5).
+STT_LANGUAGE = os.getenv("STT_LANGUAGE", "") or None
+STT_BEAM_SIZE = int(os.getenv("STT_BEAM_SIZE", "5"))
+
+# Starting estimates of seconds of compute per second of voiced audio
+# (CPU, int8); replaced by measurements as requests complete.
+DEFAULT_RTF = {"tiny": 0.04, "base": 0.08, "small": 0.2, "medium": 0.5, "large-v3": 1.0}
+_EWMA_ALPHA = 0.2
+# Fixed per-call cost (feature extraction, model dispatch)
+_OVERHEAD_S = 0.05
+
+def stt_options() -> Dict[str, Any]:
+    options = {"beam_size": STT_BEAM_SIZE}
+    if STT_LANGUAGE:
+        options["language"] = STT_LANGUAGE
+    return options
+
+@dataclass
+class STTPlan:
+    tier: str
+    voiced_seconds: float
+    predicted_seconds: float
+
+class TieringPolicy:
+    def __init__(self, tiers=WHISPER_TIERS, default=WHISPER_MODEL, slo_ms: float = STT_LATENCY_SLO_MS,
+                 workers: int = STT_CONCURRENCY, enabled: bool = STT_TIERING):
+        self.tiers = list(tiers)  # smallest to largest
+        self.default = default
+        self.slo = slo_ms / 1000
+        self.workers = max(1, workers)
+        self.enabled = enabled and len(self.tiers) > 1
+        self.rtf = {t: DEFAULT_RTF.get(t, 0.5) for t in set(self.tiers) | {default}}
+        self._lock = threading.Lock()
+        self._backlog = 0.0  # predicted seconds of STT work planned but not finished
+        self._depth = 0
+
+    def cost(self, tier: str, voiced_seconds: float) -> float:
+        return _OVERHEAD_S + self.rtf[tier] * voiced_seconds
+
+    def _choose(self, voiced_seconds: float) -> str:
+        if not self.enabled:
+            return self.default
+        candidates = self.tiers
+        if voiced_seconds < STT_SHORT_CLIP_S and STT_SHORT_CLIP_TIER in candidates:
+            candidates = candidates[:candidates.index(STT_SHORT_CLIP_TIER) + 1]
+        wait = self._backlog / self.workers
+        for tier in reversed(candidates):
+            if wait + self.cost(tier, voiced_seconds) <= self.slo:
+                return tier
+        return candidates[0]
+
+    def plan(self, voiced_seconds: float) -> STTPlan:
+        """Choose a tier and count its predicted work as queued until
+        done() is called."""
+        with self._lock:
+            tier = self._choose(voiced_seconds)
+            predicted = self.cost(tier, voiced_seconds)
+            self._backlog += predicted
+            self._depth += 1
+        return STTPlan(tier, voiced_seconds, predicted)
+
+    def done(self, plan: STTPlan, seconds: float = None, total_seconds: float = None):
+        """Release the plan's backlog. `seconds` is the measured compute time
+        (updates the tier's RTF estimate); `total_seconds` includes queueing
+        and is checked against the SLO."""
+        with self._lock:
+            self._backlog = max(0.0, self._backlog - plan.predicted_seconds)
+            self._depth -= 1
+            if seconds is not None and plan.voiced_seconds >= 0.5:
+                observed = max(0.0, seconds - _OVERHEAD_S) / plan.voiced_seconds
+                # Far below the estimate means an STT cache hit, not a decode
+                if observed >= 0.1 * self.rtf[plan.tier]:
+                    self.rtf[plan.tier] += _EWMA_ALPHA * (observed - self.rtf[plan.tier])
+        if seconds is not None:
+            STT_TIER_SECONDS.labels(plan.tier).observe(seconds)
+        if total_seconds is not None and total_seconds > self.slo:
+            STT_SLO_MISSES.labels(plan.tier).inc()
+
+    def stats(self) -> Dict[str, Any]:
+        """Policy state plus the current RTF estimate per tier
+        (exported as chatbot_stt_tiering_rtf{name=<tier>})."""
+        with self._lock:
+            stats: Dict[str, Any] = {
+                "enabled": self.enabled,
+                "queue_depth": self._depth,
+                "backlog_seconds": round(self._backlog, 3),
+            }
+            stats.update({t: {"rtf": round(r, 4)} for t, r in self.rtf.items()})
+            return stats
+
+policy = TieringPolicy()
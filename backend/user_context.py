@@ -0,0 +1,152 @@
+# user_context.py
+
+import os
+import time
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+from profile_store import get_profile_store, on_profile_change, PROFILE_CACHE_TTL
+from context_builder import aggregate_conditions, format_profile
+from metrics import timed
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Per-user prompt context (name, age, deduplicated conditions, the profile
+# block and the per-emotion guidance), built once and reused until the profile
+# changes. Writes through the profile store in this process invalidate the
+# entry right away; writes from other processes are picked up after
+# PROFILE_CACHE_TTL, when the profile is re-read and compared.
+USER_CONTEXT_CACHE_SIZE = int(os.getenv("USER_CONTEXT_CACHE_SIZE", "10000"))
+
+# Leads every prompt and is identical for every user and turn. Per-user
+# text (profile, summary) follows; the per-turn emotion guidance is sent
+# after the history (see build_context) so it never breaks the shared prefix.
+STATIC_SYSTEM_PROMPT = (
+    "You are a healthcare assistant talking with a user about their health. "
+    "Below are the user's profile and, for longer conversations, a summary of what was said earlier. "
+    "Use them as background for your reply. The last message before your reply describes the user's "
+    "current emotional state and how to respond to it.\n\n"
+)
+
+# --------- 1. Emotion Templates -----------
+# Emotion class -> (emotion words, response style)
+EMOTION_TEMPLATES: Dict[str, Tuple[Tuple[str, ...], str]] = {
+    "negative": (
+        ("sad", "angry", "anxious", "frustrated", "upset", "negative"),
+        "Be calm and supportive: respond with empathy, be brief, comforting, and directly address their concerns.",
+    ),
+    "positive": (
+        ("happy", "excited", "relieved", "positive"),
+        "Be warm and encouraging: respond positively, include relevant health information, "
+        "and feel free to elaborate helpfully.",
+    ),
+    "neutral": (
+        (),
+        "Respond clearly, respectfully, and offer relevant medical guidance or follow-up questions. "
+        "Be concise in your response & talk to them as a friend.",
+    ),
+}
+_EMOTION_CLASS = {word: cls for cls, (words, _) in EMOTION_TEMPLATES.items() for word in words}
+
+def emotion_class(emotion: str) -> str:
+    return _EMOTION_CLASS.get(emotion.lower(), "neutral")
+
+def emotion_prompt(emotion: str) -> str:
+    """Per-turn guidance for the detected emotion."""
+    _, style = EMOTION_TEMPLATES[emotion_class(emotion)]
+    return f"The user is currently feeling {emotion.lower()}. {style}"
+
+# --------- 2. Cached Context --------------
+def _fingerprint(profile: Dict[str, Any]) -> Tuple:
+    conditions = profile.get("conditions", [])
+    last = conditions[-1] if conditions else {}
+    return (profile.get("name"), profile.get("age"), len(conditions), last.get("condition"), last.get("timestamp"))
+
+@dataclass
+class UserContext:
+    user_id: str
+    name: str
+    age: str
+    conditions: List[Dict[str, Any]]  # aggregate_conditions() rows, most recent first
+    profile_block: str  # format_profile() text
+    fingerprint: Tuple
+    emotion_prompts: Dict[str, str] = field(default_factory=dict)
+
+    @classmethod
+    def build(cls, user_id: str, profile: Dict[str, Any]) -> "UserContext":
+        return cls(
+            user_id=user_id,
+            name=str(profile.get("name", "Unknown")),
+            age=str(profile.get("age", "Unknown")),
+            conditions=aggregate_conditions(profile.get("conditions", [])),
+            profile_block=format_profile(profile),
+            fingerprint=_fingerprint(profile),
+        )
+
+    def emotion_prompt(self, emotion: str) -> str:
+        prompt = self.emotion_prompts.get(emotion)
+        if prompt is None:
+            prompt = self.emotion_prompts[emotion] = emotion_prompt(emotion)
+        return prompt
+
+class UserContextCache:
+    def __init__(self, max_users: int = USER_CONTEXT_CACHE_SIZE, ttl: float = PROFILE_CACHE_TTL):
+        self.max_users = max_users
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, list]" = OrderedDict()  # user -> [context, checked at]
+        self._lock = threading.Lock()
+        self._generation = 0  # bumped on every invalidation
+        self._stats = {"hits": 0, "misses": 0, "rebuilds": 0, "invalidations": 0}
+
+    def peek(self, user_id: str) -> Optional[UserContext]:
+        """The cached context if it is still fresh; never touches the store."""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or time.monotonic() - entry[1] >= self.ttl:
+                return None
+            self._entries.move_to_end(user_id)
+            self._stats["hits"] += 1
+            return entry[0]
+
+    @timed("user_context")
+    def get(self, user_id: str) -> UserContext:
+        """The user's context, re-reading the profile if the entry is missing
+        or stale. A stale entry whose profile is unchanged is kept as is."""
+        context = self.peek(user_id)
+        if context is not None:
+            return context
+        generation = self._generation
+        profile = get_profile_store().get_profile(user_id) or {}
+        with self._lock:
+            self._stats["misses"] += 1
+            if generation != self._generation:
+                # Invalidated while we read: the profile may already be stale
+                return UserContext.build(user_id, profile)
+            entry = self._entries.pop(user_id, None)
+            if entry is not None and entry[0].fingerprint == _fingerprint(profile):
+                context = entry[0]
+            else:
+                context = UserContext.build(user_id, profile)
+                self._stats["rebuilds"] += 1
+            self._entries[user_id] = [context, time.monotonic()]
+            if len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+        return context
+
+    def invalidate(self, user_id: Optional[str] = None):
+        with self._lock:
+            self._stats["invalidations"] += 1
+            self._generation += 1
+            if user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(user_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._stats, size=len(self._entries))
+
+user_contexts = UserContextCache()
+on_profile_change(user_contexts.invalidate)
@@ -0,0 +1,84 @@
+# vad_stream.py
+
+import numpy as np
+from typing import List, Tuple, Optional
+
+def new_vad(aggressiveness: int = 3):
+    """A fresh webrtcvad.Vad. It adapts its noise and speech estimates frame
+    by frame, so every stream or clip needs its own; they are cheap."""
+    import webrtcvad
+    return webrtcvad.Vad(aggressiveness)
+
+# Incremental voice activity detection for live audio. Frames of PCM16
+# 16 kHz mono are pushed in as they arrive from the client; the detector
+# emits a "segment" event with the float32 audio of each speech region once
+# it is followed by a short pause, and an "end" event once a longer pause
+# marks the end of the user's utterance.
+class StreamingVAD:
+    def __init__(self, vad=None, sr: int = 16000, frame_ms: int = 30,
+                 segment_silence_ms: int = 300, end_silence_ms: int = 800,
+                 max_segment_ms: int = 15000):
+        assert sr == 16000, "webrtcvad requires 16000Hz sample rate"
+        self.vad = vad if vad is not None else new_vad()
+        self.sr = sr
+        self.frame_bytes = int(sr * frame_ms / 1000) * 2
+        self.frame_ms = frame_ms
+        self.segment_silence_frames = segment_silence_ms // frame_ms
+        self.end_silence_frames = end_silence_ms // frame_ms
+        self.max_segment_frames = max_segment_ms // frame_ms
+        self.reset()
+
+    def reset(self):
+        self._pending = b""
+        self._segment: List[bytes] = []
+        self._silence_run = 0
+        self._heard_speech = False
+        self._ended = False
+
+    def _close_segment(self) -> Optional[np.ndarray]:
+        if not self._segment:
+            return None
+        # Drop the trailing silence frames that closed the segment
+        voiced = self._segment[: len(self._segment) - min(self._silence_run, len(self._segment))] or self._segment
+        self._segment = []
+        return np.frombuffer(b"".join(voiced), dtype=np.int16).astype(np.float32) / 32768
+
+    def feed(self, pcm: bytes) -> List[Tuple[str, Optional[np.ndarray]]]:
+        events: List[Tuple[str, Optional[np.ndarray]]] = []
+        self._pending += pcm
+        n_frames = len(self._pending) // self.frame_bytes
+        for i in range(n_frames):
+            frame = self._pending[i * self.frame_bytes:(i + 1) * self.frame_bytes]
+            if self.vad.is_speech(frame, self.sr):
+                self._segment.append(frame)
+                self._silence_run = 0
+                self._heard_speech = True
+                self._ended = False
+            elif self._heard_speech and not self._ended:
+                self._silence_run += 1
+                if self._segment:
+                    self._segment.append(frame)
+                if self._silence_run == self.segment_silence_frames:
+                    seg = self._close_segment()
+                    if seg is not None:
+                        events.append(("segment", seg))
+                if self._silence_run >= self.end_silence_frames:
+                    events.append(("end", None))
+                    self._ended = True
+                    self._heard_speech = False
+            if len(self._segment) >= self.max_segment_frames:
+                events.append(("segment", self._close_segment()))
+        self._pending = self._pending[n_frames * self.frame_bytes:]
+        return events
+
+    def flush(self) -> List[Tuple[str, Optional[np.ndarray]]]:
+        """Close whatever is buffered, e.g. when the client signals the end."""
+        events: List[Tuple[str, Optional[np.ndarray]]] = []
+        self._silence_run = 0
+        seg = self._close_segment()
+        if seg is not None:
+            events.append(("segment", seg))
+        if self._heard_speech or seg is not None:
+            events.append(("end", None))
+        self.reset()
+        return events
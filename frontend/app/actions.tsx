@@ -78,3 +78,68 @@ export async function continueConversationFile(file: File, user_id?: string) {
   const data = await response.json();
   return data.answer;
 }
+
+// Streaming variants: the backend sends Server-Sent Events
+// ("meta" -> "token"* -> "done") so the answer can be rendered incrementally.
+export type StreamHandlers = {
+  onMeta?: (meta: { transcript: string; emotion: string; valence: number; arousal: number | null }) => void;
+  onToken: (token: string) => void;
+};
+
+async function readEventStream(response: Response, handlers: StreamHandlers) {
+  if (!response.ok || !response.body) {
+    throw new Error("Failed to fetch from python backend");
+  }
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+  let answer = "";
+
+  while (true) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    let boundary;
+    while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+      const raw = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+
+      const event = raw.match(/^event: (.*)$/m)?.[1];
+      const data = JSON.parse(raw.match(/^data: (.*)$/m)?.[1] ?? "{}");
+      if (event === "meta") handlers.onMeta?.(data);
+      else if (event === "token") {
+        answer += data.token;
+        handlers.onToken(data.token);
+      } else if (event === "done") answer = data.answer;
+      else if (event === "error") throw new Error(data.error);
+    }
+  }
+  return answer;
+}
+
+export async function streamConversation(messages: CoreMessage[], handlers: StreamHandlers, user_id?: string) {
+  const response = await fetch("http://127.0.0.1:8000/text/stream", {
+    method: "POST",
+    headers: {
+      "Content-Type": "application/json",
+    },
+    body: JSON.stringify({ messages, user_id }),
+  });
+  return readEventStream(response, handlers);
+}
+
+export async function streamConversationFile(file: File, handlers: StreamHandlers, user_id?: string) {
+  const formData = new FormData();
+  formData.append("file", file);
+  if (user_id) {
+    formData.append("user_id", user_id);
+  }
+
+  const response = await fetch("http://127.0.0.1:8000/voice/stream", {
+    method: "POST",
+    body: formData,
+  });
+  return readEventStream(response, handlers);
+}
@@ -8,7 +8,7 @@ import { BsNvidia } from "react-icons/bs";
 import ChatInput from "./chat-input";
 import { FaUserAstronaut } from "react-icons/fa6";
 import { IoLogoVercel } from "react-icons/io5";
-import { continueConversation, continueConversationFile, checkUserExists, createUserProfile } from "../app/actions";
+import { streamConversation, streamConversationFile, checkUserExists, createUserProfile } from "../app/actions";
 import { toast } from "sonner";
 import remarkGfm from "remark-gfm";
 import { MemoizedReactMarkdown } from "./markdown";
@@ -42,6 +42,21 @@ export default function Chat() {
 
   const THOUGHT_MARKER = "__THINKING__"; // marker for the animated placeholder
 
+  // Replace the content of the message at `index` (from the end when negative)
+  const updateMessage = (index: number, update: (content: string) => string) => {
+    setMessages((prevMessages) => {
+      const updatedMessages = [...prevMessages];
+      const i = index < 0 ? updatedMessages.length + index : index;
+      const current = updatedMessages[i].content as string;
+      updatedMessages[i] = { ...updatedMessages[i], content: update(current) } as CoreMessage;
+      return updatedMessages;
+    });
+  };
+
+  // Append a streamed token to the assistant placeholder
+  const appendToken = (token: string) =>
+    updateMessage(-1, (content) => (content === THOUGHT_MARKER ? token : content + token));
+
   const handleUserIdSubmit = async () => {
     if (!userIdInput.trim()) return;
     
@@ -98,13 +113,9 @@ export default function Chat() {
     const placeholderMessage: CoreMessage = { role: "assistant", content: THOUGHT_MARKER };
     setMessages([...newMessages, placeholderMessage]);
     try {
-      // Pass userId to backend
-      const result = await continueConversation(newMessages, userId);
-      setMessages((prevMessages) => {
-        const updatedMessages = [...prevMessages];
-        updatedMessages[updatedMessages.length - 1] = { role: "assistant", content: result };
-        return updatedMessages;
-      });
+      // Pass userId to backend and render tokens as they arrive
+      const result = await streamConversation(newMessages, { onToken: appendToken }, userId);
+      updateMessage(-1, () => result);
     } catch (error) {
       toast.error((error as Error).message);
       setMessages((prevMessages) => {
@@ -129,12 +140,16 @@ export default function Chat() {
     const placeholderMessage: CoreMessage = { role: "assistant", content: THOUGHT_MARKER };
     setMessages([...newMessages, placeholderMessage]);
     try {
-      const result = await continueConversationFile(file, userId);
-      setMessages((prevMessages) => {
-        const updatedMessages = [...prevMessages];
-        updatedMessages[updatedMessages.length - 1] = { role: "assistant", content: result };
-        return updatedMessages;
-      });
+      const result = await streamConversationFile(
+        file,
+        {
+          // Show the transcript in place of the "[Voice message]" label
+          onMeta: (meta) => updateMessage(-2, () => meta.transcript || "[Voice message]"),
+          onToken: appendToken,
+        },
+        userId,
+      );
+      updateMessage(-1, () => result);
     } catch (error) {
       toast.error((error as Error).message);
       setMessages((prevMessages) => {
@@ -0,0 +1,187 @@
+# loadgen.py
+#
+# Closed-loop load generator for backend/api_server.py. Each virtual user
+# picks the next request from a weighted mix of /check-user, /text and
+# /voice, waits for the answer and goes again. Run it against a backend
+# whose LLM points at this mockserver (see README) to find where the backend
+# saturates:
+#
+#   python loadgen.py --target http://localhost:8000 --sweep 1 2 4 8 16 32 --duration 30
+#   python loadgen.py --concurrency 16 --mix check-user=1 text=6 voice=3 --out run.json
+
+import os
+import io
+import json
+import time
+import wave
+import random
+import asyncio
+import argparse
+import httpx
+import numpy as np
+
+TEXTS = [
+    "hi",
+    "I have had a headache since this morning",
+    "My throat is sore and I keep coughing at night",
+    "I feel much better today, thanks",
+    "What should I eat when I have a fever?",
+    "My back pain gets worse when I sit for long",
+    "I'm anxious about my blood test results",
+    "I couldn't sleep last night because of stomach cramps",
+]
+
+def parse_mix(items):
+    mix = {}
+    for item in items:
+        name, _, weight = item.partition("=")
+        mix[name] = float(weight or 1)
+    unknown = set(mix) - {"check-user", "text", "voice"}
+    if unknown:
+        raise SystemExit(f"Unknown request types in --mix: {', '.join(sorted(unknown))}")
+    return mix
+
+def synthetic_wav(seconds: float, sr: int = 16000) -> bytes:
+    """Speech-like harmonic signal with syllable envelope, as 16-bit WAV."""
+    t = np.arange(int(seconds * sr)) / sr
+    phase = 2 * np.pi * np.cumsum(120 + 30 * np.sin(2 * np.pi * 0.3 * t)) / sr
+    voiced = sum(np.sin(k * phase) / k for k in range(1, 8))
+    audio = 0.25 * voiced * np.clip(np.sin(2 * np.pi * 4 * t), 0, None) ** 0.5
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(sr)
+        w.writeframes((audio * 32767).astype(np.int16).tobytes())
+    return buf.getvalue()
+
+def load_audio(args):
+    """(filename, bytes, content type) clips used for /voice."""
+    clips = []
+    for path in args.audio or []:
+        with open(path, "rb") as f:
+            ext = os.path.splitext(path)[1].lower()
+            clips.append((os.path.basename(path), f.read(), "audio/webm" if ext == ".webm" else "audio/wav"))
+    if not clips:
+        clips = [(f"synthetic_{s:g}s.wav", synthetic_wav(s), "audio/wav") for s in args.audio_seconds]
+    return clips
+
+# --------- Requests ---------
+async def check_user(client, user_id, rng, clips):
+    return await client.post("/check-user", json={"user_id": user_id})
+
+async def text(client, user_id, rng, clips):
+    body = {"user_id": user_id, "messages": [{"role": "user", "content": rng.choice(TEXTS)}]}
+    return await client.post("/text", json=body)
+
+async def voice(client, user_id, rng, clips):
+    name, data, content_type = rng.choice(clips)
+    return await client.post("/voice", files={"file": (name, data, content_type)}, data={"user_id": user_id})
+
+REQUESTS = {"check-user": check_user, "text": text, "voice": voice}
+
+def summarize(samples, errors, statuses, wall):
+    out = {"ok": len(samples), "errors": errors, "statuses": statuses,
+           "throughput_rps": round(len(samples) / wall, 3) if wall else 0.0}
+    if samples:
+        arr = np.asarray(samples) * 1000
+        out.update({f"p{p}_ms": round(float(np.percentile(arr, p)), 1) for p in (50, 95, 99)})
+        out["mean_ms"] = round(float(arr.mean()), 1)
+    total = len(samples) + errors
+    out["error_rate"] = round(errors / total, 4) if total else 0.0
+    return out
+
+async def run_level(args, mix, clips, concurrency):
+    """Run `concurrency` virtual users for args.duration seconds."""
+    samples = {name: [] for name in mix}
+    errors = {name: 0 for name in mix}
+    statuses = {name: {} for name in mix}
+    names, weights = list(mix), list(mix.values())
+    deadline = time.perf_counter() + args.duration
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=args.target, timeout=args.timeout, limits=limits) as client:
+        async def user(n):
+            rng = random.Random(args.seed * 1000 + n)
+            user_id = f"load-{n % args.users}"
+            while time.perf_counter() < deadline:
+                name = rng.choices(names, weights)[0]
+                start = time.perf_counter()
+                try:
+                    r = await REQUESTS[name](client, user_id, rng, clips)
+                    code = str(r.status_code)
+                    ok = r.status_code < 400
+                except httpx.HTTPError as e:
+                    code, ok = type(e).__name__, False
+                statuses[name][code] = statuses[name].get(code, 0) + 1
+                if ok:
+                    samples[name].append(time.perf_counter() - start)
+                else:
+                    errors[name] += 1
+                if args.think_ms:
+                    await asyncio.sleep(rng.expovariate(1000 / args.think_ms))
+
+        start = time.perf_counter()
+        await asyncio.gather(*(user(n) for n in range(concurrency)))
+        wall = time.perf_counter() - start
+
+    per_type = {name: summarize(samples[name], errors[name], statuses[name], wall) for name in mix}
+    everything = [s for name in mix for s in samples[name]]
+    level = summarize(everything, sum(errors.values()), {}, wall)
+    level.pop("statuses")
+    level.update({"concurrency": concurrency, "wall_seconds": round(wall, 2), "requests": per_type})
+    return level
+
+def find_saturation(levels, min_gain=0.1):
+    """First concurrency level whose throughput grew by less than min_gain
+    over the previous level (more users only added queueing)."""
+    for prev, cur in zip(levels, levels[1:]):
+        if prev["throughput_rps"] and cur["throughput_rps"] < prev["throughput_rps"] * (1 + min_gain):
+            return prev["concurrency"]
+    return None
+
+async def main_async(args):
+    mix = parse_mix(args.mix)
+    clips = load_audio(args)
+    levels = []
+    for concurrency in args.sweep or [args.concurrency]:
+        level = await run_level(args, mix, clips, concurrency)
+        levels.append(level)
+        print(f"concurrency {concurrency:4d}  {level['throughput_rps']:8.2f} req/s  "
+              f"p50 {level.get('p50_ms', 0):8.1f} ms  p95 {level.get('p95_ms', 0):8.1f} ms  "
+              f"p99 {level.get('p99_ms', 0):8.1f} ms  errors {level['error_rate'] * 100:5.1f}%")
+        for name, r in level["requests"].items():
+            print(f"    {name:10s} {r['ok']:6d} ok  p50 {r.get('p50_ms', 0):8.1f} ms  "
+                  f"p95 {r.get('p95_ms', 0):8.1f} ms  statuses {r['statuses']}")
+        limited = sum(r["statuses"].get("429", 0) for r in level["requests"].values())
+        if limited:
+            print(f"    ⚠️ {limited} requests were rate-limited (429): this level measures the per-user limits, "
+                  f"not capacity. Set USER_RATE_PER_MINUTE=0 on the backend or raise --users")
+    result = {"target": args.target, "mix": mix, "duration": args.duration, "levels": levels}
+    if len(levels) > 1:
+        result["saturation_concurrency"] = find_saturation(levels)
+        print(f"Throughput stops scaling after concurrency {result['saturation_concurrency']}"
+              if result["saturation_concurrency"] else "No saturation within the sweep")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(result, f, indent=2)
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a /check-user, /text, /voice traffic mix against the backend")
+    parser.add_argument("--target", default="http://localhost:8000")
+    parser.add_argument("--concurrency", type=int, default=8, help="virtual users")
+    parser.add_argument("--sweep", type=int, nargs="*", help="run several concurrency levels in turn")
+    parser.add_argument("--duration", type=float, default=30, help="seconds per concurrency level")
+    parser.add_argument("--mix", nargs="*", default=["check-user=1", "text=6", "voice=3"], help="request weights")
+    parser.add_argument("--users", type=int, default=50, help="distinct user_ids to spread memory/profile load over "
+                        "(the backend rate-limits each one, see USER_RATE_PER_MINUTE)")
+    parser.add_argument("--audio", nargs="*", help="clips for /voice (wav/webm); defaults to synthetic speech")
+    parser.add_argument("--audio-seconds", type=float, nargs="*", default=[2, 6, 15])
+    parser.add_argument("--think-ms", type=float, default=0, help="mean pause between a user's requests")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="write JSON results here")
+    asyncio.run(main_async(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,15 @@
 #run uvicorn main:app --host 0.0.0.0 --port 8000
 from fastapi import FastAPI, UploadFile, File, Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 import shutil
 import os
+import re
+import json
+import time
+import uuid
+import random
+import asyncio
 
 app = FastAPI()
 
@@ -37,3 +43,154 @@ async def handle_audio(file: UploadFile = File(...)):
         shutil.copyfileobj(file.file, buffer)
 
     return {"answer": "Audio received"}
+
+
+# --------- Azure OpenAI chat-completions mock ---------
+# Point the backend at this server to load-test it without Azure:
+#   AZURE_OPENAI_ENDPOINT=http://localhost:8001 AZURE_OPENAI_API_KEY=mock
+# Latency, jitter, error rate and streaming speed come from the environment
+# and can be changed at runtime with POST /mock/config.
+mock_config = {
+    "latency_ms": float(os.getenv("MOCK_LLM_LATENCY_MS", "400")),
+    "jitter_ms": float(os.getenv("MOCK_LLM_JITTER_MS", "100")),
+    "error_rate": float(os.getenv("MOCK_LLM_ERROR_RATE", "0")),
+    "tokens_per_sec": float(os.getenv("MOCK_LLM_TOKENS_PER_SEC", "50")),
+}
+mock_stats = {"requests": 0, "errors": 0, "streamed": 0, "in_flight": 0}
+
+REPLY = (
+    "I'm sorry you're not feeling well. Try to rest, drink plenty of fluids and keep an eye on your "
+    "temperature. If the symptoms get worse or last more than a few days, please see a doctor."
+)
+CONDITIONS = ["headache", "fever"]
+SUMMARY = "The user reported a headache and fever; the assistant advised rest and fluids."
+
+@app.get("/mock/config")
+async def get_mock_config():
+    return {"config": mock_config, "stats": mock_stats}
+
+@app.post("/mock/config")
+async def set_mock_config(request: Request):
+    updates = await request.json()
+    for key, value in updates.items():
+        if key in mock_config:
+            mock_config[key] = float(value)
+    return {"config": mock_config}
+
+def _prompt_text(messages):
+    parts = []
+    for m in messages:
+        content = m.get("content") or ""
+        if isinstance(content, list):
+            content = " ".join(c.get("text", "") for c in content if isinstance(c, dict))
+        parts.append(content)
+    return "\n".join(parts)
+
+def _numbered_indexes(prompt):
+    return [int(n) for n in re.findall(r'^(\d+)\. "', prompt, flags=re.M)] or [1]
+
+def _structured_answer(properties, prompt):
+    """Fill a JSON schema's top-level properties the way the backend's
+    schemas expect (reply / conditions / results)."""
+    answer = {}
+    for name in properties:
+        if name == "reply":
+            answer[name] = REPLY
+        elif name == "conditions":
+            answer[name] = CONDITIONS
+        elif name == "results":
+            answer[name] = [{"index": i, "conditions": CONDITIONS} for i in _numbered_indexes(prompt)]
+        else:
+            answer[name] = ""
+    return answer
+
+def _completion(body):
+    """(content, tool_calls) for a chat-completions request."""
+    prompt = _prompt_text(body.get("messages", []))
+    tools = body.get("tools") or []
+    if tools:
+        fn = tools[0]["function"]
+        args = _structured_answer(fn.get("parameters", {}).get("properties", {}), prompt)
+        call = {"id": f"call_{uuid.uuid4().hex[:12]}", "type": "function",
+                "function": {"name": fn["name"], "arguments": json.dumps(args)}}
+        return None, [call]
+    if '{"reply"' in prompt:
+        return json.dumps({"reply": REPLY, "conditions": CONDITIONS}), None
+    if '{"results"' in prompt:
+        return json.dumps(_structured_answer(["results"], prompt)), None
+    if '{"conditions"' in prompt:
+        return json.dumps({"conditions": CONDITIONS}), None
+    if "Updated summary:" in prompt:
+        return SUMMARY, None
+    return REPLY, None
+
+def _usage(body, content, tool_calls):
+    prompt_tokens = len(_prompt_text(body.get("messages", []))) // 4
+    completion_tokens = len(content or json.dumps(tool_calls)) // 4
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens}
+
+def _error_response():
+    if random.random() < 0.5:
+        return JSONResponse(status_code=429, headers={"Retry-After": "1"},
+                            content={"error": {"code": "429", "message": "Rate limit exceeded (mock)"}})
+    return JSONResponse(status_code=500, content={"error": {"code": "500", "message": "Internal error (mock)"}})
+
+@app.post("/openai/deployments/{deployment}/chat/completions")
+async def chat_completions(deployment: str, request: Request):
+    body = await request.json()
+    mock_stats["requests"] += 1
+    mock_stats["in_flight"] += 1
+    try:
+        delay = max(0.0, mock_config["latency_ms"] + random.uniform(-1, 1) * mock_config["jitter_ms"]) / 1000
+        await asyncio.sleep(delay)
+        if random.random() < mock_config["error_rate"]:
+            mock_stats["errors"] += 1
+            return _error_response()
+
+        content, tool_calls = _completion(body)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        created = int(time.time())
+        if body.get("stream"):
+            mock_stats["streamed"] += 1
+            return StreamingResponse(
+                _stream_chunks(body, completion_id, created, deployment, content, tool_calls),
+                media_type="text/event-stream",
+            )
+        message = {"role": "assistant", "content": content}
+        if tool_calls:
+            message["tool_calls"] = tool_calls
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": deployment,
+            "choices": [{"index": 0, "message": message, "finish_reason": "tool_calls" if tool_calls else "stop"}],
+            "usage": _usage(body, content, tool_calls),
+        }
+    finally:
+        mock_stats["in_flight"] -= 1
+
+async def _stream_chunks(body, completion_id, created, deployment, content, tool_calls):
+    def chunk(delta, finish_reason=None, usage=None):
+        payload = {
+            "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": deployment,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+        if usage is not None:
+            payload["usage"] = usage
+        return f"data: {json.dumps(payload)}\n\n"
+
+    yield chunk({"role": "assistant", "content": ""})
+    interval = 1 / mock_config["tokens_per_sec"] if mock_config["tokens_per_sec"] > 0 else 0
+    if tool_calls:
+        call = tool_calls[0]
+        yield chunk({"tool_calls": [{"index": 0, "id": call["id"], "type": "function",
+                                     "function": {"name": call["function"]["name"], "arguments": call["function"]["arguments"]}}]})
+    else:
+        for word in re.findall(r"\S+\s*", content):
+            await asyncio.sleep(interval)
+            yield chunk({"content": word})
+    usage = _usage(body, content, tool_calls) if body.get("stream_options", {}).get("include_usage") else None
+    yield chunk({}, finish_reason="tool_calls" if tool_calls else "stop", usage=usage)
+    yield "data: [DONE]\n\n"